@@ -0,0 +1,221 @@
+"""
+run_bench.py times the flight readers, model_utils, grid mapping and plotting on synthetic files, tracks their peak
+memory, and compares the results with a stored baseline. Run it from the repository root:
+
+    python bench/run_bench.py                    # run, and compare with bench/baseline.json if it exists
+    python bench/run_bench.py --save-baseline    # run, and store the results as the new baseline
+    python bench/run_bench.py --size large -k read
+
+It exits with status 1 if any benchmark regressed, i.e. got slower or used more memory than its baseline by more than
+the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import pathlib as path
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import netCDF4
+import numpy as np
+
+sys.path.append(str(path.Path(__file__).resolve().parents[1]))
+import util.flight_utils as flight_utils
+import util.model_utils as model_utils
+import util.mapping_utils as mapping_utils
+import util.plot_utils as plot_utils
+import util.synthetic_utils as synthetic_utils
+
+# the basemap tiles are never fetched here
+warnings.filterwarnings('ignore', message='CartoDB tiles')
+
+# flight length (s), number of high rate variables, CAM (ntimes, nlev, nlat, nlon) and number of plotted flights
+sizes = {'small': {'duration': 1800, 'n_hr_vars': 6, 'cam': (2, 32, 96, 144), 'n_flights': 10},
+         'large': {'duration': 8*3600, 'n_hr_vars': 12, 'cam': (8, 58, 192, 288), 'n_flights': 40}}
+
+def make_fixtures(work_dir: path.Path, size: str) -> dict:
+    """
+    make_fixtures writes the synthetic files the benchmarks run on, and reads the inputs they share.
+    """
+    params = sizes[size]
+    fixtures = {'flight_1hz': str(work_dir / 'flight_1hz.nc'), 'flight_25hz': str(work_dir / 'flight_25hz.nc'),
+                'cam': str(work_dir / 'cam.nc')}
+    synthetic_utils.write_flight_nc(fixtures['flight_1hz'], params['duration'], hz=1, n_hr_vars=params['n_hr_vars'])
+    synthetic_utils.write_flight_nc(fixtures['flight_25hz'], params['duration'], hz=25, n_hr_vars=params['n_hr_vars'])
+    ntimes, nlev, nlat, nlon = params['cam']
+    synthetic_utils.write_cam_nc(fixtures['cam'], ntimes, nlev, nlat, nlon)
+
+    fixtures['read_vars'] = ['Time','GGLAT','GGLON','GGALT','LATC','LONC','UIC','VIC','WIC','ATX','PSFC','EWX']
+    with flight_utils.open_flight_nc(fixtures['flight_1hz']) as nc:
+        fixtures['sfm'] = nc['Time'][:]
+        fixtures['tunits'] = nc['Time'].units
+    with flight_utils.open_flight_nc(fixtures['cam']) as nc:
+        fixtures['cam_fields'] = {name: np.ma.filled(nc[name][:], np.nan)
+                                  for name in ['hyai','hybi','P0','PS','PHIS','T','Q','lat','lon']}
+        fixtures['cam_times'] = mapping_utils.to_datetime64(netCDF4.num2date(nc['time'][:], nc['time'].units,
+                                                                             nc['time'].calendar))
+    f = fixtures['cam_fields']
+    fixtures['zi'] = model_utils.calc_phii_hydro_cesm(f['PS'], f['P0'], f['hyai'], f['hybi'], f['T'], f['Q'], f['PHIS'])
+    fixtures['df_25hz'] = flight_utils.read_flight_file(fixtures['flight_25hz'], ['Time','GGLAT','GGLON','GGALT'])
+    # put the flight within the model times
+    fixtures['df_25hz']['datetime'] = fixtures['cam_times'][0] + (fixtures['df_25hz']['datetime'].to_numpy()
+                                                                  - fixtures['df_25hz']['datetime'].to_numpy()[0])
+    # a campaign directory of copies of the 25 Hz flight, for the multi-flight drivers
+    fixtures['data_dir'] = str(work_dir / 'data')
+    (work_dir / 'data' / 'C0' / 'lrt').mkdir(parents=True)
+    for k in range(4):
+        (work_dir / 'data' / 'C0' / 'lrt' / f'rf{k+1:02d}.nc').symlink_to(fixtures['flight_25hz'])
+    df_1hz = flight_utils.read_flight_file(fixtures['flight_1hz'], ['Time','GGLAT','GGLON'])
+    fixtures['campaigns'] = {f'C{c}': {f'rf{k:02d}.nc': df_1hz for k in range(params['n_flights']//4)}
+                             for c in range(4)}
+    return fixtures
+
+def bench_read_flight_nc_1hz(fx):
+    with flight_utils.open_flight_nc(fx['flight_1hz']) as nc:
+        flight_utils.read_flight_nc_1hz(nc, fx['read_vars'])
+
+def bench_read_flight_nc_25hz(fx):
+    with flight_utils.open_flight_nc(fx['flight_25hz']) as nc:
+        flight_utils.read_flight_nc_25hz(nc, fx['read_vars'])
+
+def bench_sfm_to_datetime(fx):
+    flight_utils.sfm_to_datetime(fx['sfm'], fx['tunits'])
+
+def bench_sfm_to_datetime64(fx):
+    flight_utils.sfm_to_datetime64(fx['sfm'], fx['tunits'])
+
+def bench_calc_pressure_cesm(fx):
+    f = fx['cam_fields']
+    model_utils.calc_pressure_cesm(f['PS'], f['P0'], f['hyai'], f['hybi'])
+
+def bench_calc_phii_hydro(fx):
+    # the unfused chain: interface and level pressures, moist air density, then the hydrostatic integration
+    f = fx['cam_fields']
+    pi = model_utils.calc_pressure_cesm(f['PS'], f['P0'], f['hyai'], f['hybi'])
+    pm = 0.5*(pi[:,1:] + pi[:,:-1])
+    rhom = model_utils.calc_rhom(pm, f['T'][:,::-1], f['Q'][:,::-1])
+    model_utils.calc_phii_hydro(f['PHIS'][0]/model_utils.g, rhom, pi)
+
+def bench_calc_phii_hydro_cesm(fx):
+    f = fx['cam_fields']
+    model_utils.calc_phii_hydro_cesm(f['PS'], f['P0'], f['hyai'], f['hybi'], f['T'], f['Q'], f['PHIS'])
+
+def bench_map_flight_to_grid(fx):
+    f = fx['cam_fields']
+    mapping_utils.map_flight_to_grid(fx['df_25hz'], f['lat'], f['lon'], fx['zi'], fx['cam_times'])
+
+def bench_plot_campaigns(fx):
+    from bokeh.embed import json_item
+    json_item(plot_utils.plot_campaigns(fx['campaigns'], show_plot=False))
+
+def bench_plot_campaigns_simplified(fx):
+    from bokeh.embed import json_item
+    json_item(plot_utils.plot_campaigns(fx['campaigns'], show_plot=False, simplify_px=0.5))
+
+def bench_plot_campaigns_raster(fx):
+    from bokeh.embed import json_item
+    json_item(plot_utils.plot_campaigns(fx['campaigns'], show_plot=False, render='raster'))
+
+def bench_plot_flight_files_serial(fx):
+    # read every flight, then project and plot them
+    with contextlib.redirect_stdout(io.StringIO()):
+        flights = flight_utils.read_all_flights(fx['data_dir'], ['C0'], ['Time','GGLAT','GGLON'])
+        plot_utils.plot_campaigns(flights, show_plot=False, render='raster')
+
+def bench_plot_flight_files_prefetch(fx):
+    # project each flight while the next ones are read
+    with contextlib.redirect_stdout(io.StringIO()):
+        flights = flight_utils.iter_flights(fx['data_dir'], ['C0'], ['Time','GGLAT','GGLON'], prefetch=2)
+        plot_utils.plot_campaigns(flights, show_plot=False, render='raster')
+
+benchmarks = {name[len('bench_'):]: func for (name, func) in list(globals().items()) if name.startswith('bench_')}
+
+def run_benchmark(func, fixtures: dict, repeat: int) -> dict:
+    """
+    run_benchmark times a benchmark, taking the best of repeat runs, and measures its peak traced memory in one more
+                  run (tracing slows things down, so it is not timed). Memory allocated by numpy is traced, but memory
+                  allocated inside the netCDF/HDF5 C libraries is not.
+
+    :return: Returns a dictionary of the time in seconds and the peak memory in bytes.
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(fixtures)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func(fixtures)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'time_s': min(times), 'peak_bytes': peak}
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    compare finds the benchmarks that got slower, or used more memory, than their baseline by more than a fraction
+            tolerance.
+
+    :return: Returns a list of messages, one per regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ['time_s', 'peak_bytes']:
+            ratio = result[metric]/baseline[name][metric] if baseline[name][metric] > 0 else 1.
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name}: {metric} {baseline[name][metric]:.4g} -> {result[metric]:.4g} "
+                                   f"({ratio:.2f}x)")
+    return regressions
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=sizes, default='small', help="the size of the synthetic files")
+    parser.add_argument('--repeat', type=int, default=3, help="the number of timed runs of each benchmark")
+    parser.add_argument('-k', dest='select', default='', help="only run benchmarks whose names contain this")
+    parser.add_argument('--baseline', default=str(path.Path(__file__).parent / 'baseline.json'),
+                        help="the baseline file to compare with or save to")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="the fraction a time or peak memory may grow by before it is a regression")
+    parser.add_argument('--output', help="a file to also write the results to, as json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"writing {args.size} synthetic files")
+        fixtures = make_fixtures(path.Path(work_dir), args.size)
+        results = {}
+        for name, func in benchmarks.items():
+            if args.select not in name:
+                continue
+            results[name] = run_benchmark(func, fixtures, args.repeat)
+            print(f"{name:32s} {results[name]['time_s']*1e3:10.1f} ms {results[name]['peak_bytes']/2**20:10.1f} MiB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    # baselines are kept per size, since the sizes run on different files
+    baseline_path = path.Path(args.baseline)
+    stored = json.loads(baseline_path.read_text()) if baseline_path.is_file() else {}
+    if args.save_baseline:
+        stored[args.size] = dict(stored.get(args.size, {}), **results)
+        baseline_path.write_text(json.dumps(stored, indent=1))
+        print(f"saved baseline to {baseline_path}")
+        return 0
+    if args.size not in stored:
+        print(f"no {args.size} baseline in {baseline_path} to compare with")
+        return 0
+    regressions = compare(results, stored[args.size], args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not regressions:
+        print(f"no regressions against {baseline_path}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import sys
+sys.path.append('..')
+import util.synthetic_utils as synthetic_utils
+import pytest
+
+@pytest.fixture(scope='session')
+def flight_25hz_path(tmp_path_factory) -> str:
+    # a 10 minute, 25 Hz flight with LATC/LONC positions (but no GGLAT/GGLON) and winds, written once per session
+    file_path = str(tmp_path_factory.mktemp('data') / 'test_flight_25hz.nc')
+    synthetic_utils.write_flight_nc(file_path, duration=600, hz=25, n_hr_vars=3, gps=False)
+    return file_path
+
+@pytest.fixture(scope='session')
+def cam_ll_path(tmp_path_factory) -> str:
+    # two output times of CAM fields, Z3 included, on a 32 level, 192 by 288 lat/lon grid
+    file_path = str(tmp_path_factory.mktemp('data') / 'test_ll.nc')
+    synthetic_utils.write_cam_nc(file_path, ntimes=2, nlev=32, nlat=192, nlon=288)
+    return file_path
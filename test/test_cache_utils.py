@@ -0,0 +1,102 @@
+import sys
+sys.path.append('..')
+import util.flight_utils as utils
+import util.cache_utils as cache_utils
+import util.mapping_utils as mapping_utils
+import numpy as np
+import pandas as pd
+import shutil
+
+file_path = "./test_flight_1hz.nc"
+
+def test_flight_cache(tmp_path):
+    cache = cache_utils.flight_cache(str(tmp_path / "cache"))
+    nc = utils.open_flight_nc(file_path)
+
+    # a cold read decodes from the file and fills the cache
+    read_vars = ['Time','LATC','LONC','GGLAT']
+    df_cold = utils.read_flight_nc(nc, read_vars, cache)
+    pd.testing.assert_frame_equal(df_cold, utils.read_flight_nc(nc, read_vars))
+    columns, to_read = cache.load(file_path, 1, read_vars)
+    assert sorted(columns.keys()) == ['LATC','LONC','Time','datetime']
+    assert to_read == [] # GGLAT is remembered as absent from the file
+
+    # a warm read gives the same frame
+    pd.testing.assert_frame_equal(utils.read_flight_nc(nc, read_vars, cache), df_cold)
+
+    # a new variable is added to the existing entry, the cached ones are not decoded again
+    columns, to_read = cache.load(file_path, 1, ['LATC','WIC'])
+    assert list(columns.keys()) == ['LATC'] and to_read == ['WIC']
+    df = utils.read_flight_nc(nc, ['WIC','LATC'], cache)
+    assert list(df.keys()) == ['WIC','LATC']
+    assert cache.load(file_path, 1, ['LATC','WIC'])[1] == []
+
+    # invalidating the file removes its entry
+    cache.invalidate(file_path)
+    assert cache.load(file_path, 1, read_vars) == ({}, read_vars)
+
+def test_flight_cache_eviction(tmp_path):
+    # copy the test file under two names so there are two cache entries
+    for name in ["rf01.nc", "rf02.nc"]:
+        shutil.copy(file_path, tmp_path / name)
+    cache = cache_utils.flight_cache(str(tmp_path / "cache"))
+
+    utils.read_flight_file(str(tmp_path / "rf01.nc"), ['Time','LATC'], cache)
+    one_entry = cache.size()
+    cache.max_bytes = int(1.5*one_entry)
+    utils.read_flight_file(str(tmp_path / "rf02.nc"), ['Time','LATC'], cache)
+
+    # the least recently used entry, rf01, was evicted
+    assert cache.size() == one_entry
+    assert cache.load(str(tmp_path / "rf01.nc"), 1, ['LATC'])[1] == ['LATC']
+    assert cache.load(str(tmp_path / "rf02.nc"), 1, ['LATC'])[1] == []
+
+    # writes under the cap keep a running size instead of listing every entry
+    listed = []
+    entries = cache._entries
+    cache._entries = lambda: listed.append(1) or entries()
+    cache.max_bytes = 10*one_entry
+    utils.read_flight_file(str(tmp_path / "rf01.nc"), ['Time','LATC'], cache)
+    assert listed == [] and cache._size == cache.size() == 2*one_entry
+
+def test_mapping_cache(tmp_path):
+    cache = cache_utils.mapping_cache(str(tmp_path / "cache"))
+    df = utils.read_flight_file(file_path, ['Time','LATC','LONC','GGALT'])
+    lats = np.linspace(-90., 90., 37)
+    lons = np.arange(72)*5.
+    zi = np.broadcast_to(np.linspace(0., 20000., 11)[None,:,None,None], (1,11,37,72)).copy()
+    grid_hash = cache_utils.calc_grid_hash(lats, lons, hyai=np.zeros(11), hybi=np.linspace(0, 1, 11))
+    assert grid_hash != cache_utils.calc_grid_hash(lats, lons, hyai=np.zeros(11), hybi=np.linspace(0, 1, 11),
+                                                   method='midpoint')
+
+    # a miss computes and stores the cells, a hit returns them without computing
+    calls = []
+    def compute(df):
+        calls.append(1)
+        return mapping_utils.map_flight_to_grid(df, lats, lons, zi)
+    cells = cache.cells(df, file_path, 1, grid_hash, compute)
+    assert cells['valid'].any()
+    pd.testing.assert_frame_equal(cache.cells(df, file_path, 1, grid_hash, compute), cells)
+    assert len(calls) == 1
+    # another grid misses, and so does another window of the same length
+    assert cache.load_cells(file_path, 1, grid_hash[::-1], df) is None
+    assert cache.load_cells(file_path, 1, grid_hash, df.iloc[:100]) is None
+    assert cache.load_cells(file_path, 1, grid_hash, df.iloc[1:101]) is None
+    cache.store_cells(file_path, 1, grid_hash, df.iloc[:100], cells.iloc[:100])
+    assert cache.load_cells(file_path, 1, grid_hash, df.iloc[1:101]) is None
+    pd.testing.assert_frame_equal(cache.load_cells(file_path, 1, grid_hash, df.iloc[:100]), cells.iloc[:100])
+    # the inherited column cache still works
+    cache.store(file_path, 1, {'LATC': df['LATC'].to_numpy()})
+    assert list(cache.load(file_path, 1, ['LATC'])[0]) == ['LATC']
+
+    # interpolation weights round trip, at float32 precision
+    weights = mapping_utils.interp_weights(df, lats, lons, zi)
+    cache.store_weights(file_path, 1, grid_hash, df, weights)
+    loaded = cache.load_weights(file_path, 1, grid_hash, df)
+    field = np.random.default_rng(0).random((1,10,37,72))
+    assert np.array_equal(loaded.valid, weights.valid) and np.array_equal(loaded.flat, weights.flat)
+    assert np.allclose(loaded.sample(field), weights.sample(field), equal_nan=True)
+    assert np.allclose(loaded.sample(field[:,0]), weights.sample(field[:,0]), equal_nan=True)
+    # both live in the flight's entry for the grid, with compact flat indices
+    entry = cache._grid_key(file_path, 1, grid_hash, df)[0]
+    assert np.load(tmp_path / "cache" / entry / "interp_flat.npy").dtype == np.int32
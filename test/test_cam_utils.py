@@ -0,0 +1,133 @@
+import sys
+sys.path.append('..')
+import util.cam_utils as utils
+import util.mapping_utils as mapping_utils
+import util.model_utils as model_utils
+import util.synthetic_utils as synthetic_utils
+import pandas as pd
+import numpy as np
+import xarray as xr
+
+def make_flight(start: str, lat0: float, lon0: float, n: int = 3600) -> pd.DataFrame:
+    # a flight heading east-northeast, climbing to 8 km
+    t = np.arange(n)
+    return pd.DataFrame({'datetime': np.datetime64(start, 'ns') + t.astype('timedelta64[s]'),
+                         'GGLAT': lat0 + 2e-3*t, 'GGLON': lon0 + 4e-3*t, 'GGALT': 8000.*t/n})
+
+def test_find_footprint():
+    lats = np.linspace(-90., 90., 19)
+    lons = np.arange(36)*10.
+    model_times = np.array(['2018-01-01T00','2018-01-01T06','2018-01-01T12'], dtype='datetime64[ns]')
+    # a flight from 172E across the dateline to 174W, between the first two output times
+    df = make_flight('2018-01-01T01', 0., 172., 3600)
+    footprint = utils.find_footprint([df], lats, lons, model_times, halo=1)
+    assert np.array_equal(footprint['time'], [0, 1])
+    assert np.array_equal(footprint['lat'], [8, 9, 10, 11])
+    assert np.array_equal(footprint['lon'], [16, 17, 18, 19, 20])
+    # a flight across the 0/360 seam of the model grid wraps around it
+    df = make_flight('2018-01-01T01', 0., -8., 3600)
+    footprint = utils.find_footprint([df], lats, lons, model_times, halo=1)
+    assert np.array_equal(footprint['lon'], [34, 35, 0, 1, 2])
+
+def test_cam_subset(tmp_path):
+    synthetic_utils.write_cam_nc(str(tmp_path / 'cam.nc'), ntimes=4, nlev=10, nlat=48, nlon=96)
+    dfs = [make_flight('2018-01-01T02', -10., -3.), make_flight('2018-01-01T07', 20., 30.)]
+    subset = utils.cam_subset(dfs, str(tmp_path / 'cam.nc'))
+
+    # only the footprint is read
+    assert subset.ds.sizes['time'] == 3 and subset.ds.sizes['lon'] < 24 and subset.ds.sizes['lat'] < 20
+    assert subset.zi.shape == (3, 11, subset.ds.sizes['lat'], subset.ds.sizes['lon'])
+
+    # and maps flights to the same cells as the whole grid does
+    with xr.open_dataset(tmp_path / 'cam.nc') as ds:
+        zi = model_utils.calc_phii_hydro_cesm(ds.PS.values, ds.P0.values, ds.hyai.values, ds.hybi.values,
+                                              ds.T.values, ds.Q.values, ds.PHIS.values, ds.hyam.values, ds.hybm.values)
+        for df in dfs:
+            expected = mapping_utils.map_flight_to_grid(df, ds.lat.values, ds.lon.values, zi, ds.time.values)
+            pd.testing.assert_frame_equal(subset.map_flight(df), expected)
+            assert expected['valid'].mean() > 0.5
+
+def test_cam_catalog(tmp_path):
+    # three files of a day of 6-hourly output each, and a file of another stream that the pattern leaves out
+    for k in range(3):
+        synthetic_utils.write_cam_nc(str(tmp_path / f'run.cam.h1.2018-01-0{k+1}.nc'), ntimes=4, nlev=10, nlat=48,
+                                     nlon=96, start=f'2018-01-0{k+1} 00:00:00', seed=k)
+    synthetic_utils.write_cam_nc(str(tmp_path / 'run.cam.h0.2018-01.nc'), ntimes=1, nlev=10, nlat=48, nlon=96)
+
+    catalog = utils.cam_catalog(max_open=2)
+    assert catalog.scan(str(tmp_path), '*.cam.h1.*.nc') == {}
+    assert len(catalog) == 12 and np.all(np.diff(catalog.times) == np.timedelta64(6, 'h'))
+    assert catalog.coords['lat'].shape == (48,) and 'hyai' in catalog.coords
+
+    # a flight late on the first day is bracketed by 18Z and the next day's 00Z, in two files
+    rows = catalog.bracket('2018-01-01T19', '2018-01-01T21')
+    assert list(rows['time']) == [pd.Timestamp('2018-01-01T18'), pd.Timestamp('2018-01-02T00')]
+    assert list(rows['record']) == [3, 0] and rows['file_path'].nunique() == 2
+    assert len(catalog.bracket('2019-01-01', '2019-01-02')) == 0
+
+    df = make_flight('2018-01-01T19', -10., 20., 3600)
+    subset = catalog.subset([df])
+    assert list(subset.model_times) == list(rows['time'])
+    # the same cells as mapping on the two records joined by hand
+    ds = xr.concat([xr.open_dataset(fp).isel(time=[k]) for (fp, k) in zip(rows['file_path'], rows['record'])],
+                   dim='time', data_vars='minimal', coords='minimal', compat='override')
+    cells = utils.cam_subset([df], ds).map_flight(df)
+    pd.testing.assert_frame_equal(subset.map_flight(df), cells)
+
+    # a range over several files, even more than the pool holds, is loaded file by file, so no closed file is used
+    # (and reopened), while a range within a file stays lazy
+    small = utils.cam_catalog(max_open=1)
+    small.scan(str(tmp_path), '*.cam.h1.*.nc')
+    joined = small.open_range('2018-01-01T01', '2018-01-03T01', ['T'])
+    assert len(small._pool) == 1 and joined.sizes['time'] == 10
+    assert all(joined[name].variable._in_memory for name in joined.variables)
+    assert 'Q' not in joined and 'hyai' in joined
+    large = utils.cam_catalog(max_open=8)
+    large.scan(str(tmp_path), '*.cam.h1.*.nc')
+    assert np.array_equal(joined['T'].values, large.open_range('2018-01-01T01', '2018-01-03T01')['T'].values)
+    assert not large.open_range('2018-01-01T01', '2018-01-01T07')['T'].variable._in_memory
+    subset = small.subset([df])
+    pd.testing.assert_frame_equal(subset.map_flight(df), cells)
+
+    # the pool stays bounded, least recently used out first
+    for fp in sorted(set(catalog.index['file_path'])):
+        catalog.open(fp)
+    assert len(catalog._pool) == 2 and list(catalog._pool)[-1].endswith('2018-01-03.nc')
+
+    # a saved catalog finds the same records without rescanning, and rescans only changed files
+    catalog.save(str(tmp_path / 'catalog.json'))
+    catalog.close()
+    loaded = utils.cam_catalog.load(str(tmp_path / 'catalog.json'))
+    pd.testing.assert_frame_equal(loaded.index, catalog.index)
+    assert np.array_equal(loaded.coords['hybi'], catalog.coords['hybi'])
+    assert all(loaded.is_current(fp) for fp in loaded.index['file_path'])
+    (tmp_path / 'run.cam.h1.2018-01-03.nc').unlink()
+    assert loaded.scan(str(tmp_path), '*.cam.h1.*.nc') == {} and len(loaded) == 8
+
+    # the only file of a catalog may change grid when rewritten, and an emptied catalog forgets its grid
+    single = tmp_path / 'single'
+    single.mkdir()
+    synthetic_utils.write_cam_nc(str(single / 'cam.nc'), ntimes=1, nlev=10, nlat=48, nlon=96)
+    catalog = utils.cam_catalog()
+    assert catalog.scan(str(single)) == {}
+    synthetic_utils.write_cam_nc(str(single / 'cam.nc'), ntimes=2, nlev=10, nlat=24, nlon=48)
+    assert catalog.scan(str(single)) == {}
+    assert len(catalog) == 2 and catalog.coords['lat'].shape == (24,)
+    (single / 'cam.nc').unlink()
+    assert catalog.scan(str(single)) == {} and catalog.coords is None
+
+def test_cam_subset_interp_weights(tmp_path):
+    synthetic_utils.write_cam_nc(str(tmp_path / 'cam.nc'), ntimes=4, nlev=10, nlat=48, nlon=96)
+    # a flight across the 0/360 seam
+    df = make_flight('2018-01-01T02', -10., -3.)
+    subset = utils.cam_subset([df], str(tmp_path / 'cam.nc'))
+    sampled = subset.interp_weights(df).sample_dataset(subset.ds, ['T','PS','PHIS'])
+
+    # the same as interpolating on the whole grid
+    with xr.open_dataset(str(tmp_path / 'cam.nc')) as ds:
+        zi = model_utils.calc_phii_hydro_cesm(ds.PS.values, ds.P0.values, ds.hyai.values, ds.hybi.values,
+                                              ds.T.values, ds.Q.values, ds.PHIS.values, ds.hyam.values, ds.hybm.values)
+        weights = mapping_utils.interp_weights(df, ds.lat.values, ds.lon.values, zi, ds.time.values)
+        expected = weights.sample_dataset(ds, ['T','PS','PHIS'])
+    assert weights.valid.mean() > 0.9
+    pd.testing.assert_frame_equal(sampled, expected)
@@ -0,0 +1,60 @@
+import sys
+sys.path.append('..')
+import util.catalog_utils as utils
+import netCDF4
+import shutil
+import numpy as np
+
+def write_test_flight(file_path: str, start: int, lats: np.ndarray, lons: np.ndarray):
+    # write a small synthetic 1 Hz file with a track through the given positions
+    with netCDF4.Dataset(file_path, 'w') as nc:
+        nc.createDimension('Time', len(lats))
+        time = nc.createVariable('Time', 'i4', ('Time',))
+        time.units = 'seconds since 2018-01-15 00:00:00 +0000'
+        time[:] = np.arange(len(lats)) + start
+        nc.createVariable('LATC', 'f4', ('Time',))[:] = lats
+        nc.createVariable('LONC', 'f4', ('Time',))[:] = lons
+
+def test_lon_bounds():
+    assert utils.calc_lon_bounds([-10., 10., 0.]) == (-10., 10.)
+    # crossing the dateline
+    assert utils.calc_lon_bounds([170., -170., 175., 185.]) == (170., -170.)
+    assert np.all(np.isnan(utils.calc_lon_bounds([np.nan])))
+
+def test_flight_catalog(tmp_path):
+    lrt = tmp_path / 'CAMPAIGN' / 'lrt'
+    lrt.mkdir(parents=True)
+    # a flight across the dateline on the first day, one near Greenwich on the second, and the SOCRATES test flight
+    write_test_flight(str(lrt / 'rf01.nc'), 0, np.linspace(-30., -20., 100), np.linspace(170., 190., 100))
+    write_test_flight(str(lrt / 'rf02.nc'), 86400, np.linspace(40., 50., 100), np.linspace(-5., 5., 100))
+    shutil.copy('test_flight_1hz.nc', lrt / 'rf03.nc')
+    (lrt / 'rf04.nc').write_text('not a netcdf file')
+
+    catalog = utils.flight_catalog()
+    errors = catalog.build(str(tmp_path), ['CAMPAIGN','MISSING'])
+    assert len(catalog) == 3
+    assert set(errors) == {str(tmp_path / 'MISSING' / 'lrt'), str(lrt / 'rf04.nc')}
+    entry = catalog.entries.set_index('fname').loc['rf01.nc']
+    assert (entry['lon_min'], entry['lon_max']) == (170., -170.)
+    assert entry['campaign'] == 'CAMPAIGN' and entry['rate'] == 1
+    # files are keyed by their resolved path, so adding one again through another path replaces its entry
+    catalog.add_file(str(tmp_path / 'CAMPAIGN' / '..' / 'CAMPAIGN' / 'lrt' / 'rf01.nc'), 'CAMPAIGN')
+    assert len(catalog) == 3 and str((lrt / 'rf01.nc').resolve()) in set(catalog.entries['file_path'])
+
+    # region queries, including one across the dateline
+    assert list(catalog.query(-35., -15., 175., -175.)['fname']) == ['rf01.nc']
+    assert list(catalog.query(-35., -15., 100., 160.)['fname']) == []
+    assert list(catalog.query(lon_min=-10., lon_max=10.)['fname']) == ['rf02.nc']
+    assert list(catalog.query(-65., -40., 140., 150.)['fname']) == ['rf03.nc']
+
+    # time queries, alone and with a region
+    assert list(catalog.query()['fname']) == ['rf01.nc', 'rf02.nc', 'rf03.nc']
+    assert list(catalog.query(start='2018-01-16', end='2018-01-17')['fname']) == ['rf02.nc']
+    assert list(catalog.query(end='2018-01-15T00:00:30')['fname']) == ['rf01.nc']
+    assert list(catalog.query(lat_min=0., start='2018-01-15', end='2018-01-15T12:00')['fname']) == []
+
+    # the catalog round trips through JSON
+    catalog.save(str(tmp_path / 'catalog.json'))
+    loaded = utils.flight_catalog.load(str(tmp_path / 'catalog.json'))
+    assert loaded.entries.equals(catalog.entries)
+    assert list(loaded.query(-35., -15., 175., -175.)['fname']) == ['rf01.nc']
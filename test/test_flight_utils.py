@@ -2,27 +2,29 @@ import sys
 sys.path.append('..')
 import util.flight_utils as utils
 import pytest
+import pathlib as path
 import numpy as np
+import pandas as pd
+import netCDF4
+import time
 from datetime import datetime
 
-def test_open_nc():
+def test_open_nc(flight_25hz_path):
     # test bad file path, check that FileNotFoundError results
     file_path = "./test_fligt_25hz.nc"
     with pytest.raises(FileNotFoundError):
         utils.open_flight_nc(file_path)
 
     # now test where file exists
-    file_path = "./test_flight_25hz.nc"
-    assert utils.open_flight_nc(file_path)
+    assert utils.open_flight_nc(flight_25hz_path)
     
-def test_read_nc():
+def test_read_nc(flight_25hz_path):
     vars_to_read = ['Time','GGALT','LATC','LONC','UIC','VIC','WIC']
 
     # open up the netcdf files
     file_path_1hz = "./test_flight_1hz.nc"
-    file_path_25hz = "./test_flight_25hz.nc"
     nc_1hz = utils.open_flight_nc(file_path_1hz)
-    nc_25hz = utils.open_flight_nc(file_path_25hz)
+    nc_25hz = utils.open_flight_nc(flight_25hz_path)
 
     # test individual read functions for 1 hz and 25 hz files
     #    only tests that no errors were thrown, so not the best test
@@ -33,6 +35,131 @@ def test_read_nc():
     df = utils.read_flight_nc(nc_1hz, vars_to_read)
     df = utils.read_flight_nc(nc_25hz, vars_to_read)
 
+    # 25 Hz variables keep their float32 dtype, as in the original reader, while 1 Hz variables are interpolated in
+    # float64 and masked values are NaN
+    assert all(df_25hz[var].dtype == np.float32 for var in ['UIC','VIC','WIC'])
+    assert all(df_25hz[var].dtype == np.float64 for var in ['Time','GGALT','LATC','LONC'])
+    for var in ['UIC','VIC','WIC']:
+        raw = nc_25hz[var][:]
+        assert np.array_equal(df_25hz[var], np.ma.filled(np.ravel(raw).astype(np.float32), np.nan), equal_nan=True)
+
+def write_test_flight_20hz(file_path: str):
+    # write a small synthetic high-rate file: 1 Hz, 10 Hz and 20 Hz variables over 4 seconds
+    with netCDF4.Dataset(file_path, 'w') as nc:
+        nc.createDimension('Time', 4)
+        nc.createDimension('sps10', 10)
+        nc.createDimension('sps20', 20)
+        time = nc.createVariable('Time', 'i4', ('Time',))
+        time.units = 'seconds since 2018-01-15 00:00:00 +0000'
+        time[:] = np.arange(4) + 100
+        nc.createVariable('GGALT', 'f4', ('Time',))[:] = np.array([0., 10., 30., 60.])
+        nc.createVariable('X10', 'f4', ('Time','sps10'))[:] = np.arange(40).reshape(4,10)
+        nc.createVariable('WIC', 'f4', ('Time','sps20'))[:] = np.arange(80).reshape(4,20)
+
+def test_read_flight_nc_hr(tmp_path):
+    file_path = str(tmp_path / "test_flight_20hz.nc")
+    write_test_flight_20hz(file_path)
+
+    nc = utils.open_flight_nc(file_path)
+    assert utils.get_flight_rate(nc) == 20
+    df = utils.read_flight_nc(nc, ['Time','GGALT','X10','WIC','GGLAT'])
+    assert list(df.keys()) == ['Time','datetime','GGALT','X10','WIC']
+    assert len(df) == 80
+
+    # times are expanded with sub-second offsets, 20 Hz variables are unchanged, keeping their dtype
+    assert df['WIC'].dtype == np.float32 and df['GGALT'].dtype == np.float64 and df['Time'].dtype == np.float64
+    assert np.allclose(df['Time'][0:3], [100., 100.05, 100.1])
+    assert np.array_equal(df['WIC'], np.arange(80))
+    # 1 Hz and 10 Hz variables are linearly interpolated, with the last second left as NaN
+    assert np.allclose(df['GGALT'][20:23], [10., 11., 12.])
+    assert np.allclose(df['X10'][0:4], [0., 0.5, 1., 1.5])
+    assert np.all(np.isnan(df['GGALT'][60:]))
+    assert np.all(np.isnan(df['X10'][60:]))
+
+    # rows are indexed by the sample times
+    assert df.index[21] == np.datetime64('2018-01-15T00:01:41.05')
+
+    # masked times are NaN, and NaT once decoded, like masked values of the other variables
+    nc.close()
+    with netCDF4.Dataset(file_path, 'a') as nc_append:
+        nc_append['Time'].valid_max = 102
+    df = utils.read_flight_nc(utils.open_flight_nc(file_path), ['Time','WIC'])
+    assert np.all(np.isnan(df['Time'][60:])) and np.all(np.isnat(df['datetime'][60:].to_numpy()))
+    assert np.all(np.isfinite(df['Time'][:60]))
+
+def test_iter_flight_nc(tmp_path):
+    file_path = str(tmp_path / "test_flight_20hz.nc")
+    write_test_flight_20hz(file_path)
+    read_vars = ['Time','GGALT','X10','WIC']
+
+    # windows that split the file unevenly, put back together, must equal the whole-file read,
+    # including the interpolated values at the window edges
+    for (nc, window_seconds) in [(utils.open_flight_nc(file_path), 3),
+                                 (utils.open_flight_nc("./test_flight_1hz.nc"), 7000)]:
+        whole = utils.read_flight_nc(nc, read_vars)
+        windows = list(utils.iter_flight_nc(nc, read_vars, window_seconds=window_seconds))
+        assert len(windows) == int(np.ceil(len(nc.dimensions['Time'])/window_seconds))
+        assert pd.concat(windows).equals(whole)
+
+    arrays = next(utils.iter_flight_nc(utils.open_flight_nc(file_path), read_vars, window_seconds=3, as_frame=False))
+    assert np.array_equal(arrays['GGALT'][20:23], [10., 11., 12.])
+
+def test_read_all_flights(tmp_path):
+    # one campaign with a good and a corrupt flight file, and one campaign without any data directory
+    campaign_dir = tmp_path / "CAMPAIGN" / "lrt"
+    campaign_dir.mkdir(parents=True)
+    (campaign_dir / "rf01.nc").symlink_to(path.Path("./test_flight_1hz.nc").resolve())
+    (campaign_dir / "rf02.nc").write_text("not a netcdf file")
+
+    vars_to_read = ['Time','LATC','LONC']
+    for n_workers in [1, 2]:
+        all_flights, errors = utils.read_all_flights(str(tmp_path), ['CAMPAIGN','MISSING'], vars_to_read,
+                                                     n_workers=n_workers, return_errors=True)
+        assert list(all_flights.keys()) == ['CAMPAIGN','MISSING']
+        assert list(all_flights['CAMPAIGN'].keys()) == ['rf01.nc']
+        assert all_flights['MISSING'] == {}
+        assert list(all_flights['CAMPAIGN']['rf01.nc'].keys()) == ['Time','datetime','LATC','LONC']
+        assert sorted(errors.keys()) == [str(tmp_path / "CAMPAIGN" / "lrt" / "rf02.nc"),
+                                         str(tmp_path / "MISSING" / "lrt")]
+
+def test_iter_flights(tmp_path):
+    campaign_dir = tmp_path / "CAMPAIGN" / "lrt"
+    campaign_dir.mkdir(parents=True)
+    for fname in ["rf01.nc", "rf03.nc", "rf04.nc"]:
+        (campaign_dir / fname).symlink_to(path.Path("./test_flight_1hz.nc").resolve())
+    (campaign_dir / "rf02.nc").write_text("not a netcdf file")
+
+    vars_to_read = ['Time','LATC','LONC']
+    expected = utils.read_all_flights(str(tmp_path), ['CAMPAIGN'], vars_to_read)['CAMPAIGN']
+    for prefetch in [0, 2]:
+        errors = {}
+        flights = utils.iter_flights(str(tmp_path), ['CAMPAIGN','MISSING'], vars_to_read, prefetch, errors)
+        # nothing is read before the first flight is asked for
+        assert errors == {}
+        seen = []
+        for campaign, fname, df in flights:
+            pd.testing.assert_frame_equal(df, expected[fname])
+            seen.append((campaign, fname))
+        assert seen == [('CAMPAIGN','rf01.nc'), ('CAMPAIGN','rf03.nc'), ('CAMPAIGN','rf04.nc')]
+        assert sorted(errors.keys()) == [str(campaign_dir / "rf02.nc"), str(tmp_path / "MISSING" / "lrt")]
+
+    # stopping early drops the flights read ahead and leaves no reads running
+    class counting_lock:
+        reads = 0
+        def __enter__(self):
+            counting_lock.reads += 1
+        def __exit__(self, *args):
+            pass
+    flights = utils.iter_flights(str(tmp_path), ['CAMPAIGN','MISSING'], vars_to_read, prefetch=1,
+                                 lock=counting_lock())
+    assert flights.field_campaigns == ['CAMPAIGN','MISSING']
+    next(flights)
+    flights.close()
+    reads = counting_lock.reads
+    assert 1 <= reads <= 2 # the flight asked for and at most the one read ahead, out of 4 files
+    time.sleep(0.1)
+    assert counting_lock.reads == reads
+
 def test_sfm_to_datetime():
     # a test array of sfm (seconds-from-midnight) with units of tunits
     sfm = np.array([0,60,3600.5])
@@ -49,7 +176,19 @@ def test_sfm_to_datetime():
     for (test, expected) in zip(dt_list, expected_list):
         assert test == expected
 
-def test_flight_obj():
+def test_sfm_to_datetime64():
+    sfm = np.array([0,60,3600.5])
+
+    # the full reference time, including the UTC offset, should be honored
+    dts = utils.sfm_to_datetime64(sfm, 'seconds since 2018-01-15 12:00:00 -0600')
+    expected = np.array(['2018-01-15T18:00:00','2018-01-15T18:01:00','2018-01-15T19:00:00.5'], dtype='datetime64[ns]')
+    assert dts.dtype == np.dtype('datetime64[ns]')
+    assert np.array_equal(dts, expected)
+
+    with pytest.raises(ValueError):
+        utils.sfm_to_datetime64(sfm, 'seconds from 2018-01-15')
+
+def test_flight_obj(flight_25hz_path):
     # test bad file path, check that FileNotFoundError results
     file_path = "./test_fligt_25hz.nc"
     with pytest.raises(FileNotFoundError):
@@ -58,9 +197,8 @@ def test_flight_obj():
     # set up a test to read in flight data. try to read in GGLAT, GGLON despite not in file
     read_vars = ['Time','GGALT','LATC','LONC','GGLAT','GGLON',
                                 'UIC','VIC','WIC',]
-    file_path = "./test_flight_25hz.nc"
     # create the flight object
-    flight_obj = utils.flight_obj(file_path, read_vars)
+    flight_obj = utils.flight_obj(flight_25hz_path, read_vars)
     # read_vars_attempted should equal the read vars sent in
     assert flight_obj.read_vars_attempted == read_vars
     # test that GGLAT and GGLON were not actually read
@@ -72,6 +210,88 @@ def test_flight_obj():
     file_path = "./test_flight_1hz.nc"
     assert utils.flight_obj(file_path, read_vars).rate == "1Hz"
 
+def test_lazy_flight_obj():
+    # test bad file path, check that FileNotFoundError results
+    with pytest.raises(FileNotFoundError):
+        utils.lazy_flight_obj("./test_fligt_25hz.nc")
+
+    read_vars = ['Time','LATC','LONC','GGLAT','WIC']
+    file_path = "./test_flight_1hz.nc"
+    with utils.lazy_flight_obj(file_path, read_vars) as flight:
+        # only metadata is read at construction, and the file is not held open
+        assert flight.rate == "1Hz"
+        assert flight.read_vars == ['Time','datetime','LATC','LONC','WIC']
+        assert flight.nc is None
+        assert flight.nbytes() == 0
+
+        # columns are decoded on first access and match the eager reader
+        df = utils.flight_obj(file_path, read_vars).df
+        assert np.array_equal(flight["WIC"], df["WIC"].to_numpy(), equal_nan=True)
+        assert list(flight._columns.keys()) == ['WIC']
+        assert flight.df.equals(df)
+        with pytest.raises(KeyError):
+            flight["GGLAT"]
+
+    # exiting the context drops the memoized columns
+    assert flight.nbytes() == 0
+
+    # with a memory budget of a single column, older columns are dropped
+    flight = utils.lazy_flight_obj(file_path, read_vars, max_bytes=flight.nrows*4)
+    flight["LATC"]
+    flight["LONC"]
+    assert list(flight._columns.keys()) == ['LONC']
+    flight.close()
+
+def test_flight_table(tmp_path):
+    write_test_flight_20hz(str(tmp_path / 'rf01.nc'))
+    df_20hz = utils.read_flight_file(str(tmp_path / 'rf01.nc'), ['Time','GGALT','WIC'])
+    df_1hz = utils.read_flight_file('test_flight_1hz.nc', ['Time','GGALT','LATC','LONC'])
+    df_gps = df_1hz.rename(columns={'LATC': 'GGLAT', 'LONC': 'GGLON'})
+    all_campaign_dfs = {'SOCRATES': {'rf01.nc': df_1hz, 'rf02.nc': df_1hz}, 'CSET': {'rf01.nc': df_20hz},
+                        'NEW': {'rf01.nc': df_gps}}
+    table = utils.flight_table(all_campaign_dfs)
+
+    assert len(table) == 4 and len(table.df) == 3*len(df_1hz) + len(df_20hz)
+    assert np.array_equal(table.offsets, np.cumsum([0, len(df_1hz), len(df_1hz), len(df_20hz), len(df_1hz)]))
+    assert table.df['campaign'].dtype == 'category' and table.df['flight'].dtype == 'category'
+    assert table.df['GGALT'].dtype == np.float32 and table.df['Time'].dtype == np.float64
+
+    # per-flight frames are slices of the table, equal to what was read up to float32 precision
+    cset = table.flight('CSET', 'rf01.nc')
+    assert np.shares_memory(cset['WIC'].to_numpy(), table.df['WIC'].to_numpy())
+    assert np.allclose(cset['WIC'], df_20hz['WIC'], equal_nan=True)
+    assert np.array_equal(cset.index, df_20hz.index)
+    assert 'LATC' not in cset and 'LATC' in table.flight('SOCRATES', 'rf01.nc') # only the flight's own columns
+    assert np.array_equal(table.to_dict()['SOCRATES']['rf02.nc']['Time'], df_1hz['Time'])
+    # a LATC flight in a table with GGLAT flights is still positioned by its LATC
+    socrates = utils.add_projected_columns(table.to_dict()['SOCRATES']['rf01.nc'].copy())
+    assert socrates['pos_valid'].sum() == (df_1hz['LATC'].notna() & df_1hz['LONC'].notna()).sum() > 0
+
+    # float64 data take half the memory; the 20 Hz WIC was read as float32 and the interpolated GGALT as float64
+    full = utils.flight_table(all_campaign_dfs, float_dtype=None)
+    assert full.df['WIC'].dtype == np.float32 and full.df['GGALT'].dtype == np.float64
+    assert table.df['GGALT'].nbytes*2 == full.df['GGALT'].nbytes
+
+def test_project_positions():
+    # a flight mostly west of the dateline keeps positive longitudes
+    lat = np.array([-40., -41., np.nan, -42., 95.])
+    lon = np.array([178., 179.5, 179.9, -179.5, -178.])
+    lon_unwrapped, x, y, valid = utils.project_positions(lat, lon)
+    assert np.array_equal(lon_unwrapped, [178., 179.5, 179.9, 180.5, 182.])
+    assert np.array_equal(valid, [True, True, False, True, False])
+    assert x.dtype == np.float32 and y.dtype == np.float32
+    assert np.allclose(x[valid], lon_unwrapped[valid]*6378137*np.pi/180.)
+    assert np.allclose(y[valid], np.log(np.tan((90 + lat[valid])*np.pi/360.))*6378137)
+    assert np.all(np.isnan(x[~valid])) and np.all(np.isnan(y[~valid]))
+
+    df = utils.add_projected_columns(pd.DataFrame({'LATC': lat, 'LONC': lon, 'GGLAT': lat, 'GGLON': -lon}))
+    assert np.array_equal(df['lon_unwrapped'], [-178., -179.5, -179.9, -180.5, -182.])
+    df = utils.read_flight_file('test_flight_1hz.nc', ['Time','LATC','LONC'], project=True)
+    assert np.array_equal(df['pos_valid'], df['LATC'].notna()) and df['merc_x'].dtype == np.float32
+    with pytest.raises(ValueError):
+        utils.read_all_flights('.', ['CAMPAIGN'], ['Time','GGALT'], project=True)
+    with pytest.raises(ValueError):
+        utils.iter_flights('.', ['CAMPAIGN'], ['Time','GGALT'], project=True)
 
 if __name__ == "__main__":
     test_flight_obj()
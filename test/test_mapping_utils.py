@@ -0,0 +1,139 @@
+import sys
+sys.path.append('..')
+import util.mapping_utils as utils
+import util.model_utils as model_utils
+import pandas as pd
+import numpy as np
+import xarray as xr
+
+# a small synthetic grid: 2 output times, 3 levels, 4 latitudes and 8 longitudes
+lats = np.array([-67.5, -22.5, 22.5, 67.5])
+lons = np.arange(8)*45.
+model_times = np.array(['2018-01-15T00:00','2018-01-15T06:00'], dtype='datetime64[ns]')
+# interface heights of 0, 1000, 3000 and 6000 m everywhere at the first time, and 10% higher at the second
+zi = np.broadcast_to(np.array([0., 1000., 3000., 6000.])[None,:,None,None], (2,4,4,8)).copy()
+zi[1] *= 1.1
+
+def test_cell_edges():
+    assert np.allclose(utils.calc_cell_edges(lats), [-90., -45., 0., 45., 90.])
+    assert np.allclose(utils.calc_cell_edges(lons, periodic=True), np.arange(9)*45. - 22.5)
+
+def test_find_idx():
+    lat_edges = utils.calc_cell_edges(lats)
+    assert np.array_equal(utils.find_lat_idx([-90., -44., 0., 90., np.nan], lat_edges), [0, 1, 2, 3, -1])
+    # latitudes running north to south
+    assert np.array_equal(utils.find_lat_idx([-90., -44., 0., 90.], lat_edges[::-1]), [3, 2, 1, 0])
+
+    # longitudes wrap around: -170 is 190, and -10 is in the cell centered on 0
+    lon_edges = utils.calc_cell_edges(lons, periodic=True)
+    assert np.array_equal(utils.find_lon_idx([0., -10., 350., -170., 190., 337.5, np.nan], lon_edges),
+                          [0, 0, 0, 4, 4, 0, -1])
+
+    times = np.array(['2018-01-14T20:00','2018-01-15T02:59','2018-01-15T03:01','2018-01-15T09:01', 'NaT'],
+                     dtype='datetime64[ns]')
+    assert np.array_equal(utils.find_time_idx(times, model_times), [-1, 0, 1, -1, -1])
+
+def test_map_flight_to_grid():
+    df = pd.DataFrame({'datetime': np.array(['2018-01-15T00:00','2018-01-15T06:00','2018-01-15T06:00',
+                                             '2018-01-15T06:00','2018-01-15T06:00'], dtype='datetime64[ns]'),
+                       'LATC': [-50., 10., 10., 10., np.nan],
+                       'LONC': [-170., 100., 100., 100., 100.],
+                       'GGALT': [500., 3200., -10., 7000., 500.]})
+    cells = utils.map_flight_to_grid(df, lats, lons, zi, model_times)
+
+    assert np.array_equal(cells['time_idx'], [0, 1, -1, -1, -1])
+    # 3200 m is in the second level at the second time, since the 3000 m interface is at 3300 m then
+    assert np.array_equal(cells['lev_idx'], [0, 1, -1, -1, -1])
+    assert np.array_equal(cells['lat_idx'], [0, 2, -1, -1, -1])
+    assert np.array_equal(cells['lon_idx'], [4, 2, -1, -1, -1])
+    assert np.array_equal(cells['valid'], [True, True, False, False, False])
+
+    ids = utils.calc_cell_ids(cells, (2,3,4,8))
+    assert np.array_equal(ids, [np.ravel_multi_index((0,0,0,4), (2,3,4,8)),
+                                np.ravel_multi_index((1,1,2,2), (2,3,4,8)), -1, -1, -1])
+
+def test_vertical_index():
+    # synthetic CAM fields (model top first) for the grid above, with 5 levels
+    rng = np.random.default_rng(0)
+    p0 = 1e5
+    hyai = np.array([0.01, 0.05, 0.1, 0.05, 0., 0.])
+    hybi = np.array([0., 0., 0.2, 0.5, 0.8, 1.])
+    ps = 1e5 + 1e3*rng.standard_normal((2,4,8))
+    tk = 220 + 60*np.linspace(0,1,5)[None,:,None,None] + rng.standard_normal((2,5,4,8))
+    q = 1e-2*np.linspace(0,1,5)[None,:,None,None]*rng.random((2,5,4,8))
+    phis = 9.8067*1000*rng.random((4,8))
+    zi_full = model_utils.calc_phii_hydro_cesm(ps, p0, hyai, hybi, tk, q, phis)
+
+    # samples at random times between the two outputs, in 3 columns, at random heights
+    n = 1000
+    times = model_times[0] + (rng.random(n)*6*3600e9).astype('timedelta64[ns]')
+    lat_idx = rng.integers(0, 2, n)
+    lon_idx = np.full(n, 5)
+    lon_idx[0] = 6
+    alt = rng.uniform(0, 20000, n)
+
+    index = utils.vertical_index(ps, p0, hyai, hybi, tk, q, phis, model_times)
+    lev, frac = index.lookup(times, lat_idx, lon_idx, alt)
+    # only the visited columns, at both times, were computed
+    assert len(index.column_ids) == 2*3
+
+    # compare with interface heights of the whole grid, interpolated in time
+    w = (times - model_times[0])/(model_times[1] - model_times[0])
+    zi = (1 - w)[:,None]*zi_full[0,:,lat_idx,lon_idx] + w[:,None]*zi_full[1,:,lat_idx,lon_idx]
+    expected = (zi <= alt[:,None]).sum(axis=1) - 1
+    expected[expected >= 5] = -1
+    assert np.array_equal(lev, expected)
+    inside = lev >= 0
+    k = lev[inside]
+    rows = np.flatnonzero(inside)
+    assert np.allclose(frac[inside], (alt[inside] - zi[rows,k])/(zi[rows,k+1] - zi[rows,k]))
+    assert np.all(np.isnan(frac[~inside]))
+
+    # samples outside the model times are not placed
+    lev, frac = index.lookup(model_times[[0,1]] + np.array([-1,1], dtype='timedelta64[s]'), lat_idx[:2],
+                             lon_idx[:2], alt[:2])
+    assert np.array_equal(lev, [-1, -1])
+
+    # with a single model time, every sample is placed in its columns at that time, as map_flight_to_grid does
+    single = utils.vertical_index(ps[:1], p0, hyai, hybi, tk[:1], q[:1], phis, model_times[:1])
+    lev, frac = single.lookup(times, lat_idx, lon_idx, alt)
+    expected = (zi_full[0,:,lat_idx,lon_idx] <= alt[:,None]).sum(axis=1) - 1
+    expected[expected >= 5] = -1
+    assert np.array_equal(lev, expected) and np.any(lev >= 0)
+
+def test_interp_weights():
+    rng = np.random.default_rng(1)
+    n = 500
+    df = pd.DataFrame({'datetime': model_times[0] + (rng.random(n)*6*3600e9).astype('timedelta64[ns]'),
+                       'GGLAT': rng.uniform(-67.5, 67.5, n), 'GGLON': rng.uniform(-180., 180., n),
+                       'GGALT': rng.uniform(550., 4500., n)})
+    weights = utils.interp_weights(df, lats, lons, zi, model_times)
+    assert weights.valid.all() and np.allclose(weights.weights.sum(axis=1), 1.)
+
+    # fields linear in each coordinate are interpolated exactly
+    zm = 0.5*(zi[:,1:] + zi[:,:-1])
+    assert np.allclose(weights.sample(zm[:,::-1]), df['GGALT'])
+    assert np.allclose(weights.sample(zm, surface_first=True), df['GGALT'])
+    assert np.allclose(weights.sample(np.broadcast_to(lats[None,:,None], (2,4,8))), df['GGLAT'])
+    w = (df['datetime'] - model_times[0])/(model_times[1] - model_times[0])
+    assert np.allclose(weights.sample(np.broadcast_to(np.arange(2.)[:,None,None], (2,4,8))), w)
+    # longitudes across the 315/0 wrap are interpolated between the two
+    east = np.mod(df['GGLON'].to_numpy(), 360.) <= 315.
+    lon_field = np.broadcast_to(lons[None,:], (4,8))
+    assert np.allclose(weights.sample(lon_field)[east], np.mod(df['GGLON'], 360.)[east])
+    wrap = utils.interp_weights(df.iloc[:1].assign(GGLON=-22.5), lats, lons, zi, model_times)
+    assert np.allclose(wrap.sample(lon_field), 157.5)
+
+    # sampling a dataset gives one column per field
+    ds = xr.Dataset({'Z': (('time','lev','lat','lon'), zm[:,::-1]), 'PHIS': (('lat','lon'), lon_field)})
+    sampled = weights.sample_dataset(ds)
+    assert list(sampled.columns) == ['Z','PHIS'] and sampled.index.equals(df.index)
+    assert np.allclose(sampled['Z'], df['GGALT'])
+
+    # samples outside the model times, below the surface, above the model top or without a position are NaN
+    outside = pd.DataFrame({'datetime': model_times[[0,0,1,0]] + np.array([-1,0,1,0], dtype='timedelta64[s]'),
+                            'GGLAT': [0., 0., 0., np.nan], 'GGLON': [0., 0., 0., 0.],
+                            'GGALT': [1000., 7000., 1000., 1000.]})
+    outside_weights = utils.interp_weights(outside, lats, lons, zi, model_times)
+    assert not outside_weights.valid.any()
+    assert np.all(np.isnan(outside_weights.sample(zm[:,::-1])))
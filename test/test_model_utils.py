@@ -16,10 +16,8 @@ from matplotlib.gridspec import GridSpec
 from matplotlib.lines import Line2D
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
-cam_fname = './test_ll.nc'
-
-def test_calc_pressure():
-    ds = xr.open_dataset(cam_fname)
+def test_calc_pressure(cam_ll_path):
+    ds = xr.open_dataset(cam_ll_path)
 
     # read in variables
     times = ds.time.values
@@ -53,8 +51,36 @@ def test_calc_pressure():
     dp = pi[:,1:nlevi,:,:] - pi[:,0:nlevi-1,:,:]
     assert np.all(dp < 0)
 
-def test_calc_phii():
-    ds = xr.open_dataset(cam_fname)
+def test_calc_pressure_options():
+    # synthetic surface pressure and hybrid coefficients for 3 times, 4 interfaces, on a 5 by 6 grid
+    rng = np.random.default_rng(0)
+    ps = 1e5 + 1e3*rng.standard_normal((3,5,6))
+    p0 = 1e5
+    a = np.array([0.01, 0.2, 0.1, 0.])
+    b = np.array([0., 0.3, 0.8, 1.])
+
+    p = utils.calc_pressure_cesm(ps, p0, a, b)
+    assert p.shape == (3,4,5,6)
+    assert p.flags.c_contiguous
+    # level 0 is the surface
+    assert np.allclose(p[:,0,:,:], ps)
+    assert np.allclose(p[1,3,2,2], a[0]*p0 + b[0]*ps[1,2,2])
+
+    # chunking over time and writing into a provided buffer give the same answer
+    out = np.empty_like(p)
+    assert utils.calc_pressure_cesm(ps, p0, a, b, out=out, time_chunk=2) is out
+    assert np.array_equal(out, p)
+
+    # single precision
+    p32 = utils.calc_pressure_cesm(ps, p0, a, b, dtype=np.float32)
+    assert p32.dtype == np.float32
+    assert np.allclose(p32, p, rtol=1e-6)
+
+    # 2-D surface pressure
+    assert np.array_equal(utils.calc_pressure_cesm(ps[0], p0, a, b), p[0:1])
+
+def test_calc_phii(cam_ll_path):
+    ds = xr.open_dataset(cam_ll_path)
 
     g = 9.8067
     phis = ds.PHIS.values/g
@@ -66,8 +92,8 @@ def test_calc_phii():
     dz = zi_interp[:,1:,:,:]-zi_interp[:,0:nz-1,:,:]
     assert np.all(dz > 0)
 
-def test_calc_phii_hydro():
-    ds = xr.open_dataset(cam_fname)
+def test_calc_phii_hydro(cam_ll_path):
+    ds = xr.open_dataset(cam_ll_path)
 
     # compute zi (z at interfaces) via interpolation, extrapolation
     g = 9.8067
@@ -106,5 +132,36 @@ def test_calc_phii_hydro():
     assert np.std(ratio) < 1.02  # standard deviation between methods of 1.013 %
     assert np.all(ratio < 6.4)   # the worst single difference between methods was 6.372 %
 
+def test_calc_phii_hydro_cesm():
+    # synthetic CAM fields (model top first) for 3 times, 5 levels, on a 4 by 6 grid
+    rng = np.random.default_rng(0)
+    p0 = 1e5
+    hyai = np.array([0.01, 0.05, 0.1, 0.05, 0., 0.])
+    hybi = np.array([0., 0., 0.2, 0.5, 0.8, 1.])
+    hyam = 0.5*(hyai[1:] + hyai[:-1])
+    hybm = 0.5*(hybi[1:] + hybi[:-1])
+    ps = 1e5 + 1e3*rng.standard_normal((3,4,6))
+    tk = 220 + 60*np.linspace(0,1,5)[None,:,None,None] + rng.standard_normal((3,5,4,6))
+    q = 1e-2*np.linspace(0,1,5)[None,:,None,None]*rng.random((3,5,4,6))
+    phis = 9.8067*1000*rng.random((4,6))
+
+    # the unfused chain
+    p = utils.calc_pressure_cesm(ps, p0, hyam, hybm)
+    pi = utils.calc_pressure_cesm(ps, p0, hyai, hybi)
+    rhom = utils.calc_rhom(p, tk[:,::-1,:,:], q[:,::-1,:,:])
+    zi = utils.calc_phii_hydro(phis/9.8067, rhom, pi)
+
+    # fused, with and without the level coefficients, and chunked over time
+    for time_chunk in [1, 2, 3]:
+        zi_fused = utils.calc_phii_hydro_cesm(ps, p0, hyai, hybi, tk, q, phis, hyam, hybm, time_chunk=time_chunk)
+        assert zi_fused.shape == zi.shape
+        assert np.allclose(zi_fused, zi, rtol=1e-10)
+    assert np.allclose(utils.calc_phii_hydro_cesm(ps, p0, hyai, hybi, tk, q, phis), zi, rtol=1e-10)
+
+    # single precision into a provided buffer
+    out = np.empty(zi.shape, dtype=np.float32)
+    assert utils.calc_phii_hydro_cesm(ps, p0, hyai, hybi, tk, q, phis, out=out) is out
+    assert np.allclose(out, zi, rtol=1e-5)
+
 if __name__ == "__main__":
     test_calc_phii_hydro()
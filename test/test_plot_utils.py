@@ -0,0 +1,118 @@
+import sys
+sys.path.append('..')
+import util.plot_utils as utils
+import util.flight_utils as flight_utils
+import pandas as pd
+import numpy as np
+from bokeh.palettes import Category10
+
+def test_simplify_track():
+    # a straight line collapses to its ends, and a corner is kept
+    x = np.arange(11.)
+    assert np.array_equal(utils.simplify_track(x, np.zeros(11), 0.1), [0, 10])
+    assert np.array_equal(utils.simplify_track(x, np.abs(x - 5), 0.1), [0, 5, 10])
+
+    # every dropped point is within tolerance of the simplified track, and gaps are preserved
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.standard_normal(5000))
+    y = np.cumsum(rng.standard_normal(5000))
+    y[2000:2010] = np.nan
+    keep = utils.simplify_track(x, y, 3.)
+    assert len(keep) < 1000
+    assert np.all(np.isin(np.arange(1999, 2011), keep))
+    pos = np.searchsorted(keep, np.arange(5000))
+    dropped = ~np.isin(np.arange(5000), keep)
+    i0, i1 = keep[pos[dropped] - 1], keep[pos[dropped]]
+    dx, dy = x[i1] - x[i0], y[i1] - y[i0]
+    dist = np.abs((x[dropped] - x[i0])*dy - (y[dropped] - y[i0])*dx)/np.hypot(dx, dy)
+    assert np.all(dist <= 3.)
+
+def test_plot_campaigns():
+    t = np.linspace(0, 1, 1000)
+    all_campaign_dfs = {'SOCRATES': {'rf01.nc': pd.DataFrame({'LATC': -50 + 5*t, 'LONC': 140 + 10*t}),
+                                     'rf02.nc': pd.DataFrame({'LATC': -50 + 5*t**2, 'LONC': 179.5 + t})},
+                        'CSET': {'rf01.nc': pd.DataFrame({'GGLAT': 30 + 5*t, 'GGLON': -150 + 20*t})}}
+    plot = utils.plot_campaigns(all_campaign_dfs, show_plot=False, simplify_px=0.5)
+    # one glyph per campaign, with one line per flight
+    lines = [r for r in plot.renderers if hasattr(r, 'data_source')]
+    assert len(lines) == 2
+    socrates = lines[0].data_source.data
+    assert len(socrates['xs']) == 2
+    # the straight flight collapses to its ends, and the dateline crossing is unwrapped
+    assert len(socrates['xs'][0]) == 2
+    assert np.all(np.diff(socrates['xs'][1]) > 0)
+
+    # flights streamed one at a time give the same glyphs
+    flights = ((campaign, fname, df) for campaign, dfs in all_campaign_dfs.items() for fname, df in dfs.items())
+    streamed = utils.plot_campaigns(flights, show_plot=False, simplify_px=0.5)
+    streamed_lines = [r for r in streamed.renderers if hasattr(r, 'data_source')]
+    assert [len(r.data_source.data['xs']) for r in streamed_lines] == [2, 1]
+    assert np.array_equal(streamed_lines[0].data_source.data['xs'][1], socrates['xs'][1])
+
+    # a campaign with no readable flights is left out, while still taking its turn of the colors, whether the flights
+    # were read or streamed
+    field_campaigns = ['SOCRATES','EMPTY','CSET']
+    flights = flight_utils.flight_iterator(field_campaigns, ((c, fname, df) for c, dfs in all_campaign_dfs.items()
+                                                             for fname, df in dfs.items()))
+    streamed = utils.plot_campaigns(flights, show_plot=False)
+    read = utils.plot_campaigns({campaign: all_campaign_dfs.get(campaign, {}) for campaign in field_campaigns},
+                                show_plot=False)
+    for plot in [streamed, read]:
+        assert [item.label.value for item in plot.legend[0].items] == ['SOCRATES','CSET']
+        colors = [r.glyph.line_color for r in plot.renderers if hasattr(r, 'data_source')]
+        assert colors == [Category10[8][0], Category10[8][2]]
+    # with no flights at all, the plot is empty
+    empty = utils.plot_campaigns({'EMPTY': {}}, show_plot=False, render='raster')
+    assert not [r for r in empty.renderers if hasattr(r, 'data_source')] and not empty.legend
+
+    plot = utils.plot_campaigns_custom(all_campaign_dfs, show_plot=False)
+    cset = [r for r in plot.renderers if hasattr(r, 'data_source')][1].data_source.data
+    assert len(cset['xs'][0]) == 1000
+
+def test_rasterize_tracks(tmp_path):
+    k = 6378137
+    to_x = lambda lon: np.asarray(lon)*k*np.pi/180.
+    # a one-degree raster: a long segment along the equator is drawn without gaps
+    counts, row0, col0 = utils.rasterize_tracks([(to_x([10.5, 20.5]), np.zeros(2))], width=360)
+    assert (row0, col0) == (180, 190)
+    assert counts.shape == (1,11) and np.all(counts >= 1)
+    # an unwrapped track across the dateline wraps around the raster, adding one to each pixel it passes through
+    # however many of its samples fall there, while every track passing through a pixel adds one
+    track = (to_x(np.linspace(175.5, 184.5, 100)), np.zeros(100))
+    counts, row0, col0 = utils.rasterize_tracks([track], width=360)
+    assert counts.shape == (1,360) and counts.sum() == 10
+    assert np.array_equal(np.flatnonzero(counts[0]), np.r_[0:5, 355:360])
+    assert np.all(utils.rasterize_tracks([track, track], width=360)[0][0, counts[0] > 0] == 2)
+
+    # raster rendering draws one image per campaign, and reuses cached rasters
+    t = np.linspace(0, 1, 1000)
+    all_campaign_dfs = {'SOCRATES': {'rf01.nc': pd.DataFrame({'LATC': -50 + 5*t, 'LONC': 140 + 10*t})},
+                        'CSET': {'rf01.nc': pd.DataFrame({'LATC': 30 + 5*t, 'LONC': -150 + 20*t})}}
+    plot = utils.plot_campaigns(all_campaign_dfs, show_plot=False, render='raster', raster_cache_dir=str(tmp_path))
+    images = [r.data_source.data['image'][0] for r in plot.renderers if hasattr(r, 'data_source')]
+    assert len(images) == 2 and len(list(tmp_path.iterdir())) == 2
+    plot = utils.plot_campaigns(all_campaign_dfs, show_plot=False, render='raster', raster_cache_dir=str(tmp_path))
+    cached = [r.data_source.data['image'][0] for r in plot.renderers if hasattr(r, 'data_source')]
+    assert all(np.array_equal(a, b) for (a, b) in zip(images, cached))
+    # a campaign's changed tracks replace its cached raster rather than adding to the cache
+    all_campaign_dfs['CSET']['rf02.nc'] = pd.DataFrame({'LATC': 20 + 5*t, 'LONC': -140 + 20*t})
+    utils.plot_campaigns(all_campaign_dfs, show_plot=False, render='raster', raster_cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 2
+    utils.plot_campaigns(all_campaign_dfs, show_plot=False, render='raster', raster_cache_dir=str(tmp_path),
+                         raster_width=1024)
+    assert len(list(tmp_path.iterdir())) == 4
+
+def test_plot_projected_columns():
+    # precomputed projected columns are used as they are
+    t = np.linspace(0, 1, 1000)
+    df = flight_utils.add_projected_columns(pd.DataFrame({'LATC': -50 + 5*t**2, 'LONC': 179.5 + t}))
+    plot = utils.plot_campaigns({'SOCRATES': {'rf01.nc': df[['merc_x','merc_y']]}}, show_plot=False)
+    data = [r for r in plot.renderers if hasattr(r, 'data_source')][0].data_source.data
+    assert np.array_equal(data['xs'][0], df['merc_x']) and np.array_equal(data['ys'][0], df['merc_y'])
+
+    # the ARISTO2017 filter works on the projected latitudes, with or without latitude columns
+    df = flight_utils.add_projected_columns(pd.DataFrame({'GGLAT': np.r_[0., 30 + t], 'GGLON': np.r_[0., -100 + t]}))
+    for flight in [df, df[['merc_x','merc_y']]]:
+        plot = utils.plot_campaigns({'ARISTO2017': {'rf01.nc': flight}}, show_plot=False)
+        data = [r for r in plot.renderers if hasattr(r, 'data_source')][0].data_source.data
+        assert len(data['xs'][0]) == 1000
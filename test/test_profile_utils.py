@@ -0,0 +1,42 @@
+import sys
+sys.path.append('..')
+import util.profile_utils as utils
+import util.flight_utils as flight_utils
+import util.model_utils as model_utils
+import json
+import numpy as np
+
+def test_profile_collector(tmp_path):
+    # nothing is collected, or fails, without a collector, nor are messages formatted
+    df = flight_utils.read_flight_file('test_flight_1hz.nc', ['Time','GGALT','NOPE'])
+    utils.count('flight.rows', 10)
+    formatted = []
+    class counted_error(Exception):
+        def __str__(self):
+            formatted.append(1)
+            return 'counted'
+    with flight_utils.open_flight_nc('test_flight_1hz.nc') as nc:
+        flight_utils._skip_var(nc, 'NOPE', counted_error())
+    assert formatted == []
+
+    with utils.profile_collector() as prof:
+        df = flight_utils.read_flight_file('test_flight_1hz.nc', ['Time','GGALT','NOPE'])
+        model_utils.calc_pressure_cesm(np.full((2,3,4), 1e5), 1e5, np.zeros(5), np.linspace(0, 1, 5))
+        with utils.profile_collector() as inner:
+            utils.count('inner')
+
+    assert prof.stages['flight.read_flight_nc']['calls'] == 1
+    assert prof.stages['flight.netcdf_read']['seconds'] > 0
+    assert prof.stages['model.calc_pressure_cesm']['calls'] == 1
+    assert prof.counters['flight.rows'] == len(df)
+    assert prof.counters['flight.bytes_read'] > 0
+    # variables that could not be read are counted and explained
+    assert prof.counters['flight.skipped_vars'] == 1
+    assert 'NOPE' in prof.notes['flight.skipped_vars'][0]
+    # the innermost collector collects
+    assert inner.counters == {'inner': 1} and 'inner' not in prof.counters
+    assert prof.peak_rss_bytes > 0
+
+    prof.save(str(tmp_path / 'profile.json'))
+    with open(tmp_path / 'profile.json') as f:
+        assert json.load(f) == json.loads(json.dumps(prof.to_dict()))
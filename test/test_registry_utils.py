@@ -0,0 +1,61 @@
+import sys
+sys.path.append('..')
+import util.registry_utils as utils
+import util.flight_utils as flight_utils
+import shutil
+import os
+import pytest
+
+def test_scan_flight_header():
+    header = utils.scan_flight_header('test_flight_1hz.nc')
+    assert header['rate'] == 1
+    assert header['ntimes'] == header['dimensions']['Time']
+    assert header['start'] == '2018-02-17T23:40:00.000000000'
+    assert header['attributes']['project'] == 'SOCRATES'
+    variables = {var[0]: var for var in header['variables']}
+    assert variables['GGALT'][2] == 1 and variables['GGALT'][3] == 'Time'
+
+def test_flight_registry(tmp_path):
+    lrt = tmp_path / 'SOCRATES' / 'lrt'
+    lrt.mkdir(parents=True)
+    shutil.copy('test_flight_1hz.nc', lrt / 'rf01.nc')
+    shutil.copy('test_flight_1hz.nc', lrt / 'rf02.nc')
+    (lrt / 'rf03.nc').write_text('not a netcdf file')
+
+    with utils.flight_registry(str(tmp_path / 'registry.db')) as registry:
+        errors = registry.scan(str(tmp_path), ['SOCRATES'], n_workers=2)
+        assert list(errors) == [str((lrt / 'rf03.nc').resolve())]
+        files = registry.files()
+        assert list(files['fname']) == ['rf01.nc', 'rf02.nc']
+        assert files['attributes'][0]['FlightNumber'] == 'rf12'
+        assert 'GGALT' in set(registry.variables(str(lrt / 'rf01.nc'))['name'])
+
+        # rescans only touch new or modified files
+        (lrt / 'rf03.nc').unlink()
+        os.remove(lrt / 'rf02.nc')
+        shutil.copy('test_flight_1hz.nc', lrt / 'rf04.nc')
+        assert registry.is_current(str(lrt / 'rf01.nc'))
+        assert not registry.is_current(str(lrt / 'rf04.nc'))
+        assert registry.scan(str(tmp_path), ['SOCRATES']) == {}
+        assert list(registry.files()['fname']) == ['rf01.nc', 'rf04.nc']
+
+        # files lacking requested variables are found without opening them
+        assert registry.missing_vars(str(lrt / 'rf01.nc'), ['GGALT','NOPE']) == ['NOPE']
+        assert list(registry.files(read_vars=['GGALT','LATC'])['fname']) == ['rf01.nc', 'rf04.nc']
+        assert len(registry.files(read_vars=['GGALT','NOPE'])) == 0
+        assert list(registry.files(read_vars=['GGALT','GGALT'])['fname']) == ['rf01.nc', 'rf04.nc']
+        with pytest.raises(ValueError):
+            flight_utils.flight_obj(str(lrt / 'rf01.nc'), ['Time','NOPE'], registry=registry)
+        # files lacking only some of the variables, e.g. GGLAT in older campaigns, are still read
+        flight = flight_utils.flight_obj(str(lrt / 'rf01.nc'), ['Time','GGLAT','GGLON','LATC'], registry=registry)
+        assert 'LATC' in flight.df and 'GGLAT' not in flight.df
+
+        flights = flight_utils.read_all_flights(str(tmp_path), ['SOCRATES'], ['Time','NOPE'], registry=registry)
+        assert flights['SOCRATES'] == {}
+        flights = flight_utils.read_all_flights(str(tmp_path), ['SOCRATES'], ['Time','GGLAT','LATC'], registry=registry)
+        assert list(flights['SOCRATES']) == ['rf01.nc', 'rf04.nc']
+        flights = flight_utils.read_all_flights(str(tmp_path), ['SOCRATES'], ['Time','GGALT'], registry=registry)
+        assert list(flights['SOCRATES']) == ['rf01.nc', 'rf04.nc']
+        flights = flight_utils.read_all_flights(str(tmp_path), ['SOCRATES'], ['Time','GGALT','GGALT'],
+                                                registry=registry)
+        assert list(flights['SOCRATES']) == ['rf01.nc', 'rf04.nc']
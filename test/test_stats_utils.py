@@ -0,0 +1,82 @@
+import sys
+sys.path.append('..')
+import util.stats_utils as utils
+import pandas as pd
+import numpy as np
+
+def make_samples(n: int, seed: int) -> tuple[np.ndarray, pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    cell_ids = rng.integers(-1, 20, n) # -1 is a sample outside the grid
+    data = pd.DataFrame({'WIC': rng.standard_normal(n), 'ATX': 10 + 5*rng.standard_normal(n)})
+    data.loc[data.index[::7], 'ATX'] = np.nan
+    return cell_ids, data
+
+def test_cell_stats():
+    cell_ids, data = make_samples(1000, 0)
+    stats = utils.cell_stats(['WIC','ATX'])
+    stats.add(cell_ids, data)
+    df = stats.to_dataframe(grid_shape=(1,1,4,5))
+
+    # compare with a pandas group-by of the same samples
+    in_cell = cell_ids >= 0
+    expected = data[in_cell].groupby(cell_ids[in_cell])
+    assert np.array_equal(df.index, sorted(set(cell_ids[in_cell])))
+    for var in ['WIC','ATX']:
+        assert np.array_equal(df[f"{var}_count"], expected[var].count())
+        assert np.allclose(df[f"{var}_mean"], expected[var].mean())
+        assert np.allclose(df[f"{var}_var"], expected[var].var(ddof=0))
+        assert np.array_equal(df[f"{var}_min"], expected[var].min())
+        assert np.array_equal(df[f"{var}_max"], expected[var].max())
+    assert np.array_equal(df['lat_idx'], df.index // 5)
+    assert np.array_equal(df['lon_idx'], df.index % 5)
+
+def test_cell_stats_merge():
+    # accumulating in batches, or in separate accumulators that are merged, equals one accumulation of all samples
+    cell_ids, data = make_samples(3000, 1)
+    whole = utils.cell_stats(['WIC','ATX'])
+    whole.add(cell_ids, data)
+
+    batched = utils.cell_stats(['WIC','ATX'])
+    parts = []
+    for start in range(0, 3000, 700):
+        batched.add(cell_ids[start:start+700], data[start:start+700])
+        part = utils.cell_stats(['WIC','ATX'])
+        part.add(cell_ids[start:start+700], data[start:start+700])
+        parts.append(part)
+    merged = utils.cell_stats(['WIC','ATX'])
+    for part in parts[::-1]:
+        merged.merge(part)
+
+    expected = whole.to_dataframe()
+    pd.testing.assert_frame_equal(batched.to_dataframe(), expected)
+    pd.testing.assert_frame_equal(merged.to_dataframe(), expected)
+
+def test_cell_histogram():
+    cell_ids, data = make_samples(200000, 2)
+    edges = np.linspace(-5, 5, 1001)
+    hist = utils.cell_histogram('WIC', edges)
+    parts = []
+    for start in range(0, 200000, 60000):
+        part = utils.cell_histogram('WIC', edges)
+        part.add(cell_ids[start:start+60000], data[start:start+60000])
+        parts.append(part)
+        hist.add(cell_ids[start:start+60000], data[start:start+60000])
+    merged = utils.cell_histogram('WIC', edges)
+    for part in parts:
+        merged.merge(part)
+
+    # merging is exact, and memory is a fixed number of counts per cell
+    assert np.array_equal(merged.counts, hist.counts)
+    assert hist.counts.shape == (20, 1002)
+
+    # quantiles agree with exact ones to within a bin width
+    in_cell = cell_ids >= 0
+    expected = data[in_cell].groupby(cell_ids[in_cell])['WIC'].quantile([0.05, 0.5, 0.95]).unstack()
+    assert np.allclose(hist.quantiles([0.05, 0.5, 0.95]), expected, atol=0.01)
+    df = hist.to_dataframe(grid_shape=(1,1,4,5))
+    assert list(df.keys()) == ['time_idx','lev_idx','lat_idx','lon_idx','WIC_count','WIC_q05','WIC_q50','WIC_q95']
+    assert np.array_equal(df['WIC_count'], data[in_cell].groupby(cell_ids[in_cell])['WIC'].count())
+
+    # the PDF integrates to the fraction of samples within the edges
+    inside = data[in_cell].groupby(cell_ids[in_cell])['WIC'].apply(lambda x: np.mean(np.abs(x) <= 5))
+    assert np.allclose((hist.pdf()*np.diff(edges)).sum(axis=1), inside)
@@ -0,0 +1,400 @@
+import hashlib
+import json
+import os
+import pathlib as path
+import shutil
+import pandas as pd
+import numpy as np
+import util.mapping_utils as mapping_utils
+import util.profile_utils as profile_utils
+
+def _dir_size(dir_path: path.Path) -> int:
+    """
+    _dir_size returns the total size in bytes of the files in a directory.
+    """
+    return sum(f.stat().st_size for f in dir_path.iterdir())
+
+class flight_cache:
+    """
+    flight_cache is a persistent, on-disk cache of decoded flight data columns. Each cache entry is a directory holding
+    one .npy file per decoded column and a manifest.json describing the flight file it was decoded from.
+
+    Entries are keyed by the flight file's resolved path, size, modification time and the sample rate it was decoded
+    at, so a modified file automatically misses the cache. Columns are stored individually, so variables that were
+    not requested before are appended to an existing entry without re-decoding the cached ones. Variables that turned
+    out not to exist in the file are remembered as well, so they are not looked for again.
+
+    The total size of the cache is capped at max_bytes. When a write pushes it over the cap, the least recently used
+    entries are evicted. The size is tracked in memory as entries are written, so a write only lists the whole cache
+    (once, and then when evicting) rather than every time; entries written by other processes are counted when it
+    is next listed.
+
+    The __init__ takes a cache directory path string (created if needed) and the size cap in bytes (1 GiB by default).
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 2**30):
+        self.cache_dir = path.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._size = None # the running total size in bytes, None until the cache is first listed
+
+    def _key(self, file_path: str, rate: int) -> tuple[str, dict]:
+        """
+        _key computes the cache key of a flight file decoded at a given rate.
+
+        :param file_path: A path string to a flight data file.
+        :param rate: The sample rate in Hz the file is decoded at.
+
+        :return: Returns a tuple of the key string and a dictionary of the file identity it was computed from.
+        """
+        fp_path = path.Path(file_path).resolve()
+        stat = fp_path.stat()
+        ident = {'file_path': str(fp_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'rate': rate}
+        key = hashlib.sha1(json.dumps(ident, sort_keys=True).encode()).hexdigest()
+        return key, ident
+
+    def _read_manifest(self, entry_dir: path.Path) -> dict:
+        try:
+            with open(entry_dir / 'manifest.json') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, entry_dir: path.Path, manifest: dict):
+        tmp = entry_dir / f'manifest.json.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, entry_dir / 'manifest.json')
+
+    def _load_entry(self, key: str, names: list[str]) -> tuple[dict, dict[str,np.ndarray]]:
+        """
+        _load_entry reads the named columns of a cache entry, skipping any that are not cached or unreadable.
+
+        :return: Returns a tuple of the entry's manifest (None if there is no entry) and a dictionary of the columns
+                 read (name -> array).
+        """
+        entry_dir = self.cache_dir / key
+        manifest = self._read_manifest(entry_dir)
+        if manifest is None:
+            return None, {}
+        columns = {}
+        for name in names:
+            if name not in manifest['columns']:
+                continue
+            try:
+                columns[name] = np.load(entry_dir / f'{name}.npy', allow_pickle=False)
+            except (OSError, ValueError):
+                pass
+
+        # touch the manifest so eviction sees this entry as recently used
+        try:
+            os.utime(entry_dir / 'manifest.json')
+        except OSError:
+            pass
+        return manifest, columns
+
+    def _store_entry(self, key: str, ident: dict, columns: dict[str,np.ndarray], absent: list[str] = None):
+        """
+        _store_entry adds columns to a cache entry, creating it if needed, and then evicts least recently used entries
+                     if the cache is over its size cap.
+        """
+        if self._size is None:
+            self._size = self.size()
+        entry_dir = self.cache_dir / key
+        entry_dir.mkdir(exist_ok=True)
+        size_before = _dir_size(entry_dir)
+        manifest = self._read_manifest(entry_dir) or dict(ident, columns=[], absent=[])
+
+        for name, data in columns.items():
+            data = np.asarray(data)
+            if data.dtype == object:
+                continue # only plain numeric and datetime64 columns are cached
+            tmp = entry_dir / f'{name}.npy.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, data, allow_pickle=False)
+            os.replace(tmp, entry_dir / f'{name}.npy')
+            if name not in manifest['columns']:
+                manifest['columns'].append(name)
+        manifest['absent'] = sorted(set(manifest['absent']) | set(absent or ()))
+        self._write_manifest(entry_dir, manifest)
+
+        self._size += _dir_size(entry_dir) - size_before
+        if self._size > self.max_bytes:
+            self.evict(keep=key)
+
+    def load(self, file_path: str, rate: int, read_vars: list[str]) -> tuple[dict[str,np.ndarray], list[str]]:
+        """
+        load looks up the requested variables of a flight file in the cache.
+
+        :param file_path: A path string to a flight data file.
+        :param rate: The sample rate in Hz the file is decoded at.
+        :param read_vars: A list of variable names to be read.
+
+        :return: Returns a tuple of a dictionary of cached columns (variable name -> array) and a list of the
+                 variables that are neither cached nor known to be absent from the file, i.e. still need decoding.
+                 The 'datetime' column is returned along with 'Time'.
+        """
+        key, _ = self._key(file_path, rate)
+        names = [name for var in read_vars for name in ([var, 'datetime'] if var == 'Time' else [var])]
+        manifest, loaded = self._load_entry(key, names)
+        if manifest is None:
+            return {}, list(read_vars)
+
+        columns = {}
+        to_read = []
+        for var in read_vars:
+            if var in manifest['absent']:
+                continue
+            names = [var, 'datetime'] if var == 'Time' else [var]
+            if all(name in loaded for name in names):
+                columns.update((name, loaded[name]) for name in names)
+            else:
+                to_read.append(var)
+        return columns, to_read
+
+    def store(self, file_path: str, rate: int, columns: dict[str,np.ndarray], absent: list[str] = None):
+        """
+        store adds decoded columns to the cache entry of a flight file, creating the entry if needed, and then evicts
+        least recently used entries if the cache is over its size cap.
+
+        :param file_path: A path string to a flight data file.
+        :param rate: The sample rate in Hz the file was decoded at.
+        :param columns: A dictionary of variable name -> 1-D array of decoded data.
+        :param absent: A list of variable names that could not be read from the file. Optional.
+        """
+        key, ident = self._key(file_path, rate)
+        self._store_entry(key, ident, columns, absent)
+
+    def _entries(self) -> list[tuple[float,int,path.Path]]:
+        """
+        _entries lists the cache entries as tuples of (last use time, size in bytes, entry directory).
+        """
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            try:
+                size = _dir_size(entry_dir)
+            except OSError:
+                continue # removed by another process
+            try:
+                last_used = (entry_dir / 'manifest.json').stat().st_mtime
+            except OSError:
+                last_used = 0. # an entry without a manifest is the first to go
+            entries.append((last_used, size, entry_dir))
+        return entries
+
+    def size(self) -> int:
+        """
+        size returns the total size of the cache entries in bytes.
+        """
+        return sum(size for (_, size, _) in self._entries())
+
+    def evict(self, keep: str = None):
+        """
+        evict removes the least recently used entries until the cache is no larger than max_bytes.
+
+        :param keep: An optional key of an entry that must not be evicted, e.g. the one just written.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, entry_dir) in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_dir.name == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+        self._size = total
+
+    def invalidate(self, file_path: str = None):
+        """
+        invalidate removes cache entries.
+
+        :param file_path: A path string to a flight data file. Optional. If given, only the entries (at any rate or
+                          modification time) of that file are removed. Otherwise the whole cache is cleared.
+        """
+        resolved = str(path.Path(file_path).resolve()) if file_path is not None else None
+        for (_, _, entry_dir) in self._entries():
+            if resolved is not None:
+                manifest = self._read_manifest(entry_dir)
+                if manifest is None or manifest['file_path'] != resolved:
+                    continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        self._size = None
+
+def calc_grid_hash(lats: np.ndarray, lons: np.ndarray, model_times: np.ndarray = None, hyai: np.array = None,
+                   hybi: np.array = None, method: str = 'hydro', sources: list[str] = None) -> str:
+    """
+    calc_grid_hash computes a hash of a model grid definition, to key cached sample-to-cell mappings by.
+
+    :param lats: A 1-D array of the model grid cell center latitudes
+    :param lons: A 1-D array of the model grid cell center longitudes
+    :param model_times: A 1-D array of the model output times (datetime64 or cftime). Optional.
+    :param hyai: An array of a hybrid interface coefficients. Optional.
+    :param hybi: An array of b hybrid interface coefficients. Optional.
+    :param method: The name of how the interface heights were computed, e.g. 'hydro' (calc_phii_hydro_cesm) or
+                   'midpoint' (calc_phii_midpoint). Optional. Default is 'hydro'.
+    :param sources: A list of path strings to the model files the interface heights were computed from. Optional.
+                    Their identities (resolved path, size and modification time) are hashed, so a rewritten model
+                    file changes the hash.
+
+    :return: Returns the hash as a hex string.
+    """
+    h = hashlib.sha1()
+    for name, values in [('lats', lats), ('lons', lons), ('hyai', hyai), ('hybi', hybi)]:
+        h.update(name.encode())
+        if values is not None:
+            h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    h.update(b'times')
+    if model_times is not None:
+        h.update(mapping_utils.to_datetime64(model_times).astype(np.int64).tobytes())
+    h.update(method.encode())
+    for source in sources or ():
+        fp_path = path.Path(source).resolve()
+        stat = fp_path.stat()
+        h.update(json.dumps([str(fp_path), stat.st_size, stat.st_mtime_ns]).encode())
+    return h.hexdigest()
+
+class mapping_cache(flight_cache):
+    """
+    mapping_cache is a persistent, on-disk cache of the grid cells (from mapping_utils.map_flight_to_grid or
+    cam_utils.cam_subset.map_flight) and interpolation weights (mapping_utils.interp_weights) of flight samples, so
+    binning or sampling more variables of a flight on a grid it was already mapped to skips all geometry work.
+
+    Entries are laid out and evicted like those of flight_cache, and keyed by the flight file's identity, the sample
+    rate, the first and last sample times of the flight DataFrame (so differently windowed reads of a file do not
+    share entries) and a hash of the grid (see calc_grid_hash). Cell indices and the flat indices of interpolation
+    weights are stored as int32 (int16 for levels, and int64 for flat indices of grids of 2**31 points or more) and
+    interpolation weights as float32. The __init__ takes a cache directory path string (created if needed) and the
+    size cap in bytes (1 GiB by default).
+    """
+    cell_columns = ['time_idx','lev_idx','lat_idx','lon_idx','valid']
+    weight_columns = ['interp_grid_shape','interp_valid','interp_flat','interp_weights']
+
+    def _grid_key(self, file_path: str, rate: int, grid_hash: str, df: pd.DataFrame) -> tuple[str, dict]:
+        """
+        _grid_key computes the cache key of a flight DataFrame, decoded from a file at a given rate, mapped to a given
+                  grid.
+        """
+        _, ident = self._key(file_path, rate)
+        times = mapping_utils.get_flight_position(df)[0] if len(df) > 0 else []
+        ident['span'] = [str(times[0]), str(times[-1])] if len(times) > 0 else None
+        ident['grid_hash'] = grid_hash
+        key = hashlib.sha1(json.dumps(ident, sort_keys=True).encode()).hexdigest()
+        return key, ident
+
+    def load_cells(self, file_path: str, rate: int, grid_hash: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        load_cells looks up the grid cells of a flight's samples.
+
+        :param file_path: A path string to the flight data file
+        :param rate: The sample rate in Hz the flight was decoded at
+        :param grid_hash: The hash of the grid, from calc_grid_hash
+        :param df: The flight DataFrame. Cells cached for a different number of samples are treated as not cached.
+
+        :return: Returns a DataFrame like map_flight_to_grid's, with the index of df, or None if the cells are not
+                 cached.
+        """
+        key, _ = self._grid_key(file_path, rate, grid_hash, df)
+        _, columns = self._load_entry(key, self.cell_columns)
+        if len(columns) < len(self.cell_columns) or len(columns['valid']) != len(df):
+            return None
+        cells = pd.DataFrame({name: columns[name].astype(np.intp) for name in self.cell_columns[:-1]}, index=df.index)
+        cells['valid'] = columns['valid'].astype(bool)
+        return cells
+
+    def store_cells(self, file_path: str, rate: int, grid_hash: str, df: pd.DataFrame, cells: pd.DataFrame):
+        """
+        store_cells adds the grid cells of a flight's samples to the cache.
+
+        :param file_path: A path string to the flight data file
+        :param rate: The sample rate in Hz the flight was decoded at
+        :param grid_hash: The hash of the grid, from calc_grid_hash
+        :param df: The flight DataFrame
+        :param cells: A DataFrame from map_flight_to_grid of df
+        """
+        key, ident = self._grid_key(file_path, rate, grid_hash, df)
+        columns = {name: cells[name].to_numpy().astype(np.int16 if name == 'lev_idx' else np.int32)
+                   for name in self.cell_columns[:-1]}
+        columns['valid'] = cells['valid'].to_numpy(dtype=bool)
+        self._store_entry(key, ident, columns)
+
+    def load_weights(self, file_path: str, rate: int, grid_hash: str,
+                     df: pd.DataFrame) -> mapping_utils.interp_weights:
+        """
+        load_weights looks up the interpolation weights of a flight's samples.
+
+        :param file_path: A path string to the flight data file
+        :param rate: The sample rate in Hz the flight was decoded at
+        :param grid_hash: The hash of the grid, from calc_grid_hash
+        :param df: The flight DataFrame. Weights cached for a different number of samples are treated as not cached.
+
+        :return: Returns a mapping_utils.interp_weights, or None if the weights are not cached.
+        """
+        key, _ = self._grid_key(file_path, rate, grid_hash, df)
+        _, columns = self._load_entry(key, self.weight_columns)
+        if len(columns) < len(self.weight_columns) or len(columns['interp_valid']) != len(df):
+            return None
+        return mapping_utils.interp_weights.from_arrays(df.index, columns['interp_grid_shape'], columns['interp_valid'],
+                                                        columns['interp_flat'], columns['interp_weights'])
+
+    def store_weights(self, file_path: str, rate: int, grid_hash: str, df: pd.DataFrame,
+                      weights: mapping_utils.interp_weights):
+        """
+        store_weights adds the interpolation weights of a flight's samples to the cache.
+
+        :param file_path: A path string to the flight data file
+        :param rate: The sample rate in Hz the flight was decoded at
+        :param grid_hash: The hash of the grid, from calc_grid_hash
+        :param df: The flight DataFrame
+        :param weights: A mapping_utils.interp_weights of df
+        """
+        key, ident = self._grid_key(file_path, rate, grid_hash, df)
+        flat_dtype = np.int32 if np.prod(weights.grid_shape, dtype=np.int64) < 2**31 else np.int64
+        self._store_entry(key, ident, {'interp_grid_shape': np.array(weights.grid_shape, dtype=np.int64),
+                                       'interp_valid': weights.valid,
+                                       'interp_flat': weights.flat.astype(flat_dtype),
+                                       'interp_weights': weights.weights.astype(np.float32)})
+
+    def cells(self, df: pd.DataFrame, file_path: str, rate: int, grid_hash: str, compute) -> pd.DataFrame:
+        """
+        cells returns the grid cells of a flight's samples from the cache, or computes and caches them.
+
+        :param df: A flight DataFrame
+        :param file_path: A path string to the flight data file df was read from
+        :param rate: The sample rate in Hz df was decoded at
+        :param grid_hash: The hash of the grid, from calc_grid_hash
+        :param compute: A function of df returning its cells, e.g. subset.map_flight or a lambda calling
+                        map_flight_to_grid, only called (and the geometry it needs only built) on a cache miss
+
+        :return: Returns a DataFrame like map_flight_to_grid's.
+        """
+        with profile_utils.stage('mapping.cache_load'):
+            cells = self.load_cells(file_path, rate, grid_hash, df)
+        if cells is not None:
+            profile_utils.count('mapping.cache_hits')
+            return cells
+        cells = compute(df)
+        self.store_cells(file_path, rate, grid_hash, df, cells)
+        return cells
+
+    def weights(self, df: pd.DataFrame, file_path: str, rate: int, grid_hash: str,
+                compute) -> mapping_utils.interp_weights:
+        """
+        weights returns the interpolation weights of a flight's samples from the cache, or computes and caches them.
+
+        :param df: A flight DataFrame
+        :param file_path: A path string to the flight data file df was read from
+        :param rate: The sample rate in Hz df was decoded at
+        :param grid_hash: The hash of the grid, from calc_grid_hash
+        :param compute: A function of df returning its mapping_utils.interp_weights, e.g. subset.interp_weights, only
+                        called on a cache miss
+
+        :return: Returns a mapping_utils.interp_weights.
+        """
+        with profile_utils.stage('mapping.cache_load'):
+            weights = self.load_weights(file_path, rate, grid_hash, df)
+        if weights is not None:
+            profile_utils.count('mapping.cache_hits')
+            return weights
+        weights = compute(df)
+        self.store_weights(file_path, rate, grid_hash, df, weights)
+        return weights
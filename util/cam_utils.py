@@ -0,0 +1,482 @@
+import collections
+import json
+import pathlib as path
+import netCDF4
+import pandas as pd
+import numpy as np
+import xarray as xr
+import util.model_utils as model_utils
+import util.mapping_utils as mapping_utils
+import util.profile_utils as profile_utils
+
+# the CAM history fields read_cam_subset reads by default, when they are in the file
+cam_vars_to_read = ['PS','T','Q','Z3','PHIS']
+
+# the level coefficients and reference pressure needed alongside them
+cam_coords_to_read = ['hyai','hybi','hyam','hybm','P0']
+
+def _lon_span(lon_idx: np.ndarray, nlon: int, halo: int) -> np.ndarray:
+    """
+    _lon_span finds the shortest run of longitude indices, going east and possibly wrapping around, that covers a set
+              of longitude indices, extended by halo indices on either side.
+
+    :return: Returns an int array of the longitude indices of the run, in order.
+    """
+    visited = np.unique(lon_idx)
+    # the run is the complement of the largest gap between visited indices around the circle
+    gaps = np.diff(np.append(visited, visited[0] + nlon))
+    k = np.argmax(gaps)
+    first = visited[(k + 1) % len(visited)]
+    length = (visited[k] - first) % nlon + 1 + 2*halo
+    if length >= nlon:
+        return np.arange(nlon)
+    return (first - halo + np.arange(length)) % nlon
+
+def find_footprint(dfs: list[pd.DataFrame], lats: np.ndarray, lons: np.ndarray, model_times: np.ndarray,
+                   halo: int = 1) -> dict[str,np.ndarray]:
+    """
+    find_footprint works out the part of a model grid a set of flights passes through: the range of output times
+                   around the flights, and the latitudes and longitudes they visit, plus a halo of grid cells. The
+                   longitude range is dateline-aware, i.e. a flight across the dateline (or the model's 0/360 seam)
+                   gets a short range that wraps around, not the whole globe.
+
+    :param dfs: A list of flight DataFrames (see mapping_utils.get_flight_position for the needed columns)
+    :param lats: A 1-D array of the model grid cell center latitudes
+    :param lons: A 1-D array of the model grid cell center longitudes
+    :param model_times: A 1-D array of increasing model output times (datetime64 or cftime)
+    :param halo: The number of grid cells to add around the visited ones in latitude and longitude. Optional. Default
+                 is 1, enough for horizontal interpolation between neighboring columns.
+
+    :return: Returns a dictionary of int arrays of the 'time', 'lat' and 'lon' indices of the footprint. Time and
+             latitude indices are contiguous ranges, and longitude indices a run that may wrap around, e.g.
+             [286, 287, 0, 1].
+    """
+    lat_edges = mapping_utils.calc_cell_edges(lats)
+    lon_edges = mapping_utils.calc_cell_edges(lons, periodic=True)
+    model_times = mapping_utils.to_datetime64(model_times)
+
+    lat_idx, lon_idx, times = [], [], []
+    for df in dfs:
+        t, lat, lon, _ = mapping_utils.get_flight_position(df)
+        j = mapping_utils.find_lat_idx(lat, lat_edges)
+        i = mapping_utils.find_lon_idx(lon, lon_edges)
+        ok = (j >= 0) & (i >= 0) & ~np.isnat(t)
+        lat_idx.append(j[ok])
+        lon_idx.append(i[ok])
+        times.append(t[ok])
+    lat_idx, lon_idx, times = np.concatenate(lat_idx), np.concatenate(lon_idx), np.concatenate(times)
+    if len(times) == 0:
+        raise ValueError("The flights have no valid positions on the model grid")
+
+    # every output time a sample is nearest to, or between
+    ntimes = len(model_times)
+    t0 = np.clip(np.searchsorted(model_times, times.min(), side='right') - 1, 0, ntimes - 1)
+    t1 = np.clip(np.searchsorted(model_times, times.max(), side='left'), 0, ntimes - 1)
+
+    j0 = max(lat_idx.min() - halo, 0)
+    j1 = min(lat_idx.max() + halo, len(lats) - 1)
+    return {'time': np.arange(t0, t1 + 1), 'lat': np.arange(j0, j1 + 1), 'lon': _lon_span(lon_idx, len(lons), halo)}
+
+def _isel_lon(ds: xr.Dataset, lon_idx: np.ndarray) -> xr.Dataset:
+    """
+    _isel_lon selects longitudes by index as contiguous slices, which lazily loaded datasets read as hyperslabs. A run
+              wrapping around the seam is read as two slices and joined.
+    """
+    breaks = np.flatnonzero(np.diff(lon_idx) != 1) + 1
+    runs = np.split(lon_idx, breaks)
+    parts = [ds.isel(lon=slice(run[0], run[-1] + 1)) for run in runs]
+    return parts[0] if len(parts) == 1 else xr.concat(parts, dim='lon', data_vars='minimal', coords='minimal',
+                                                      compat='override')
+
+@profile_utils.timed('cam.read_cam_subset')
+def read_cam_subset(ds, footprint: dict[str,np.ndarray], read_vars: list[str] = cam_vars_to_read) -> xr.Dataset:
+    """
+    read_cam_subset reads only the footprint (see find_footprint) of a CAM history file's fields into memory.
+
+    :param ds: An xarray Dataset of a CAM history file, e.g. from xr.open_dataset (which loads lazily), or a path
+               string to one
+    :param footprint: A dictionary of 'time', 'lat' and 'lon' index arrays, e.g. from find_footprint
+    :param read_vars: A list of the fields to read. Optional. Default is cam_vars_to_read (PS, T, Q, Z3 and PHIS),
+                      skipping any not in the file. The hybrid level coefficients and P0 are always read.
+
+    :return: Returns an in-memory xarray Dataset of the fields on the footprint's times, latitudes and longitudes.
+    """
+    if isinstance(ds, (str, path.Path)):
+        with xr.open_dataset(ds) as opened:
+            return read_cam_subset(opened, footprint, read_vars)
+
+    names = [name for name in list(read_vars) + cam_coords_to_read if name in ds.variables]
+    subset = ds[names].isel(time=slice(footprint['time'][0], footprint['time'][-1] + 1),
+                            lat=slice(footprint['lat'][0], footprint['lat'][-1] + 1))
+    subset = _isel_lon(subset, footprint['lon']).load()
+    profile_utils.count('cam.bytes_read', int(subset.nbytes))
+    return subset
+
+class cam_subset:
+    """
+    cam_subset holds the part of a CAM history file a set of flights passes through, and the model geometry computed
+    on just that part, so that I/O and compute scale with the flights' footprint rather than the model resolution.
+
+    The __init__ takes a list of flight DataFrames, an xarray Dataset of (or a path string to) a CAM history file,
+    the halo in grid cells around the visited cells (1 by default) and the fields to read (cam_vars_to_read by
+    default). It reads the footprint's fields with read_cam_subset and, if T, Q, PS and PHIS were read, integrates
+    the hydrostatic interface heights with model_utils.calc_phii_hydro_cesm.
+    The __init__ assigns:
+    self.footprint: dict[str,np.ndarray]; the global 'time', 'lat' and 'lon' indices of the subset (see find_footprint)
+    self.grid_shape: tuple[int,int,int,int]; the (ntime, nlev, nlat, nlon) shape of the full model grid
+    self.ds: xr.Dataset; the fields on the subset
+    self.zi: np.ndarray; the (ntime by nlev+1 by nlat by nlon) interface heights of the subset, surface first, or None
+    """
+    def __init__(self, dfs: list[pd.DataFrame], ds, halo: int = 1, read_vars: list[str] = cam_vars_to_read):
+        if isinstance(ds, (str, path.Path)):
+            with xr.open_dataset(ds) as opened:
+                self.__init__(dfs, opened, halo, read_vars)
+            return
+
+        self.model_times = mapping_utils.to_datetime64(ds.time.values)
+        self.lats = ds.lat.values
+        self.lons = ds.lon.values
+        self.grid_shape = (ds.sizes['time'], ds.sizes['lev'], ds.sizes['lat'], ds.sizes['lon'])
+        self.footprint = find_footprint(dfs, self.lats, self.lons, self.model_times, halo)
+        self.ds = read_cam_subset(ds, self.footprint, read_vars)
+
+        self.zi = None
+        if all(name in self.ds for name in ['PS','T','Q','PHIS']):
+            s = self.ds
+            hyam, hybm = (s.hyam.values, s.hybm.values) if 'hyam' in s and 'hybm' in s else (None, None)
+            self.zi = model_utils.calc_phii_hydro_cesm(s.PS.values, s.P0.values, s.hyai.values, s.hybi.values,
+                                                       s.T.values, s.Q.values, s.PHIS.values, hyam, hybm)
+
+    def to_local(self, time_idx: np.ndarray, lat_idx: np.ndarray, lon_idx: np.ndarray) -> tuple[np.ndarray,...]:
+        """
+        to_local converts global grid indices to indices into the subset's arrays.
+
+        :return: Returns a tuple of int arrays of the local time, lat and lon indices, -1 where a global index is -1
+                 or outside the subset.
+        """
+        local = []
+        for idx, subset_idx, size in zip([time_idx, lat_idx, lon_idx],
+                                         [self.footprint['time'], self.footprint['lat'], self.footprint['lon']],
+                                         [self.grid_shape[0], self.grid_shape[2], self.grid_shape[3]]):
+            lookup = np.full(size + 1, -1, dtype=np.intp) # the extra last entry maps an index of -1 to -1
+            lookup[subset_idx] = np.arange(len(subset_idx))
+            local.append(lookup[np.asarray(idx)])
+        return tuple(local)
+
+    def interp_weights(self, df: pd.DataFrame) -> mapping_utils.interp_weights:
+        """
+        interp_weights computes the weights interpolating the subset's fields onto a flight's samples, e.g.
+
+            weights = subset.interp_weights(df)
+            sampled = weights.sample_dataset(subset.ds)
+
+        :param df: A flight DataFrame (see mapping_utils.get_flight_position for the needed columns)
+
+        :return: Returns a mapping_utils.interp_weights on the subset's grid.
+        """
+        if self.zi is None:
+            raise ValueError("The subset has no interface heights (T, Q, PS and PHIS are needed)")
+        return mapping_utils.interp_weights(df, self.ds.lat.values, self.ds.lon.values, self.zi,
+                                            self.model_times[self.footprint['time']])
+
+    def map_flight(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        map_flight assigns every sample of a flight to a model grid cell, like mapping_utils.map_flight_to_grid with
+                   the interface heights of the full grid, but using only the subset.
+
+        :param df: A flight DataFrame (see mapping_utils.get_flight_position for the needed columns)
+
+        :return: Returns a DataFrame of the global grid cell indices of each sample ('time_idx', 'lev_idx', 'lat_idx',
+                 'lon_idx', -1 where the sample is outside the grid or the subset) and a boolean 'valid' column.
+        """
+        if self.zi is None:
+            raise ValueError("The subset has no interface heights (T, Q, PS and PHIS are needed)")
+        times, lat, lon, alt = mapping_utils.get_flight_position(df)
+        time_idx = mapping_utils.find_time_idx(times, self.model_times)
+        lat_idx = mapping_utils.find_lat_idx(lat, mapping_utils.calc_cell_edges(self.lats))
+        lon_idx = mapping_utils.find_lon_idx(lon, mapping_utils.calc_cell_edges(self.lons, periodic=True))
+        t, j, i = self.to_local(time_idx, lat_idx, lon_idx)
+        lev_idx = mapping_utils.find_lev_idx(self.zi, t, j, i, alt)
+
+        cells = pd.DataFrame({'time_idx': time_idx, 'lev_idx': lev_idx, 'lat_idx': lat_idx, 'lon_idx': lon_idx},
+                             index=df.index)
+        cells['valid'] = (lev_idx >= 0)
+        cells.loc[~cells['valid'].to_numpy(), ['time_idx','lev_idx','lat_idx','lon_idx']] = -1
+        return cells
+
+def scan_cam_file(file_path: str) -> dict:
+    """
+    scan_cam_file reads the output times and grid of a CAM history file, without reading any fields.
+
+    :param file_path: A path string to a CAM history file
+
+    :return: Returns a dictionary of the file's identity (resolved path, size, mtime_ns), its output times (ISO
+             strings) and its grid as the (nlev, nlat, nlon) sizes.
+    """
+    fp_path = path.Path(file_path).resolve()
+    stat = fp_path.stat()
+    with netCDF4.Dataset(str(fp_path)) as nc:
+        ncvar = nc['time']
+        times = netCDF4.num2date(ncvar[:], ncvar.units, getattr(ncvar, 'calendar', 'standard'))
+        grid = [len(nc.dimensions[name]) for name in ['lev','lat','lon']]
+    return {'file_path': str(fp_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'times': [str(t) for t in mapping_utils.to_datetime64(np.atleast_1d(times))], 'grid': grid}
+
+def _read_coords(file_path: str) -> dict[str,np.ndarray]:
+    """
+    _read_coords reads the horizontal coordinates, hybrid level coefficients and P0 of a CAM history file.
+    """
+    with netCDF4.Dataset(file_path) as nc:
+        return {name: np.asarray(nc[name][:]) for name in ['lat','lon'] + cam_coords_to_read if name in nc.variables}
+
+class cam_catalog:
+    """
+    cam_catalog is an index of the output times of a set of CAM history files on the same grid, e.g. one stream
+    (h0, h1, ...) of a run, so that the files and records bracketing a flight can be found without opening them.
+
+    The index maps every output time, sorted, to the file and record (index along the time dimension) holding it.
+    The grid coordinates (lat, lon, the hybrid level coefficients and P0) are read once, from the first file scanned,
+    and again whenever the catalog's only file is rescanned or the catalog empties.
+    Scans only read the time variable of files that are new or whose size or modification time changed, and the
+    catalog is persisted with save and load.
+
+    Datasets are opened on demand with xr.open_dataset (which loads lazily) and kept in a pool of at most max_open
+    open datasets, the least recently used one being closed when the pool is full, so that mapping a long campaign
+    neither runs out of file descriptors nor reopens (and re-decodes the coordinates of) the same files for every
+    flight. The catalog is a context manager that closes the pool on exit.
+
+    The __init__ takes the size of the pool (8 by default). The __init__ assigns:
+    self.max_open: int; the most datasets kept open at once
+    self.coords: dict[str,np.ndarray]; the grid coordinates, or None before any file is added
+    self.index: pd.DataFrame; one row per output time, sorted by time, with the 'time', 'file_path' and 'record' of
+                each (a property built on first use)
+    """
+    def __init__(self, max_open: int = 8):
+        self.max_open = max_open
+        self.coords = None
+        self._files = {} # resolved file path -> scan_cam_file result
+        self._index = None
+        self._pool = collections.OrderedDict() # file path -> open dataset, least recently used first
+
+    def close(self):
+        """
+        close closes every dataset in the pool.
+        """
+        while self._pool:
+            self._pool.popitem(last=False)[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def is_current(self, file_path: str) -> bool:
+        """
+        is_current checks that a file is in the catalog and has not changed since it was scanned.
+
+        :param file_path: A path string to a CAM history file
+
+        :return: Returns True if the cataloged size and modification time match the file's.
+        """
+        fp_path = path.Path(file_path).resolve()
+        record = self._files.get(str(fp_path))
+        try:
+            stat = fp_path.stat()
+        except OSError:
+            return False
+        return record is not None and (record['size'], record['mtime_ns']) == (stat.st_size, stat.st_mtime_ns)
+
+    def add_file(self, file_path: str):
+        """
+        add_file scans a CAM history file and adds its output times to the catalog, if it is new or changed.
+
+        :param file_path: A path string to a CAM history file
+
+        :raises ValueError: if the file's grid differs from that of the files already in the catalog
+        """
+        if self.is_current(file_path):
+            return
+        record = scan_cam_file(file_path)
+        # compare against the other files, not this file's own record from before it changed
+        others = [r for (fp, r) in self._files.items() if fp != record['file_path']]
+        if others:
+            grid = others[0]['grid']
+            if record['grid'] != grid:
+                raise ValueError(f"{file_path} has a (nlev, nlat, nlon) grid of {record['grid']}, not {grid}")
+        if not others or self.coords is None:
+            self.coords = _read_coords(record['file_path'])
+        stale = self._pool.pop(record['file_path'], None)
+        if stale is not None:
+            stale.close()
+        self._files[record['file_path']] = record
+        self._index = None
+
+    @profile_utils.timed('cam.catalog_scan')
+    def scan(self, data_dir: str, pattern: str = '*.nc') -> dict[str,str]:
+        """
+        scan adds every CAM history file in a directory matching a pattern. Only new or modified files are scanned,
+             and files that were cataloged from the directory but no longer exist are removed.
+
+        :param data_dir: A path string to a directory of CAM history files
+        :param pattern: A glob pattern of the files to add, e.g. '*.cam.h1.*.nc' for a single stream. Optional.
+                        Default is '*.nc'.
+
+        :return: Returns a dictionary of file path -> error message for the files that could not be scanned.
+        """
+        errors = {}
+        data_dir = path.Path(data_dir).resolve()
+        file_paths = sorted(str(fp) for fp in data_dir.glob(pattern))
+        for file_path in set(fp for fp in self._files if path.Path(fp).parent == data_dir) - set(file_paths):
+            self._forget(file_path)
+        for file_path in file_paths:
+            try:
+                self.add_file(file_path)
+            except Exception as e:
+                errors[file_path] = f"{type(e).__name__}: {e}"
+        return errors
+
+    def _forget(self, file_path: str):
+        del self._files[file_path]
+        stale = self._pool.pop(file_path, None)
+        if stale is not None:
+            stale.close()
+        if not self._files:
+            self.coords = None
+        self._index = None
+
+    @property
+    def index(self) -> pd.DataFrame:
+        if self._index is None:
+            records = list(self._files.values())
+            index = pd.DataFrame({'time': pd.to_datetime([t for r in records for t in r['times']]),
+                                  'file_path': [r['file_path'] for r in records for _ in r['times']],
+                                  'record': [k for r in records for k in range(len(r['times']))]})
+            self._index = index.sort_values('time', kind='stable').reset_index(drop=True)
+        return self._index
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.index['time'].to_numpy()
+
+    def bracket(self, start, end) -> pd.DataFrame:
+        """
+        bracket finds the output times needed to cover a time range: those within it, and the last one before and the
+                first one after it.
+
+        :param start: The start of the time range, anything pd.Timestamp accepts
+        :param end: The end of the time range
+
+        :return: Returns the rows of the index of the output times, sorted by time. It is empty if the range is
+                 entirely outside the cataloged times.
+        """
+        times = self.times
+        start, end = pd.Timestamp(start).to_datetime64(), pd.Timestamp(end).to_datetime64()
+        if len(times) == 0 or end < times[0] or start > times[-1]:
+            return self.index.iloc[:0]
+        t0 = max(np.searchsorted(times, start, side='right') - 1, 0)
+        t1 = min(np.searchsorted(times, end, side='left'), len(times) - 1)
+        return self.index.iloc[t0:t1 + 1]
+
+    def open(self, file_path: str) -> xr.Dataset:
+        """
+        open returns a cataloged file as a lazily loaded xarray Dataset from the pool, opening it (and closing the
+             least recently used dataset, if the pool is full) if it is not already open. The dataset stays usable
+             after it leaves the pool, but is then reopened when read.
+
+        :param file_path: A path string to a CAM history file
+
+        :return: Returns an xarray Dataset of the file.
+        """
+        file_path = str(path.Path(file_path).resolve())
+        if file_path in self._pool:
+            self._pool.move_to_end(file_path)
+            return self._pool[file_path]
+        ds = xr.open_dataset(file_path)
+        profile_utils.count('cam.files_opened')
+        self._pool[file_path] = ds
+        while len(self._pool) > self.max_open:
+            self._pool.popitem(last=False)[1].close()
+        return ds
+
+    def open_range(self, start, end, read_vars: list[str] = None) -> xr.Dataset:
+        """
+        open_range joins the records of the output times bracketing a time range (see bracket) into one dataset,
+                   opening only the files holding them. Records of a single file are selected lazily. Joining records
+                   of several files reads them (xr.concat loads its parts), so each file's records are loaded before
+                   the next file is opened: otherwise files the pool had meanwhile closed would be quietly reopened by
+                   xarray, beyond max_open.
+
+        :param start: The start of the time range, anything pd.Timestamp accepts
+        :param end: The end of the time range
+        :param read_vars: A list of the fields to keep (besides the level coefficients and P0) when records of several
+                          files are joined, so that only those are read. Optional. By default, every variable is kept.
+
+        :return: Returns an xarray Dataset of the bracketing output times, lazily loaded if they are in one file.
+
+        :raises ValueError: if the range is entirely outside the cataloged times
+        """
+        rows = self.bracket(start, end)
+        if len(rows) == 0:
+            raise ValueError(f"{start} to {end} is outside the cataloged times")
+        parts = []
+        # consecutive rows of the same file are selected together
+        runs = list(rows.groupby((rows['file_path'] != rows['file_path'].shift()).cumsum(), sort=False))
+        for _, run in runs:
+            part = self.open(run['file_path'].iloc[0]).isel(time=run['record'].to_numpy())
+            if len(runs) > 1:
+                if read_vars is not None:
+                    part = part[[name for name in list(read_vars) + cam_coords_to_read if name in part]]
+                part = part.load()
+            parts.append(part)
+        return parts[0] if len(parts) == 1 else xr.concat(parts, dim='time', data_vars='minimal', coords='minimal',
+                                                          compat='override')
+
+    def subset(self, dfs: list[pd.DataFrame], halo: int = 1, read_vars: list[str] = cam_vars_to_read) -> cam_subset:
+        """
+        subset reads the part of the model output a set of flights passes through (see cam_subset), from only the
+               files holding the output times bracketing the flights. To map a long campaign, call it once per flight
+               (or day of flights), so each call only touches a few files.
+
+        :param dfs: A list of flight DataFrames (see mapping_utils.get_flight_position for the needed columns)
+        :param halo: The number of grid cells to add around the visited ones. Optional. Default is 1.
+        :param read_vars: A list of the fields to read. Optional. Default is cam_vars_to_read.
+
+        :return: Returns a cam_subset. Its time indices are into its model_times, the bracketing output times, not
+                 into the catalog's times.
+        """
+        times = np.concatenate([mapping_utils.get_flight_position(df)[0] for df in dfs])
+        times = times[~np.isnat(times)]
+        if len(times) == 0:
+            raise ValueError("The flights have no valid times")
+        return cam_subset(dfs, self.open_range(times.min(), times.max(), read_vars), halo, read_vars)
+
+    def save(self, file_path: str):
+        """
+        save writes the catalog (but not the pool) to a JSON file.
+
+        :param file_path: A path string to the JSON file to write.
+        """
+        coords = None if self.coords is None else {name: value.tolist() for (name, value) in self.coords.items()}
+        with open(file_path, 'w') as f:
+            json.dump({'max_open': self.max_open, 'coords': coords, 'files': list(self._files.values())}, f)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'cam_catalog':
+        """
+        load reads a catalog written by save.
+
+        :param file_path: A path string to the JSON file to read.
+
+        :return: Returns a cam_catalog.
+        """
+        with open(file_path) as f:
+            saved = json.load(f)
+        catalog = cls(saved['max_open'])
+        if saved['coords'] is not None:
+            catalog.coords = {name: np.array(value) for (name, value) in saved['coords'].items()}
+        catalog._files = {record['file_path']: record for record in saved['files']}
+        return catalog
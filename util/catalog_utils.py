@@ -0,0 +1,275 @@
+import json
+import pathlib as path
+import pandas as pd
+import numpy as np
+import util.flight_utils as flight_utils
+
+def _read_position_1hz(nc, names: list[str]) -> np.ndarray:
+    """
+    _read_position_1hz reads the first of the named variables found in a flight file at 1 Hz, i.e. only the first
+                       sample of each second of high rate variables, with masked values as NaN.
+    """
+    for name in names:
+        if name in nc.variables:
+            ncvar = nc[name]
+            data = ncvar[:] if len(ncvar.shape) == 1 else ncvar[:,0]
+            return np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan)
+    raise KeyError(f"None of {names} are in {nc.filepath()}")
+
+def calc_lon_bounds(lons: np.ndarray) -> tuple[float, float]:
+    """
+    calc_lon_bounds finds the smallest longitude interval covering a set of longitudes, taking the dateline into
+                    account: a flight from 170E to 170W is bounded by (170, -170), not (-170, 170).
+
+    :param lons: An array of longitudes in degrees. NaNs are ignored.
+
+    :return: Returns a tuple of the western and eastern bounds in degrees in [-180, 180). The western bound is greater
+             than the eastern one when the interval crosses the dateline. Returns (nan, nan) if there are no
+             longitudes.
+    """
+    lons = np.unique(np.mod(np.asarray(lons, dtype=np.float64)[np.isfinite(lons)] + 180., 360.) - 180.)
+    if len(lons) == 0:
+        return np.nan, np.nan
+    # the interval is the complement of the largest gap between consecutive longitudes around the circle
+    gaps = np.diff(np.append(lons, lons[0] + 360.))
+    k = np.argmax(gaps)
+    return float(lons[(k + 1) % len(lons)]), float(lons[k])
+
+def calc_tile_ids(lats: np.ndarray, lons: np.ndarray, tile_deg: float) -> np.ndarray:
+    """
+    calc_tile_ids finds the coarse lat/lon tiles visited by a set of positions.
+
+    :param lats: An array of latitudes in degrees
+    :param lons: An array of longitudes in degrees, in any range
+    :param tile_deg: The tile size in degrees. Should divide 180 evenly.
+
+    :return: Returns a sorted int array of the unique ids (lat_tile*nlon_tiles + lon_tile) of the visited tiles.
+             Tiles start at (-90, -180). NaN positions are ignored.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    ok = np.isfinite(lats) & np.isfinite(lons)
+    nlat_tiles = int(round(180./tile_deg))
+    nlon_tiles = int(round(360./tile_deg))
+    lat_tile = np.clip(np.floor((lats[ok] + 90.)/tile_deg).astype(np.int64), 0, nlat_tiles - 1)
+    lon_tile = np.floor(np.mod(lons[ok] + 180., 360.)/tile_deg).astype(np.int64) % nlon_tiles
+    return np.unique(lat_tile*nlon_tiles + lon_tile)
+
+def scan_flight_extent(file_path: str, tile_deg: float = 5.) -> dict:
+    """
+    scan_flight_extent reads just the time and position variables of a flight file and summarizes where and when the
+                       flight went.
+
+    :param file_path: A path string to a flight data file
+    :param tile_deg: The size of the coarse track tiles in degrees. Optional. Default is 5.
+
+    :return: Returns a dictionary of the file path, rate (Hz), start and end times (ISO strings, UTC), latitude
+             bounds, dateline-aware longitude bounds (see calc_lon_bounds) and the list of visited tile ids.
+    """
+    nc = flight_utils.open_flight_nc(file_path)
+    try:
+        rate = flight_utils.get_flight_rate(nc)
+        times = flight_utils.sfm_to_datetime64(nc['Time'][:], nc['Time'].units)
+        lats = _read_position_1hz(nc, ['GGLAT','LATC'])
+        lons = _read_position_1hz(nc, ['GGLON','LONC'])
+    finally:
+        nc.close()
+
+    ok = np.isfinite(lats) & np.isfinite(lons) & ~np.isnat(times)
+    valid_times = times[~np.isnat(times)]
+    if len(valid_times) == 0:
+        raise ValueError(f"{file_path} has no valid times")
+    lon_min, lon_max = calc_lon_bounds(lons[ok])
+    return {'file_path': str(file_path),
+            'rate': rate,
+            'start': str(valid_times.min()),
+            'end': str(valid_times.max()),
+            'lat_min': float(lats[ok].min()) if ok.any() else np.nan,
+            'lat_max': float(lats[ok].max()) if ok.any() else np.nan,
+            'lon_min': lon_min,
+            'lon_max': lon_max,
+            'tiles': calc_tile_ids(lats[ok], lons[ok], tile_deg).tolist()}
+
+class flight_catalog:
+    """
+    flight_catalog is an index of where and when each flight in a set of flight files went, so that the files
+    passing through a region and time range can be found without reading them.
+
+    Each entry holds a flight file's path, field campaign, file name, rate, time extent, dateline-aware bounding box
+    and the coarse tiles its track visits. Two indexes are kept over the entries: the entries sorted by start time,
+    with a running maximum of end times, so a time range query is two binary searches; and a mapping of tile id to
+    the entries visiting it, so a region query only looks at flights that came near the region.
+
+    The __init__ takes the tile size in degrees (5 by default). Entries are added with add_file or build, and the
+    catalog is persisted with save and load. The __init__ assigns:
+    self.tile_deg: float; the tile size in degrees
+    self.entries: pd.DataFrame; one row per flight file, sorted by start time (a property built on first use)
+    """
+    columns = ['file_path','campaign','fname','rate','start','end','lat_min','lat_max','lon_min','lon_max']
+
+    def __init__(self, tile_deg: float = 5.):
+        self.tile_deg = tile_deg
+        self._records = {} # resolved file path -> scan_flight_extent result
+        self._index = None
+
+    def _scan(self, file_path: str, campaign: str) -> dict:
+        """
+        _scan scans a flight file into a catalog record, keyed by its resolved path like the entries of
+              registry_utils.flight_registry, so the same file reached through different paths has a single entry.
+        """
+        fp_path = path.Path(file_path).resolve()
+        record = scan_flight_extent(str(fp_path), self.tile_deg)
+        record['campaign'] = campaign
+        record['fname'] = fp_path.name
+        return record
+
+    def add_file(self, file_path: str, campaign: str = None):
+        """
+        add_file scans a flight file and adds it to the catalog, replacing any entry of the same file. The indexes are
+                 rebuilt on the next query, so adding many files one at a time costs a single rebuild.
+
+        :param file_path: A path string to a flight data file
+        :param campaign: The field campaign of the flight. Optional.
+        """
+        record = self._scan(file_path, campaign)
+        self._records[record['file_path']] = record
+        self._index = None
+
+    def build(self, data_dir: str, field_campaigns: list[str]) -> dict[str,str]:
+        """
+        build adds every flight file in the lrt directory of each field campaign in data_dir, the same files that
+              flight_utils.read_all_flights reads. Files that fail to scan are skipped and reported.
+
+        :param data_dir: A path string to the directory holding one directory per field campaign.
+        :param field_campaigns: A list of field campaign names, e.g. ['SOCRATES','CSET'].
+
+        :return: Returns a dictionary of file path -> error message for the files that could not be scanned.
+        """
+        errors = {}
+        records = []
+        for campaign in field_campaigns:
+            campaign_dir = data_dir + "/" + campaign + "/lrt"
+            try:
+                flight_fnames = flight_utils.find_flight_fnames(campaign_dir)
+            except OSError as e:
+                errors[campaign_dir] = f"{type(e).__name__}: {e}"
+                continue
+            for fname in flight_fnames:
+                file_path = campaign_dir + "/" + fname
+                try:
+                    records.append(self._scan(file_path, campaign))
+                except Exception as e:
+                    errors[file_path] = f"{type(e).__name__}: {e}"
+        # the scanned files are added as one batch
+        self._records.update((record['file_path'], record) for record in records)
+        self._index = None
+        return errors
+
+    @property
+    def entries(self) -> pd.DataFrame:
+        self._build_index()
+        return self._index['entries']
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _build_index(self):
+        """
+        _build_index builds the time and tile indexes over the entries, if they are out of date.
+        """
+        if self._index is not None:
+            return
+        entries = pd.DataFrame(list(self._records.values()), columns=self.columns + ['tiles'])
+        entries['start'] = pd.to_datetime(entries['start'])
+        entries['end'] = pd.to_datetime(entries['end'])
+        entries = entries.sort_values('start', kind='stable').reset_index(drop=True)
+
+        # tile id -> sorted array of the entries visiting that tile
+        tile_ids = np.array([t for tiles in entries['tiles'] for t in tiles], dtype=np.int64)
+        owners = np.repeat(np.arange(len(entries)), [len(tiles) for tiles in entries['tiles']])
+        order = np.argsort(tile_ids, kind='stable')
+        tile_ids, owners = tile_ids[order], owners[order]
+        unique_ids, first = np.unique(tile_ids, return_index=True)
+        tiles = dict(zip(unique_ids.tolist(), np.split(owners, first[1:])))
+
+        self._index = {'entries': entries.drop(columns='tiles'),
+                       'start': entries['start'].to_numpy(),
+                       'end': entries['end'].to_numpy(),
+                       'end_max': np.maximum.accumulate(entries['end'].to_numpy()),
+                       'tiles': tiles}
+
+    def _box_tiles(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        """
+        _box_tiles lists the ids of the tiles overlapping a lat/lon box. lon_min > lon_max is a box crossing the
+                   dateline.
+        """
+        nlat_tiles = int(round(180./self.tile_deg))
+        nlon_tiles = int(round(360./self.tile_deg))
+        j0, j1 = np.clip(np.floor((np.array([lat_min, lat_max]) + 90.)/self.tile_deg).astype(int), 0, nlat_tiles - 1)
+        i0, i1 = (np.floor(np.mod(np.array([lon_min, lon_max]) + 180., 360.)/self.tile_deg).astype(int)
+                  % nlon_tiles)
+        if lon_max - lon_min >= 360.:
+            i0, i1 = 0, nlon_tiles - 1
+        lon_tiles = np.arange(i0, i1 + 1) if i0 <= i1 else np.r_[np.arange(i0, nlon_tiles), np.arange(0, i1 + 1)]
+        return (np.arange(j0, j1 + 1)[:,None]*nlon_tiles + lon_tiles[None,:]).ravel()
+
+    def query(self, lat_min: float = -90., lat_max: float = 90., lon_min: float = -180., lon_max: float = 180.,
+              start = None, end = None) -> pd.DataFrame:
+        """
+        query finds the flights that passed through a region during a time range.
+
+        :param lat_min: The southern edge of the region in degrees. Optional. Default is -90.
+        :param lat_max: The northern edge of the region in degrees. Optional. Default is 90.
+        :param lon_min: The western edge of the region in degrees. Optional. Default is -180. A lon_min greater than
+                        lon_max, e.g. (170, -170), is a region crossing the dateline.
+        :param lon_max: The eastern edge of the region in degrees. Optional. Default is 180.
+        :param start: The start of the time range, anything pd.Timestamp accepts. Optional. Default is unbounded.
+        :param end: The end of the time range. Optional. Default is unbounded.
+
+        :return: Returns a DataFrame of the catalog entries of the flights that visited a tile overlapping the region
+                 and overlap the time range, sorted by start time. Tiles are coarse, so a flight may pass near, rather
+                 than through, the region.
+        """
+        self._build_index()
+        index = self._index
+        n = len(index['start'])
+
+        # time: entries starting by the end of the range, and not all ending before its start
+        hi = n if end is None else np.searchsorted(index['start'], pd.Timestamp(end).to_datetime64(), side='right')
+        lo = 0 if start is None else np.searchsorted(index['end_max'], pd.Timestamp(start).to_datetime64())
+        candidates = np.arange(lo, hi)
+        if start is not None:
+            candidates = candidates[index['end'][candidates] >= pd.Timestamp(start).to_datetime64()]
+
+        # space: entries visiting any tile of the region
+        if (lat_min, lat_max, lon_min, lon_max) != (-90., 90., -180., 180.):
+            visiting = [index['tiles'][t] for t in self._box_tiles(lat_min, lat_max, lon_min, lon_max)
+                        if t in index['tiles']]
+            visiting = np.unique(np.concatenate(visiting)) if visiting else np.zeros(0, dtype=np.int64)
+            candidates = np.intersect1d(candidates, visiting)
+
+        return index['entries'].iloc[candidates]
+
+    def save(self, file_path: str):
+        """
+        save writes the catalog to a JSON file.
+
+        :param file_path: A path string to the JSON file to write.
+        """
+        with open(file_path, 'w') as f:
+            json.dump({'tile_deg': self.tile_deg, 'entries': list(self._records.values())}, f)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'flight_catalog':
+        """
+        load reads a catalog written by save.
+
+        :param file_path: A path string to the JSON file to read.
+
+        :return: Returns a flight_catalog.
+        """
+        with open(file_path) as f:
+            saved = json.load(f)
+        catalog = cls(saved['tile_deg'])
+        catalog._records = {record['file_path']: record for record in saved['entries']}
+        return catalog
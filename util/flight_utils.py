@@ -3,9 +3,13 @@ import pathlib as path
 import pandas as pd
 import numpy as np
 import os
+import contextvars
 from datetime import datetime, timedelta
 from fnmatch import fnmatch
-from typing import Iterable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, Union
+from collections import OrderedDict, deque
+import util.profile_utils as profile_utils
 
 # vars_to_read is the default set of variables that get read when calling read_nc below when
 # variables are not specified (i.e. when called like "utils.read_nc(netcdf_obj)"). 
@@ -33,6 +37,37 @@ def sfm_to_datetime(sfm: Iterable[float], tunits: str) -> list[datetime]:
     dts = [t0_dt + delta for delta in deltas]
     return dts
 
+_tunit_ns = {'seconds': 10**9, 'second': 10**9, 'secs': 10**9, 'sec': 10**9, 's': 10**9,
+             'minutes': 60*10**9, 'minute': 60*10**9, 'mins': 60*10**9, 'min': 60*10**9,
+             'hours': 3600*10**9, 'hour': 3600*10**9, 'hrs': 3600*10**9, 'hr': 3600*10**9, 'h': 3600*10**9,
+             'days': 86400*10**9, 'day': 86400*10**9, 'd': 86400*10**9}
+
+def sfm_to_datetime64(sfm: Iterable[float], tunits: str) -> np.ndarray:
+    """
+    sfm_to_datetime64 converts an array of times with units of tunits to a numpy datetime64[ns] array in one
+                      vectorized operation. Unlike sfm_to_datetime, the full reference timestamp (date, time and
+                      UTC offset) in tunits is honored.
+
+    :param sfm: An iterable/array of times, e.g. seconds from UTC midnight
+    :param tunits: A string defining the units of sfm. Expected to be in the form of "seconds since YYYY-MM-DD HH:MM:SS +0000"
+
+    :return: Returns a numpy datetime64[ns] array of UTC times (timezone naive). Masked or NaN times become NaT.
+    """
+    unit, sep, ref = tunits.strip().partition(' since ')
+    if not sep or unit.lower() not in _tunit_ns:
+        raise ValueError(f"Unable to parse time units '{tunits}'")
+    t0 = pd.Timestamp(ref.strip())
+    if t0.tz is not None:
+        t0 = t0.tz_convert('UTC').tz_localize(None)
+
+    sfm = np.ma.filled(np.ma.asarray(sfm, dtype=np.float64), np.nan)
+    ns = np.round(sfm*_tunit_ns[unit.lower()])
+    nat = ~np.isfinite(ns)
+    ns[nat] = 0
+    dts = np.datetime64(t0.to_datetime64(), 'ns') + ns.astype(np.int64).astype('timedelta64[ns]')
+    dts[nat] = np.datetime64('NaT')
+    return dts
+
 def find_flight_fnames(dir_path: str) -> list[str]:
     """
     find_flight_fnames just searches a directory for all *.nc files and returns a list of them.
@@ -59,66 +94,170 @@ def open_flight_nc(file_path: str) -> netCDF4._netCDF4.Dataset:
 
     return netCDF4.Dataset(file_path)
 
-def read_flight_nc_25hz(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read) -> pd.DataFrame:
+def get_flight_rate(nc: netCDF4._netCDF4.Dataset) -> int:
     """
-    read_flight_nc reads a set of variables into memory.
+    get_flight_rate determines the highest sample rate in a flight netcdf file from its spsNN dimensions (e.g. sps25).
+
+    :param nc: netCDF4._netCDF4.Dataset object opened by open_flight_nc.
+
+    :return: Returns the sample rate in Hz as an int. 1 is returned if no spsNN dimensions exist.
+    """
+    rates = [int(name[3:]) for name in nc.dimensions.keys() if name.startswith('sps') and name[3:].isdigit()]
+    return max(rates, default=1)
+
+def _var_rate(ncvar: netCDF4._netCDF4.Variable) -> int:
+    """
+    _var_rate returns the sample rate of a netcdf variable using only its metadata, i.e. without reading its data.
+
+    :param ncvar: A netCDF4 variable with dimensions (Time,) or (Time, spsNN).
+
+    :return: Returns the sample rate in Hz as an int.
+    """
+    if ncvar.ndim == 1:
+        return 1
+    elif ncvar.ndim == 2:
+        return ncvar.shape[1]
+    else:
+        raise RuntimeError(f"Variable {ncvar.name} is {ncvar.ndim}-dimensional. Only 1-D or 2-D variables are handled.")
+
+def _upsample(data: np.ndarray, var_hz: int, hz: int) -> np.ndarray:
+    """
+    _upsample linearly interpolates a (ntime,) or (ntime, var_hz) array onto a 1-D, hz time series.
+
+    Samples within the last second have nothing to interpolate towards and are set to NaN, as in the original
+    25 Hz reader.
+
+    :param data: A 1-D (var_hz == 1) or 2-D (ntime by var_hz) float array. Masked values should already be NaN.
+    :param var_hz: The sample rate of data in Hz.
+    :param hz: The output sample rate in Hz.
+
+    :return: Returns a 1-D numpy array of length ntime*hz.
+    """
+    if var_hz == hz:
+        return np.ravel(data)
+
+    ntime = data.shape[0]
+    if var_hz == 1:
+        # broadcast each second's value and the difference to the next second over the sub-second offsets
+        sub_seconds = np.arange(0,hz,1)/hz
+        output = np.full((ntime,hz), np.nan)
+        np.add(data[:-1,None], sub_seconds[None,:]*np.diff(data)[:,None], out=output[:-1,:]) # divide by 1s omitted
+        return np.ravel(output)
+
+    # general case: for each output sample find the preceding input sample and the fraction of the way to the next
+    flat = np.ravel(data)
+    steps = np.arange(ntime*hz)*var_hz
+    lo = steps // hz
+    frac = (steps % hz)/hz
+    output = np.full(ntime*hz, np.nan)
+    valid = lo < (ntime-1)*var_hz
+    lo = lo[valid]
+    output[valid] = flat[lo] + frac[valid]*(flat[lo+1]-flat[lo])
+    return output
+
+def _skip_var(nc: netCDF4._netCDF4.Dataset, var: str, error: Exception):
+    """
+    _skip_var records a variable the readers could not read (e.g. it is not in the file) with the active
+              profile_utils collector, if there is one, instead of dropping it silently.
+    """
+    if profile_utils.active():
+        profile_utils.count('flight.skipped_vars')
+        profile_utils.note('flight.skipped_vars', f"{nc.filepath()}: {var}: {type(error).__name__}: {error}")
 
-    NOTE: a high-rate, usually 25 Hz, flight data file is assumed.
+def read_flight_nc_hr(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read, hz: int = None,
+                      start: int = 0, stop: int = None) -> pd.DataFrame:
+    """
+    read_flight_nc_hr reads a set of variables from a high-rate flight data file into memory.
+
+    Variable shapes are taken from the netcdf metadata, 1-D (1 Hz) and 2-D variables at other rates are interpolated
+    onto the hz time series with broadcast numpy, and every variable is written into a preallocated block, one per
+    output dtype: variables at the hz rate keep their floating point dtype, e.g. float32, while times and interpolated
+    variables are float64. Masked values, times included, are NaN (and masked times NaT in the datetime column).
 
     :param nc: netCDF4._netCDF4.Dataset object opened by open_flight_nc.
     :param read_vars: An optional list of strings of variable names to be read into memory. A default
                       list, vars_to_read, is specified above. Passing in a similar list will read in those variables
                       instead.
+    :param hz: The output sample rate. Optional. By default, the highest spsNN dimension in the file is used.
+    :param start: The first Time record (i.e. second) to read. Optional. Default is the start of the file.
+    :param stop: The Time record to stop reading at (exclusive). Optional. Default is the end of the file.
 
-    :return: Returns a pandas data frame.
+    :return: Returns a pandas data frame. If Time is read, it is indexed by a DatetimeIndex of the UTC sample times.
     """
-
-    data = [] # an empty list to accumulate Dataframes of each variable to be read in
-
-    hz = 25
-    sub_seconds = np.arange(0,25,1)/25.
-
+    if hz is None:
+        hz = get_flight_rate(nc)
+    start, stop, _ = slice(start, stop).indices(len(nc.dimensions['Time']))
+    ntime = max(stop - start, 0)
+    # variables that are interpolated also need the record after stop, so values at the end of a record range
+    # are identical to those of a whole-file read
+    stop_interp = min(stop + 1, len(nc.dimensions['Time']))
+
+    # check which variables can be read from metadata alone, skipping missing and >2-D variables
+    cols = []
+    rates = {}
     for var in read_vars:
         try:
-            if var == "Time":
-                # time is provided every second, so need to calculate 25 Hz times efficiently
-                tunits = getattr(nc[var],'units')
-                time = nc[var][:]
-
-                time_25hz = np.zeros((len(time),hz)) # 2-D
-                for i,inc in enumerate(sub_seconds):
-                    time_25hz[:,i] = time + inc
-                output = np.ravel(time_25hz) # ravel to 1-D
-                data.append(pd.DataFrame({var: output}))
-                dt_list = sfm_to_datetime(output, tunits)
-                data.append(pd.DataFrame({'datetime': dt_list}))
-            else:
-                ndims = len(np.shape(nc[var][:]))
-                if ndims == 2:
-                    # 2-D, 25 Hz variables can just be raveled into 1-D time series
-                    output = np.ravel(nc[var][:])
-                    data.append(pd.DataFrame({var: output}))
-                elif ndims == 1:
-                    # 1-D variables in 25 Hz data files exist (e.g. GGALT is sampled at 20 Hz, but by default,
-                    # this is filtered to 1Hz instead of fudged to 25 Hz). Do interpolation to 25 Hz so all time series
-                    # have same length.
-                    output_1d = nc[var][:]
-                    output_2d = np.zeros((len(output_1d),hz))*float("NaN")
-                    for i in range(len(output_1d)-1):
-                        output_2d[i,:] = output_1d[i] + sub_seconds*(output_1d[i+1]-output_1d[i]) # divide by 1s omitted
-                    output = np.ravel(output_2d)
-                    data.append(pd.DataFrame({var: output}))
-                else:
-                    raise RuntimeError(f"Variable {var} is {ndims}-dimensional. Only 1-D or 2-D variables are handled.")
+            rates[var] = _var_rate(nc[var])
+            cols.append(var)
         except Exception as e:
-            #print(f"Issue reading {var}: {e}")
-            pass
-              
+            _skip_var(nc, var, e)
+
+    # variables at the output rate keep their floating point dtype (integers become floats to hold NaN), while
+    # times and interpolated variables are float64, as in the original 25 Hz reader. There is one block per dtype.
+    dtypes = {var: np.dtype(np.float64) if var == "Time" or rates[var] != hz else
+                   np.result_type(nc[var].dtype, np.float32) for var in cols}
+    block_cols = {dtype: [var for var in cols if dtypes[var] == dtype] for dtype in dict.fromkeys(dtypes.values())}
+    blocks = {dtype: np.empty((ntime*hz,len(names)), dtype=dtype) for (dtype, names) in block_cols.items()}
+    profiling = profile_utils.active() is not None
+    for var in cols:
+        with profile_utils.stage('flight.netcdf_read'):
+            data = nc[var][start:stop] if var == "Time" or rates[var] == hz else nc[var][start:stop_interp]
+        # masked values, times included, become NaN (and so NaT once times are decoded)
+        if np.ma.isMaskedArray(data):
+            data = np.ma.filled(data.astype(dtypes[var]), np.nan)
+        column = blocks[dtypes[var]][:,block_cols[dtypes[var]].index(var)]
+        if var == "Time":
+            # time is provided every second, so add the sub-second offsets to it
+            column[:] = np.ravel(data[:,None] + np.arange(0,hz,1)[None,:]/hz)
+        else:
+            with profile_utils.stage('flight.interpolate'):
+                column[:] = _upsample(data, rates[var], hz)[:ntime*hz]
+        if profiling:
+            profile_utils.count('flight.bytes_read', data.nbytes)
+
+    frames = [pd.DataFrame(blocks[dtype], columns=names, copy=False) for (dtype, names) in block_cols.items()]
+    if len(frames) == 0:
+        df = pd.DataFrame(np.empty((ntime*hz,0)))
+    elif len(frames) == 1:
+        df = frames[0]
+    else:
+        df = pd.concat(frames, axis=1)[cols]
+    if "Time" in cols:
+        with profile_utils.stage('flight.decode_time'):
+            tunits = getattr(nc["Time"],'units')
+            dts = sfm_to_datetime64(df["Time"].to_numpy(), tunits)
+            df.insert(cols.index("Time")+1, 'datetime', dts)
+            df.index = pd.DatetimeIndex(dts)
+    profile_utils.count('flight.rows', len(df))
+    return df
+
+def read_flight_nc_25hz(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read) -> pd.DataFrame:
+    """
+    read_flight_nc reads a set of variables into memory.
 
-    # concatenate the list of dataframes into a single dataframe and return it
-    return pd.concat(data, axis=1, ignore_index=False)
+    NOTE: a high-rate, usually 25 Hz, flight data file is assumed. This is a thin wrapper around read_flight_nc_hr.
 
-def read_flight_nc_1hz(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read) -> pd.DataFrame:
+    :param nc: netCDF4._netCDF4.Dataset object opened by open_flight_nc.
+    :param read_vars: An optional list of strings of variable names to be read into memory. A default
+                      list, vars_to_read, is specified above. Passing in a similar list will read in those variables
+                      instead.
+
+    :return: Returns a pandas data frame. If Time is read, it is indexed by a DatetimeIndex of the UTC sample times.
+    """
+    return read_flight_nc_hr(nc, read_vars, hz=25)
+
+def read_flight_nc_1hz(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read,
+                       start: int = 0, stop: int = None) -> pd.DataFrame:
     """
     read_flight_nc reads a set of variables into memory.
 
@@ -128,74 +267,434 @@ def read_flight_nc_1hz(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars
     :param read_vars: An optional list of strings of variable names to be read into memory. A default
                       list, vars_to_read, is specified above. Passing in a similar list will read in those variables
                       instead.
+    :param start: The first Time record (i.e. second) to read. Optional. Default is the start of the file.
+    :param stop: The Time record to stop reading at (exclusive). Optional. Default is the end of the file.
 
-    :return: Returns a pandas data frame.
+    :return: Returns a pandas data frame. If Time is read, it is indexed by a DatetimeIndex of the UTC sample times.
     """
 
     data = [] # an empty list to accumulate Dataframes of each variable to be read in
+    profiling = profile_utils.active() is not None
     for var in read_vars:
         try:
             if var == "Time":
                 # time is provided every second, so need to calculate 25 Hz times efficiently
                 tunits = getattr(nc[var],'units')
-                time = nc[var][:]
+                with profile_utils.stage('flight.netcdf_read'):
+                    time = nc[var][start:stop]
                 data.append(pd.DataFrame({var: time}))
-                dt_list = sfm_to_datetime(time, tunits)
-                data.append(pd.DataFrame({'datetime': dt_list}))
+                with profile_utils.stage('flight.decode_time'):
+                    dts = sfm_to_datetime64(time, tunits)
+                data.append(pd.DataFrame({'datetime': dts}))
+                if profiling:
+                    profile_utils.count('flight.bytes_read', time.nbytes)
             else:
-                output = nc[var][:]
+                with profile_utils.stage('flight.netcdf_read'):
+                    output = nc[var][start:stop]
                 data.append(pd.DataFrame({var: output}))
+                if profiling:
+                    profile_utils.count('flight.bytes_read', output.nbytes)
         except Exception as e:
-            #print(f"Issue reading {var}: {e}")
-            pass
+            _skip_var(nc, var, e)
     
 
-    # concatenate the list of dataframes into a single dataframe and return it
-    return pd.concat(data, axis=1, ignore_index=False)
+    if not data:
+        return pd.DataFrame()
 
-def read_flight_nc(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read) -> pd.DataFrame:
+    # concatenate the list of dataframes into a single dataframe, index it by time and return it
+    df = pd.concat(data, axis=1, ignore_index=False)
+    if 'datetime' in df:
+        df.index = pd.DatetimeIndex(df['datetime'].to_numpy())
+    profile_utils.count('flight.rows', len(df))
+    return df
+
+def iter_flight_nc(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read, window_seconds: int = 600,
+                   as_frame: bool = True) -> Iterator[pd.DataFrame]:
     """
-    read_flight_nc simply figures out if the flight netcdf object is 1 hz or 25 hz and calls the appropriate reader.
+    iter_flight_nc reads a flight netcdf file in fixed-length time windows, so that peak memory depends on the window
+                   length rather than the flight length. Only the Time records of each window (plus the following record
+                   for variables that are interpolated) are read, and the windows put together are identical to a
+                   read_flight_nc of the whole file.
 
     :param nc: A netcdf object for a flight netcdf file.
     :param read_vars: A list of variable names to be read in the netcdf object. Optional. Default is "vars_to_read" specified
                       above.
+    :param window_seconds: The length of each window in seconds (i.e. Time records). Optional. Default is 10 minutes.
+    :param as_frame: If True (default), yield Pandas DataFrames. Otherwise yield dictionaries of variable name -> array.
+
+    :return: Returns a generator of Pandas DataFrames (or dictionaries of arrays), one per window.
+    """
+    hz = get_flight_rate(nc)
+    ntime = len(nc.dimensions['Time'])
+    for start in range(0, ntime, window_seconds):
+        stop = min(start + window_seconds, ntime)
+        if hz > 1:
+            df = read_flight_nc_hr(nc, read_vars, hz, start, stop)
+        else:
+            df = read_flight_nc_1hz(nc, read_vars, start, stop)
+        yield df if as_frame else {name: df[name].to_numpy() for name in df.keys()}
+
+def _frame_from_columns(columns: dict[str,np.ndarray], read_vars: list[str]) -> pd.DataFrame:
+    """
+    _frame_from_columns assembles decoded columns into a DataFrame laid out like the readers' output, i.e. in the
+                        order of read_vars, with 'datetime' after 'Time' and a DatetimeIndex if 'Time' was read.
+
+    :param columns: A dictionary of variable name -> 1-D array.
+    :param read_vars: A list of the variable names that were requested.
 
     :return: Returns Pandas DataFrame
     """
-    dim_names = list(nc.dimensions.keys())
-    if 'sps25' in dim_names:
-        df = read_flight_nc_25hz(nc, read_vars)
-    else:
-        df = read_flight_nc_1hz(nc, read_vars)
+    names = []
+    for var in dict.fromkeys(read_vars):
+        if var in columns:
+            names.append(var)
+            if var == "Time" and 'datetime' in columns:
+                names.append('datetime')
+    df = pd.DataFrame({name: columns[name] for name in names})
+    if 'datetime' in df:
+        df.index = pd.DatetimeIndex(df['datetime'].to_numpy())
     return df
 
-def read_all_flights(data_dir: str, 
-                     field_campaigns: list[str], 
-                     read_vars: list[str] = vars_to_read) -> dict[str,dict[str,pd.DataFrame]]:
+def read_flight_nc(nc: netCDF4._netCDF4.Dataset, read_vars: list[str] = vars_to_read, cache = None) -> pd.DataFrame:
     """
-    open_all_flights 
+    read_flight_nc simply figures out if the flight netcdf object is 1 hz or high rate (e.g. 25 hz) and calls the
+                   appropriate reader.
 
     :param nc: A netcdf object for a flight netcdf file.
     :param read_vars: A list of variable names to be read in the netcdf object. Optional. Default is "vars_to_read" specified
                       above.
+    :param cache: A cache_utils.flight_cache. Optional. If given, columns already in the cache are loaded from it and
+                  only the remaining variables are decoded from nc and added to the cache.
+
+    :return: Returns Pandas DataFrame
+    """
+    hz = get_flight_rate(nc)
+    if cache is None:
+        with profile_utils.stage('flight.read_flight_nc'):
+            if hz > 1:
+                df = read_flight_nc_hr(nc, read_vars, hz)
+            else:
+                df = read_flight_nc_1hz(nc, read_vars)
+        return df
+
+    with profile_utils.stage('flight.cache_load'):
+        columns, to_read = cache.load(nc.filepath(), hz, read_vars)
+    profile_utils.count('flight.cache_hits', len(read_vars) - len(to_read))
+    if to_read:
+        df = read_flight_nc(nc, to_read)
+        decoded = {name: df[name].to_numpy() for name in df.keys()}
+        cache.store(nc.filepath(), hz, decoded, absent=[var for var in to_read if var not in decoded])
+        columns.update(decoded)
+    return _frame_from_columns(columns, read_vars)
+
+def project_positions(lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    project_positions unwraps a flight's longitudes across the dateline and projects its positions to web mercator
+                      plot coordinates, in one vectorized pass.
+
+    :param lat: An array of latitudes in degrees
+    :param lon: An array of longitudes in degrees
+
+    :return: Returns a tuple of the unwrapped longitudes (float64), the mercator x and y in meters (float32), and a
+             boolean mask of valid positions (finite, with latitudes strictly between the poles). x and y are NaN where
+             positions are not valid.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    # To prevent wrap around, detect when a flight crossed the dateline and unwrap the longitudes.
+    #    That is, when lats go -178, -179, 180, 179, 178, ..., and most flights on east of the dateline
+    #    (negative) make all longitudes east of the dateline (negative)
+    if np.any(lon > 179) and np.any(lon < -179):
+        if np.sum(lon > 0) >= np.sum(lon < 0):
+            lon = np.where(lon < 0, lon + 360, lon)
+        else:
+            lon = np.where(lon > 0, lon - 360, lon)
+
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) < 90)
+    k = 6378137
+    x = np.where(valid, lon*(k*np.pi/180.0), np.nan).astype(np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = np.where(valid, np.log(np.tan((90 + lat)*np.pi/360.0))*k, np.nan).astype(np.float32)
+    return lon, x, y, valid
+
+def add_projected_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    add_projected_columns adds the columns of project_positions to a flight DataFrame, so that plotting (or anything
+                          else needing projected positions) can reuse them instead of redoing the trigonometry.
+                          GGLAT/GGLON are used if they were read in, otherwise the GPS-corrected IRU LATC/LONC.
+
+    :param df: A flight DataFrame, e.g. from read_flight_nc. It is modified in place.
+
+    :return: Returns df, with 'lon_unwrapped', 'merc_x', 'merc_y' and 'pos_valid' columns added.
+    """
+    if "GGLAT" in df and "GGLON" in df:
+        lat, lon = df["GGLAT"].to_numpy(), df["GGLON"].to_numpy()
+    elif "LATC" in df and "LONC" in df:
+        lat, lon = df["LATC"].to_numpy(), df["LONC"].to_numpy()
+    else:
+        raise KeyError("Neither GGLAT/GGLON nor LATC/LONC are in the flight DataFrame")
+    df['lon_unwrapped'], df['merc_x'], df['merc_y'], df['pos_valid'] = project_positions(lat, lon)
+    return df
+
+def read_flight_file(file_path: str, read_vars: list[str] = vars_to_read, cache = None,
+                     project: bool = False) -> pd.DataFrame:
+    """
+    read_flight_file opens a flight netcdf file, reads it with read_flight_nc and closes it again.
+
+    :param file_path: A path string to a flight data file, e.g. "./test/test_flight.nc"
+    :param read_vars: A list of variable names to be read in the netcdf object. Optional. Default is "vars_to_read" specified
+                      above.
+    :param cache: A cache_utils.flight_cache to read through. Optional.
+    :param project: If True, add the projected position columns of add_projected_columns. Optional. Default is False.
 
     :return: Returns Pandas DataFrame
     """
-    all_campaign_nc = {} # a dictionary of dictionaries with keys of field campaigns
+    flight_nc = open_flight_nc(file_path)
+    try:
+        df = read_flight_nc(flight_nc, read_vars, cache)
+    finally:
+        flight_nc.close()
+    if project:
+        add_projected_columns(df)
+    return df
+
+def _check_position_vars(read_vars: list[str]):
+    """
+    _check_position_vars checks that read_vars has a pair of position variables for add_projected_columns, so that
+                         project=True fails once up front rather than for every file.
+    """
+    if not ({'GGLAT','GGLON'} <= set(read_vars) or {'LATC','LONC'} <= set(read_vars)):
+        raise ValueError(f"project=True needs GGLAT/GGLON or LATC/LONC in read_vars, not {read_vars}")
+
+def _lacks_all_vars(registry, file_path: str, read_vars: list[str]) -> bool:
+    """
+    _lacks_all_vars checks whether a registry knows a flight file has none of the requested data variables (anything
+                    but Time), i.e. reading it would give nothing but times. Files merely lacking some of them, e.g.
+                    GGLAT in older campaigns that only have LATC, are read as usual, like the readers skip absent
+                    variables.
+    """
+    data_vars = [var for var in read_vars if var != 'Time']
+    missing = registry.missing_vars(file_path, data_vars) if registry is not None and data_vars else None
+    return missing is not None and len(missing) == len(data_vars)
+
+def _find_flight_jobs(data_dir: str, field_campaigns: list[str], read_vars: list[str], registry,
+                      errors: dict[str,str]) -> list[tuple[str,str,str]]:
+    """
+    _find_flight_jobs lists the flight files in the lrt directory of each field campaign in data_dir, skipping those a
+                      registry knows have none of read_vars (see _lacks_all_vars). Campaign directories that cannot
+                      be listed are reported in errors.
+
+    :return: Returns a list of (campaign, file name, file path) tuples.
+    """
+    jobs = []
     for campaign in field_campaigns:
-        print(campaign)
-        flight_dict = {} # a dictionary of Pandas DataFrames with keys of file names
         campaign_dir = data_dir + "/" + campaign + "/lrt"
-        flight_fnames = find_flight_fnames(campaign_dir)
+        try:
+            flight_fnames = find_flight_fnames(campaign_dir)
+        except OSError as e:
+            errors[campaign_dir] = f"{type(e).__name__}: {e}"
+            print(f"{campaign}: {errors[campaign_dir]}")
+            continue
         for fname in flight_fnames:
-            #print(fname)
-            flight_nc = open_flight_nc(campaign_dir + "/" + fname)
-            flight_dict[fname] = read_flight_nc(flight_nc, read_vars)
-        all_campaign_nc[campaign] = flight_dict
+            file_path = campaign_dir + "/" + fname
+            if _lacks_all_vars(registry, file_path, read_vars):
+                print(f"{campaign} {fname} skipped: has none of {', '.join(read_vars)}")
+                continue
+            jobs.append((campaign, fname, file_path))
+    return jobs
+
+def read_all_flights(data_dir: str, 
+                     field_campaigns: list[str], 
+                     read_vars: list[str] = vars_to_read,
+                     n_workers: int = 1,
+                     return_errors: bool = False,
+                     cache = None,
+                     registry = None,
+                     project: bool = False,
+                     as_table: bool = False,
+                     float_dtype: np.dtype = np.float32) -> Union[dict[str,dict[str,pd.DataFrame]], 'flight_table',
+                                                                  tuple[dict[str,dict[str,pd.DataFrame]],dict[str,str]],
+                                                                  tuple['flight_table',dict[str,str]]]:
+    """
+    read_all_flights reads every flight file in the lrt directory of each field campaign in data_dir.
+
+    Files that fail to open or read are skipped and reported instead of aborting the run.
+
+    :param data_dir: A path string to the directory holding one directory per field campaign.
+    :param field_campaigns: A list of field campaign names, e.g. ['SOCRATES','CSET'].
+    :param read_vars: A list of variable names to be read in the netcdf object. Optional. Default is "vars_to_read" specified
+                      above.
+    :param n_workers: The number of worker processes to spread the files across. Optional. The default of 1 reads
+                      the files one after another in this process.
+    :param return_errors: If True, also return a dictionary of file path -> error message for the files that failed.
+    :param cache: A cache_utils.flight_cache to read through. Optional.
+    :param registry: A registry_utils.flight_registry. Optional. If given, files the registry knows have none of
+                     the variables of read_vars (other than Time) are skipped without being opened. Files lacking only
+                     some of them, or that it has no current entry for, are read as usual.
+    :param project: If True, add the projected position columns of add_projected_columns to each DataFrame as it is
+                    read (in the worker processes, if n_workers > 1), for plotting. Optional. Default is False.
+    :param as_table: If True, return the flights consolidated into a flight_table instead. Optional. Default is False.
+    :param float_dtype: The floating point dtype the flight_table stores variables in, for as_table=True. Optional.
+                        Default is float32. None keeps them as they were read.
+
+    :return: Returns a dictionary (keys of field campaigns) of dictionaries (keys of file names) of Pandas DataFrames.
+             If as_table is True, a flight_table of the flights is returned instead of the dictionary.
+             If return_errors is True, a tuple of that and the dictionary of errors is returned.
+    """
+    if project:
+        _check_position_vars(read_vars)
+    all_campaign_nc = {campaign: {} for campaign in field_campaigns} # dictionaries of DataFrames with keys of file names
+    errors = {} # a dictionary of error messages with keys of file paths
+    jobs = _find_flight_jobs(data_dir, field_campaigns, read_vars, registry, errors)
+
+    def report(i, campaign, fname, file_path, error=None):
+        if error is None:
+            print(f"[{i}/{len(jobs)}] {campaign} {fname}")
+        else:
+            errors[file_path] = f"{type(error).__name__}: {error}"
+            print(f"[{i}/{len(jobs)}] {campaign} {fname} failed: {errors[file_path]}")
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(read_flight_file, file_path, read_vars, cache, project): (campaign, fname, file_path)
+                       for (campaign, fname, file_path) in jobs}
+            for i, future in enumerate(as_completed(futures), start=1):
+                campaign, fname, file_path = futures[future]
+                try:
+                    all_campaign_nc[campaign][fname] = future.result()
+                    report(i, campaign, fname, file_path)
+                except Exception as e:
+                    report(i, campaign, fname, file_path, e)
+        # completion order is arbitrary, so restore the sorted file name order within each campaign
+        for campaign, flight_dict in all_campaign_nc.items():
+            all_campaign_nc[campaign] = {fname: flight_dict[fname] for fname in sorted(flight_dict)}
+    else:
+        for i, (campaign, fname, file_path) in enumerate(jobs, start=1):
+            try:
+                all_campaign_nc[campaign][fname] = read_flight_file(file_path, read_vars, cache, project)
+                report(i, campaign, fname, file_path)
+            except Exception as e:
+                report(i, campaign, fname, file_path, e)
+
+    if as_table:
+        all_campaign_nc = flight_table(all_campaign_nc, float_dtype)
+    if return_errors:
+        return all_campaign_nc, errors
     return all_campaign_nc
 
 
+class flight_iterator:
+    """
+    flight_iterator is the iterator of (campaign, file name, DataFrame) tuples returned by iter_flights. It also holds
+                    the field campaigns asked for, so that consumers can list campaigns none of whose flights could be
+                    read, as they would find them in the dictionaries of read_all_flights.
+    """
+    def __init__(self, field_campaigns: list[str], flights: Iterator[tuple[str,str,pd.DataFrame]]):
+        """
+        __init__ wraps a generator of flights.
+
+        :param field_campaigns: A list of field campaign names, e.g. ['SOCRATES','CSET'].
+        :param flights: A generator of (campaign, file name, DataFrame) tuples.
+        """
+        self.field_campaigns = list(field_campaigns)
+        self._flights = flights
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> tuple[str,str,pd.DataFrame]:
+        return next(self._flights)
+
+    def close(self):
+        """
+        close stops the iteration early, dropping the flights read ahead.
+        """
+        self._flights.close()
+
+def iter_flights(data_dir: str,
+                 field_campaigns: list[str],
+                 read_vars: list[str] = vars_to_read,
+                 prefetch: int = 2,
+                 errors: dict[str,str] = None,
+                 cache = None,
+                 registry = None,
+                 project: bool = False,
+                 lock = None) -> flight_iterator:
+    """
+    iter_flights reads the same flight files as read_all_flights, one at a time, while reading ahead: a background
+                 thread opens and decodes the next flights while the caller processes the current one (e.g. maps or
+                 projects it), so reading and processing overlap and a run takes about as long as the slower of the
+                 two rather than their sum.
+
+                 At most prefetch flights are read ahead, so no more than prefetch + 1 flights are in memory at once
+                 (plus whatever the caller keeps). When the caller falls behind, the reading waits for it. Flights are
+                 read by a single thread, since the netCDF library is not safe to call from several threads at once.
+                 If the caller reads netCDF files too, e.g. CAM files with xarray, pass the lock it reads under (for
+                 xarray, xarray.backends.locks.HDF5_LOCK) so the two never read at the same time. Reads are
+                 profiled into the caller's active profile_collector.
+
+    :param data_dir: A path string to the directory holding one directory per field campaign.
+    :param field_campaigns: A list of field campaign names, e.g. ['SOCRATES','CSET'].
+    :param read_vars: A list of variable names to be read in the netcdf object. Optional. Default is "vars_to_read"
+                      specified above.
+    :param prefetch: The number of flights to read ahead. Optional. Default is 2. 0 reads each flight only when it is
+                     asked for, like a plain loop over read_flight_file.
+    :param errors: A dictionary to add file path -> error message to for the files that failed, which are skipped.
+                   Optional.
+    :param cache: A cache_utils.flight_cache to read through. Optional.
+    :param registry: A registry_utils.flight_registry to skip files having none of read_vars. Optional.
+    :param project: If True, add the projected position columns of add_projected_columns. Optional. Default is False.
+    :param lock: A lock (anything usable in a with statement) held while each flight file is read. Optional.
+
+    :return: Returns a flight_iterator of (campaign, file name, DataFrame) tuples, in the order of field_campaigns
+             and, within each, of the sorted file names.
+    """
+    if project:
+        _check_position_vars(read_vars)
+    errors = {} if errors is None else errors
+    return flight_iterator(field_campaigns, _read_ahead(data_dir, field_campaigns, read_vars, prefetch, errors, cache,
+                                                        registry, project, lock))
+
+def _read_ahead(data_dir: str, field_campaigns: list[str], read_vars: list[str], prefetch: int, errors: dict[str,str],
+                cache, registry, project: bool, lock) -> Iterator[tuple[str,str,pd.DataFrame]]:
+    """
+    _read_ahead is the generator behind iter_flights, which takes the same parameters. Nothing is listed or read
+                before the first flight is asked for.
+    """
+    jobs = _find_flight_jobs(data_dir, field_campaigns, read_vars, registry, errors)
+
+    def read(file_path):
+        if lock is None:
+            return read_flight_file(file_path, read_vars, cache, project)
+        with lock:
+            return read_flight_file(file_path, read_vars, cache, project)
+
+    pending = deque() # the futures of the flights read ahead, in order
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        next_job = 0
+        for i, (campaign, fname, file_path) in enumerate(jobs, start=1):
+            # top up the read-ahead queue; the thread runs in the caller's context so profiling sees its reads
+            while next_job < len(jobs) and len(pending) < prefetch + 1:
+                pending.append(pool.submit(contextvars.copy_context().run, read, jobs[next_job][2]))
+                next_job += 1
+            with profile_utils.stage('flight.prefetch_wait'):
+                future = pending.popleft()
+                try:
+                    df = future.result()
+                except Exception as e:
+                    errors[file_path] = f"{type(e).__name__}: {e}"
+                    print(f"[{i}/{len(jobs)}] {campaign} {fname} failed: {errors[file_path]}")
+                    continue
+            print(f"[{i}/{len(jobs)}] {campaign} {fname}")
+            yield campaign, fname, df
+    finally:
+        # the caller may stop early; drop the flights read ahead
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
 class flight_obj:
     """
     flight_obj's are classes that hold flight data (i.e. variables indicated by read_vars) from a provided file path string.
@@ -207,12 +706,19 @@ class flight_obj:
     self.df: pd.DataFrame; a dataframe holding the read in data
     self.rate: str; a string indicating the rate of the data read in
     self.read_vars: list[str]; list of the vars that were successfully read in
+    An optional cache_utils.flight_cache can be passed in to read through. An optional registry_utils.flight_registry
+    can be passed in to check, without opening the file, that it has any of read_vars (other than Time); a ValueError
+    is raised if the registry knows it has none of them.
     """
-    def __init__(self, file_path: str, read_vars: list[str] = vars_to_read):
+    def __init__(self, file_path: str, read_vars: list[str] = vars_to_read, cache = None, registry = None):
         # assign input vars
         self.file_path = path.Path(file_path)
         self.read_vars_attempted = read_vars
 
+        if registry is not None:
+            if _lacks_all_vars(registry, self.file_path, read_vars):
+                raise ValueError(f"File {self.file_path} has none of {', '.join(read_vars)}")
+
         # open netcdf file if the file exists, assign to self.nc
         if self.file_path.is_file():
             self.nc = netCDF4.Dataset(self.file_path)
@@ -222,12 +728,259 @@ class flight_obj:
         # read in the variables, assign DataFrame to self.df,
         #                               rate to self.rate,
         #                               vars read in to self.read_vars
-        dim_names = list(self.nc.dimensions.keys())
-        if 'sps25' in dim_names:
-            self.df = read_flight_nc_25hz(self.nc, self.read_vars_attempted)
-            self.rate = "25Hz"
-        else:
-            self.df = read_flight_nc_1hz(self.nc, self.read_vars_attempted)
-            self.rate = "1Hz"
+        self.df = read_flight_nc(self.nc, self.read_vars_attempted, cache)
+        self.rate = f"{get_flight_rate(self.nc)}Hz"
         self.read_vars = list(self.df.keys())
 
+    def close(self):
+        """
+        close closes the netcdf file. The data already read into self.df stays available.
+        """
+        if self.nc.isopen():
+            self.nc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class lazy_flight_obj:
+    """
+    lazy_flight_obj's are a lazy variant of flight_obj. The __init__ only reads the file metadata (sample rate, number
+    of records and variable names) and closes the file again. Each column is decoded on first access, e.g.
+    flight["WIC"], and memoized. If max_bytes is given, the least recently used columns are dropped from memory once
+    the memoized columns exceed it, and are decoded again if accessed later.
+
+    The netcdf file is only held open while a column is being decoded, unless keep_open is True, in which case it stays
+    open until close() is called. lazy_flight_obj's can be used as context managers, which call close() on exit.
+
+    The __init__ takes a file path string, a list of vars to read (vars_to_read by default), the optional memory budget
+    in bytes, keep_open, and an optional cache_utils.flight_cache to read through.
+    The __init__ assigns:
+    self.file_path: str; the file path passed in
+    self.read_vars_attempted: list[str]; the originally passed in list of vars to read
+    self.rate: str; a string indicating the rate of the data
+    self.variables: list[str]; list of the 1-D and 2-D variables in the file that can be decoded
+    self.read_vars: list[str]; list of the vars in read_vars_attempted that exist in the file
+    self.nrows: int; the number of rows of each decoded column
+    """
+    def __init__(self, file_path: str, read_vars: list[str] = vars_to_read, max_bytes: int = None,
+                 keep_open: bool = False, cache = None):
+        self.file_path = path.Path(file_path)
+        self.read_vars_attempted = read_vars
+        self.max_bytes = max_bytes
+        self.keep_open = keep_open
+        self.cache = cache
+        self.nc = None
+        self._columns = OrderedDict() # memoized columns, least recently used first
+
+        if not self.file_path.is_file():
+            raise FileNotFoundError(f"File {self.file_path} did not exist!")
+
+        # read only the metadata
+        nc = self._open()
+        try:
+            hz = get_flight_rate(nc)
+            self.rate = f"{hz}Hz"
+            self.nrows = len(nc.dimensions['Time'])*hz
+            self.variables = [name for (name, var) in nc.variables.items()
+                              if var.ndim in (1, 2) and var.dimensions[0] == 'Time']
+        finally:
+            if not self.keep_open:
+                self._close_nc()
+
+        self.read_vars = []
+        for var in dict.fromkeys(read_vars):
+            if var in self.variables:
+                self.read_vars += [var, 'datetime'] if var == "Time" else [var]
+
+    def _open(self) -> netCDF4._netCDF4.Dataset:
+        if self.nc is None or not self.nc.isopen():
+            self.nc = netCDF4.Dataset(self.file_path)
+        return self.nc
+
+    def _close_nc(self):
+        if self.nc is not None and self.nc.isopen():
+            self.nc.close()
+        self.nc = None
+
+    def nbytes(self) -> int:
+        """
+        nbytes returns the memory held by the memoized columns in bytes.
+        """
+        return sum(data.nbytes for data in self._columns.values())
+
+    def __contains__(self, var: str) -> bool:
+        return var in self.variables or (var == 'datetime' and 'Time' in self.variables)
+
+    def __getitem__(self, var: str) -> np.ndarray:
+        """
+        __getitem__ returns the decoded column of a variable, decoding it if it is not memoized.
+
+        :param var: A variable name, or 'datetime' for the decoded sample times.
+
+        :return: Returns a 1-D numpy array of length self.nrows.
+        """
+        if var in self._columns:
+            self._columns.move_to_end(var)
+            return self._columns[var]
+        if var not in self:
+            raise KeyError(f"Variable {var} is not in {self.file_path}")
+
+        read_var = "Time" if var == 'datetime' else var
+        nc = self._open()
+        try:
+            df = read_flight_nc(nc, [read_var], self.cache)
+        finally:
+            if not self.keep_open:
+                self._close_nc()
+        if var not in df:
+            raise KeyError(f"Variable {var} could not be read from {self.file_path}")
+
+        # Time and datetime are decoded together, so memoize both
+        for name in df.keys():
+            self._columns[name] = df[name].to_numpy()
+        self._columns.move_to_end(var)
+
+        # drop the least recently used columns until the memory budget is met, keeping the one just decoded
+        if self.max_bytes is not None:
+            while len(self._columns) > 1 and self.nbytes() > self.max_bytes:
+                self._columns.popitem(last=False)
+        return self._columns[var]
+
+    def get_frame(self, read_vars: list[str] = None) -> pd.DataFrame:
+        """
+        get_frame assembles a DataFrame from (decoded on demand) columns, laid out like read_flight_nc's output.
+
+        :param read_vars: A list of variable names. Optional. Default is self.read_vars_attempted.
+
+        :return: Returns Pandas DataFrame
+        """
+        if read_vars is None:
+            read_vars = self.read_vars_attempted
+        columns = {}
+        for var in dict.fromkeys(read_vars):
+            if var in self:
+                columns[var] = self[var]
+                if var == "Time":
+                    columns['datetime'] = self['datetime']
+        return _frame_from_columns(columns, read_vars)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self.get_frame()
+
+    def close(self):
+        """
+        close closes the netcdf file, if it is open, and drops all memoized columns.
+        """
+        self._close_nc()
+        self._columns.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class flight_table:
+    """
+    flight_table is a consolidated, columnar alternative to the dictionary of dictionaries of DataFrames returned by
+    read_all_flights. All flights are stacked into one DataFrame, with categorical 'campaign' and 'flight' columns,
+    floating point variables optionally downcast (to float32 by default), and an offsets array giving the rows of each
+    flight, so that per-flight frames are slices of the one table rather than separate copies.
+
+    The __init__ takes the dictionary (keys of field campaigns) of dictionaries (keys of file names) of DataFrames
+    returned by read_all_flights, the floating point dtype to store variables in (None keeps them as they are), and
+    a list of variables to keep at full precision (('Time',) by default, whose sub-second part float32 cannot hold).
+    The __init__ assigns:
+    self.df: pd.DataFrame; the stacked flights, with a RangeIndex. Variables a flight lacks are NaN for its rows.
+    self.keys: list[tuple[str,str]]; the (campaign, file name) of each flight, in table order
+    self.columns: list[list[str]]; the columns each flight was read with, in table order
+    self.offsets: np.ndarray; flight k is rows offsets[k]:offsets[k+1] of self.df
+    """
+    def __init__(self, all_campaign_dfs: dict[str,dict[str,pd.DataFrame]], float_dtype: np.dtype = np.float32,
+                 keep_precision: tuple[str,...] = ('Time',)):
+        self.keys = [(campaign, fname) for campaign, flight_dfs in all_campaign_dfs.items() for fname in flight_dfs]
+        frames = [all_campaign_dfs[campaign][fname] for (campaign, fname) in self.keys]
+        self.columns = [list(df.columns) for df in frames]
+        lengths = np.array([len(df) for df in frames], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        nrows = int(self.offsets[-1])
+
+        # the union of the flights' columns, in the order they are first seen, and the dtype to store each in
+        dtypes = {}
+        for df in frames:
+            for name, dtype in df.dtypes.items():
+                if name not in dtypes:
+                    dtypes[name] = dtype
+                elif dtypes[name] != dtype:
+                    dtypes[name] = np.result_type(dtypes[name], dtype)
+        for name, dtype in dtypes.items():
+            if float_dtype is not None and np.issubdtype(dtype, np.floating) and name not in keep_precision:
+                dtypes[name] = np.dtype(float_dtype)
+
+        # fill each column in place, flight by flight
+        columns = {}
+        for name, dtype in dtypes.items():
+            if np.issubdtype(dtype, np.datetime64):
+                column = np.full(nrows, np.datetime64('NaT'), dtype=dtype)
+            elif dtype == bool:
+                column = np.zeros(nrows, dtype=bool)
+            elif np.issubdtype(dtype, np.number):
+                dtype = dtype if np.issubdtype(dtype, np.floating) else np.float64 # NaN for flights lacking it
+                column = np.full(nrows, np.nan, dtype=dtype)
+            else:
+                column = np.full(nrows, None, dtype=object)
+            for k, df in enumerate(frames):
+                if name in df:
+                    column[self.offsets[k]:self.offsets[k+1]] = df[name].to_numpy()
+            columns[name] = column
+
+        flight_idx = np.repeat(np.arange(len(self.keys)), lengths)
+        campaigns = list(dict.fromkeys(campaign for (campaign, _) in self.keys))
+        campaign_codes = np.array([campaigns.index(campaign) for (campaign, _) in self.keys], dtype=np.int16)
+        fnames = list(dict.fromkeys(fname for (_, fname) in self.keys))
+        fname_codes = np.array([fnames.index(fname) for (_, fname) in self.keys], dtype=np.int32)
+        self.df = pd.DataFrame(dict({'campaign': pd.Categorical.from_codes(campaign_codes[flight_idx], campaigns),
+                                     'flight': pd.Categorical.from_codes(fname_codes[flight_idx], fnames)},
+                                    **columns), copy=False)
+        self._positions = {key: k for k, key in enumerate(self.keys)}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def flight(self, campaign: str, fname: str) -> pd.DataFrame:
+        """
+        flight returns the rows of one flight, as a slice of the table (i.e. without copying its data).
+
+        :param campaign: The field campaign name
+        :param fname: The flight's file name
+
+        :return: Returns a DataFrame of the flight's rows and own columns (plus 'campaign' and 'flight'), without the
+                 columns only other flights have, indexed by a DatetimeIndex if the flight has 'datetime'.
+        """
+        k = self._positions[(campaign, fname)]
+        df = self.df.iloc[self.offsets[k]:self.offsets[k+1]][['campaign','flight'] + self.columns[k]]
+        if 'datetime' in df:
+            df = df.set_index(pd.DatetimeIndex(df['datetime'].to_numpy()), drop=False)
+        return df
+
+    def to_dict(self) -> dict[str,dict[str,pd.DataFrame]]:
+        """
+        to_dict returns the flights in the layout read_all_flights returns, a dictionary (keys of field campaigns) of
+                dictionaries (keys of file names) of DataFrames, each a slice of the table. It can be passed to
+                consumers of that layout, e.g. plot_utils.plot_campaigns.
+        """
+        all_campaign_dfs = {}
+        for (campaign, fname) in self.keys:
+            all_campaign_dfs.setdefault(campaign, {})[fname] = self.flight(campaign, fname)
+        return all_campaign_dfs
+
+    def nbytes(self) -> int:
+        """
+        nbytes returns the memory used by the table's columns in bytes.
+        """
+        return int(self.df.memory_usage(index=True, deep=True).sum())
@@ -0,0 +1,604 @@
+import pandas as pd
+import numpy as np
+import util.model_utils as model_utils
+import util.profile_utils as profile_utils
+
+def calc_cell_edges(centers: np.ndarray, periodic: bool = False) -> np.ndarray:
+    """
+    calc_cell_edges estimates the edges of the grid cells of a regular latitude or longitude axis as the midpoints
+                    between the grid cell centers.
+
+    :param centers: A 1-D array of monotonically increasing grid cell centers in degrees
+    :param periodic: If True, the axis is treated as longitude wrapping around 360 degrees, so the first and last edges
+                     are the midpoints across the wrap. Otherwise (latitude), the outer edges are extrapolated by half a
+                     grid spacing and clipped to +/-90 degrees.
+
+    :return: Returns a 1-D array of len(centers)+1 edges.
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    edges = np.empty(len(centers)+1)
+    edges[1:-1] = 0.5*(centers[1:] + centers[:-1])
+    if periodic:
+        half_wrap = 0.5*(centers[0] + 360. - centers[-1])
+        edges[0] = centers[0] - half_wrap
+        edges[-1] = centers[-1] + half_wrap
+    else:
+        edges[0] = max(centers[0] - 0.5*(centers[1] - centers[0]), -90.)
+        edges[-1] = min(centers[-1] + 0.5*(centers[-1] - centers[-2]), 90.)
+    return edges
+
+def find_lat_idx(lat: np.ndarray, lat_edges: np.ndarray) -> np.ndarray:
+    """
+    find_lat_idx finds the latitude index of the grid cell each sample falls in.
+
+    :param lat: An array of sample latitudes in degrees
+    :param lat_edges: A 1-D array of grid cell edges from calc_cell_edges, either increasing or decreasing
+
+    :return: Returns an int array of latitude indices, -1 where a sample is outside the grid or NaN.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    descending = lat_edges[0] > lat_edges[-1]
+    edges = lat_edges[::-1] if descending else lat_edges
+    ncells = len(edges) - 1
+
+    idx = np.searchsorted(edges, lat, side='right') - 1
+    idx[lat == edges[-1]] = ncells - 1 # the last edge belongs to the last cell
+    idx[(idx < 0) | (idx >= ncells) | np.isnan(lat)] = -1
+    if descending:
+        idx = np.where(idx >= 0, ncells - 1 - idx, -1)
+    return idx
+
+def find_lon_idx(lon: np.ndarray, lon_edges: np.ndarray) -> np.ndarray:
+    """
+    find_lon_idx finds the longitude index of the grid cell each sample falls in. Longitudes are wrapped, so e.g.
+                 samples at -170 (flight convention) fall in the cells centered near 190 (model convention).
+
+    :param lon: An array of sample longitudes in degrees
+    :param lon_edges: A 1-D array of increasing grid cell edges from calc_cell_edges(lons, periodic=True)
+
+    :return: Returns an int array of longitude indices, -1 where a sample is NaN.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    ncells = len(lon_edges) - 1
+
+    # shift longitudes into [lon_edges[0], lon_edges[0] + 360)
+    lon_wrapped = np.mod(lon - lon_edges[0], 360.) + lon_edges[0]
+    idx = np.searchsorted(lon_edges, lon_wrapped, side='right') - 1
+    idx = np.mod(idx, ncells) # a sample rounded onto the last edge is in the first cell
+    idx[np.isnan(lon)] = -1
+    return idx
+
+def to_datetime64(times) -> np.ndarray:
+    """
+    to_datetime64 converts an array of times, e.g. the cftime objects xarray decodes CAM times to, to datetime64[ns].
+
+    :param times: An array of datetime64, datetime or cftime times
+
+    :return: Returns a numpy datetime64[ns] array.
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return times.astype('datetime64[ns]')
+    return np.array([np.datetime64(t.isoformat()) for t in times.ravel()], dtype='datetime64[ns]').reshape(times.shape)
+
+def find_time_idx(times: np.ndarray, model_times: np.ndarray) -> np.ndarray:
+    """
+    find_time_idx finds the index of the model output time nearest to each sample time.
+
+    :param times: An array of sample times (datetime64)
+    :param model_times: A 1-D array of increasing model output times (datetime64 or cftime)
+
+    :return: Returns an int array of time indices, -1 where a sample is more than half an output interval before the
+             first or after the last model time, or NaT. If there is a single model time, every valid sample maps to it.
+    """
+    times = to_datetime64(times).astype(np.int64)
+    nat = times == np.iinfo(np.int64).min
+    model_times = to_datetime64(model_times).astype(np.int64)
+    ntimes = len(model_times)
+    if ntimes == 1:
+        return np.where(nat, -1, 0)
+
+    # bin the samples by the midpoints between output times, extended half an interval past either end
+    bounds = np.empty(ntimes+1)
+    bounds[1:-1] = 0.5*(model_times[1:] + model_times[:-1])
+    bounds[0] = model_times[0] - 0.5*(model_times[1] - model_times[0])
+    bounds[-1] = model_times[-1] + 0.5*(model_times[-1] - model_times[-2])
+    idx = np.searchsorted(bounds, times, side='right') - 1
+    idx[(idx < 0) | (idx >= ntimes) | nat] = -1
+    return idx
+
+def _bisect_levels(height, alt: np.ndarray, n: int) -> np.ndarray:
+    """
+    _bisect_levels counts, for every sample at once, how many of n increasing heights are at or below it. Each of the
+                   log2(n) steps of the bisection calls height once, for one height per sample, so neither a Python
+                   loop over samples nor a (nsample by n) copy of the columns is needed.
+
+    :param height: A function of an int array k (shaped like alt, each in [0, n)) returning the k-th height of each
+                   sample's column
+    :param alt: An array of sample heights
+    :param n: The number of heights in each column
+
+    :return: Returns an int array, shaped like alt, of the number of heights at or below each sample.
+    """
+    lo = np.zeros(np.shape(alt), dtype=np.intp)
+    hi = np.full(np.shape(alt), n, dtype=np.intp)
+    for _ in range(int(np.ceil(np.log2(n + 1)))):
+        mid = (lo + hi)//2
+        searching = lo < hi
+        below = height(np.minimum(mid, n - 1)) <= alt
+        lo = np.where(searching & below, mid + 1, lo)
+        hi = np.where(searching & ~below, mid, hi)
+    return lo
+
+def find_lev_idx(zi: np.ndarray, time_idx: np.ndarray, lat_idx: np.ndarray, lon_idx: np.ndarray,
+                 alt: np.ndarray) -> np.ndarray:
+    """
+    find_lev_idx finds the model level each sample falls in, given the interface heights of the sample's column.
+
+    The search is a bisection carried out on all samples at once: each of the log2(nlev) steps gathers one interface
+    height per sample, so neither a Python loop over samples nor a (nsample by nlev) copy of the columns is needed.
+
+    :param zi: A 4-D (ntime by nlev+1 by nlat by nlon) array of interface heights, surface first and increasing, e.g.
+               from calc_phii_hydro or calc_phii_midpoint
+    :param time_idx: An int array of the samples' time indices
+    :param lat_idx: An int array of the samples' latitude indices
+    :param lon_idx: An int array of the samples' longitude indices
+    :param alt: An array of sample altitudes in meters
+
+    :return: Returns an int array of level indices (0 is the surface level), -1 where a sample is below the surface,
+             above the model top, NaN, or has an index of -1.
+    """
+    alt = np.asarray(alt, dtype=np.float64)
+    ninterfaces = zi.shape[1]
+    valid = (time_idx >= 0) & (lat_idx >= 0) & (lon_idx >= 0) & np.isfinite(alt)
+    t, j, i, alt_valid = time_idx[valid], lat_idx[valid], lon_idx[valid], alt[valid]
+
+    # flat index of each sample's surface interface, and the distance between interfaces in the flattened array
+    zi_flat = np.ravel(zi)
+    level_stride = zi.shape[2]*zi.shape[3]
+    base = (t*ninterfaces*level_stride + j*zi.shape[3] + i).astype(np.intp)
+
+    # count the interfaces at or below each sample
+    lo = _bisect_levels(lambda k: zi_flat[base + k*level_stride], alt_valid, ninterfaces)
+
+    lev = np.full(len(alt), -1, dtype=np.intp)
+    lev_valid = lo - 1
+    lev_valid[(lo == 0) | (lo == ninterfaces)] = -1 # below the surface or above the model top
+    lev[valid] = lev_valid
+    return lev
+
+def get_flight_position(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    get_flight_position pulls the sample positions out of a flight DataFrame. GGLAT/GGLON are used if they were read
+                        in, otherwise the GPS-corrected IRU LATC/LONC.
+
+    :param df: A flight DataFrame from flight_utils.read_flight_nc, with a DatetimeIndex or 'datetime' column,
+               GGALT, and GGLAT/GGLON or LATC/LONC
+
+    :return: Returns a tuple of arrays of (datetime64 times, latitudes, longitudes, altitudes).
+    """
+    if "GGLAT" in df and "GGLON" in df:
+        lat, lon = df["GGLAT"].to_numpy(), df["GGLON"].to_numpy()
+    elif "LATC" in df and "LONC" in df:
+        lat, lon = df["LATC"].to_numpy(), df["LONC"].to_numpy()
+    else:
+        raise KeyError("Neither GGLAT/GGLON nor LATC/LONC are in the flight DataFrame")
+    if 'datetime' in df:
+        times = df['datetime'].to_numpy()
+    elif isinstance(df.index, pd.DatetimeIndex):
+        times = df.index.to_numpy()
+    else:
+        raise KeyError("The flight DataFrame has neither a 'datetime' column nor a DatetimeIndex")
+    return times, lat, lon, df["GGALT"].to_numpy()
+
+@profile_utils.timed('mapping.map_flight_to_grid')
+def map_flight_to_grid(df: pd.DataFrame, lats: np.ndarray, lons: np.ndarray, zi: np.ndarray,
+                       model_times: np.ndarray = None) -> pd.DataFrame:
+    """
+    map_flight_to_grid assigns every flight sample to a model grid cell on a regular lat/lon grid.
+
+    :param df: A flight DataFrame from flight_utils.read_flight_nc (see get_flight_position for the needed columns)
+    :param lats: A 1-D array of the model grid cell center latitudes
+    :param lons: A 1-D array of the model grid cell center longitudes
+    :param zi: A 4-D (ntime by nlev+1 by nlat by nlon) array of interface heights, surface first, e.g. from
+               calc_phii_hydro or calc_phii_midpoint
+    :param model_times: A 1-D array of the model output times of zi. Optional if zi has a single time.
+
+    :return: Returns a DataFrame, with the same index as df, of int columns time_idx, lev_idx, lat_idx, lon_idx (the
+             level index counts up from the surface, like zi) and a boolean column valid. Indices are -1 where a
+             sample could not be placed in a cell, and valid is True only where all four indices are.
+    """
+    times, lat, lon, alt = get_flight_position(df)
+
+    lat_idx = find_lat_idx(lat, calc_cell_edges(lats))
+    lon_idx = find_lon_idx(lon, calc_cell_edges(lons, periodic=True))
+    if model_times is None:
+        if zi.shape[0] != 1:
+            raise ValueError("model_times are needed when zi has more than one time")
+        time_idx = np.where(np.isnat(times), -1, 0)
+    else:
+        time_idx = find_time_idx(times, model_times)
+    lev_idx = find_lev_idx(zi, time_idx, lat_idx, lon_idx, alt)
+
+    cells = pd.DataFrame({'time_idx': time_idx, 'lev_idx': lev_idx, 'lat_idx': lat_idx, 'lon_idx': lon_idx},
+                         index=df.index)
+    cells['valid'] = (time_idx >= 0) & (lev_idx >= 0) & (lat_idx >= 0) & (lon_idx >= 0)
+    cells.loc[~cells['valid'].to_numpy(), ['time_idx','lev_idx','lat_idx','lon_idx']] = -1
+    if profile_utils.active():
+        profile_utils.count('mapping.rows', len(cells))
+        profile_utils.count('mapping.rows_outside_grid', int((~cells['valid']).sum()))
+    return cells
+
+def calc_cell_ids(cells: pd.DataFrame, grid_shape: tuple[int,int,int,int]) -> np.ndarray:
+    """
+    calc_cell_ids flattens the (time_idx, lev_idx, lat_idx, lon_idx) cell indices from map_flight_to_grid into a
+                  single int64 id per sample, which is convenient to group samples by cell.
+
+    :param cells: A DataFrame from map_flight_to_grid
+    :param grid_shape: The (ntime, nlev, nlat, nlon) shape of the model grid
+
+    :return: Returns an int64 array of cell ids, -1 for samples that are not valid.
+    """
+    valid = cells['valid'].to_numpy()
+    ids = np.full(len(cells), -1, dtype=np.int64)
+    ids[valid] = np.ravel_multi_index((cells['time_idx'].to_numpy()[valid], cells['lev_idx'].to_numpy()[valid],
+                                       cells['lat_idx'].to_numpy()[valid], cells['lon_idx'].to_numpy()[valid]),
+                                      grid_shape)
+    return ids
+
+def _gather_columns(field, time_idx: np.ndarray, lat_idx: np.ndarray, lon_idx: np.ndarray) -> np.ndarray:
+    """
+    _gather_columns reads a set of (time, lat, lon) columns of a field without reading the rest of it.
+
+    :param field: A 2-D (lat, lon), 3-D (time, lat, lon) or 4-D (time, lev, lat, lon) numpy array or xarray DataArray.
+                  For DataArrays, a vectorized isel is used, so lazily loaded fields only read what is needed.
+    :param time_idx: An int array of column time indices (ignored for 2-D fields)
+    :param lat_idx: An int array of column latitude indices
+    :param lon_idx: An int array of column longitude indices
+
+    :return: Returns a (ncol,) array for 2-D and 3-D fields, or a (ncol by nlev) array for 4-D fields.
+    """
+    ndim = len(field.shape)
+    if hasattr(field, 'isel'):
+        import xarray as xr
+        indexers = dict(zip(field.dims[-2:], [xr.DataArray(lat_idx, dims='col'), xr.DataArray(lon_idx, dims='col')]))
+        if ndim > 2:
+            indexers[field.dims[0]] = xr.DataArray(time_idx, dims='col')
+        return np.asarray(field.isel(indexers).transpose('col', ...).values, dtype=np.float64)
+    field = np.asarray(field)
+    if ndim == 2:
+        return field[lat_idx, lon_idx].astype(np.float64)
+    elif ndim == 3:
+        return field[time_idx, lat_idx, lon_idx].astype(np.float64)
+    return field[time_idx, :, lat_idx, lon_idx].astype(np.float64)
+
+class vertical_index:
+    """
+    vertical_index looks up the model level, and the fractional position within it, of flight samples that fall between
+    CAM history output times. Interface heights are computed by hydrostatic integration (calc_phii_hydro_cesm) only for
+    the (time, lat, lon) columns that samples actually visit, memoized, and interpolated linearly in time between the
+    two output times bracketing each sample.
+
+    The __init__ takes the CAM fields needed by calc_phii_hydro_cesm and the model output times. The 3-D and 4-D fields
+    can be lazily loaded xarray DataArrays (e.g. ds.PS, ds.T, ds.Q), in which case only visited columns are read.
+    The __init__ assigns:
+    self.model_times: np.ndarray; datetime64 model output times
+    self.column_ids: np.ndarray; the sorted ids of the memoized (time, lat, lon) columns
+    self.zi: np.ndarray; a (ncolumns by nlev+1) array of interface heights of the memoized columns, surface first
+    """
+    def __init__(self, ps, p0: float, hyai: np.array, hybi: np.array, tk, q, phis, model_times: np.ndarray,
+                 hyam: np.array = None, hybm: np.array = None):
+        self.ps, self.tk, self.q, self.phis = ps, tk, q, phis
+        self.p0 = p0
+        self.hyai, self.hybi, self.hyam, self.hybm = hyai, hybi, hyam, hybm
+        self.model_times = to_datetime64(model_times)
+        self.grid_shape = tuple(ps.shape) # (ntime, nlat, nlon)
+        self.column_ids = np.zeros(0, dtype=np.int64)
+        self.zi = np.zeros((0, len(hyai)))
+
+    @classmethod
+    def from_dataset(cls, ds) -> 'vertical_index':
+        """
+        from_dataset builds a vertical_index from an xarray Dataset of a CAM history file (PS, P0, hyai, hybi, hyam,
+                     hybm, T, Q, PHIS and time).
+        """
+        return cls(ds.PS, ds.P0.values, ds.hyai.values, ds.hybi.values, ds.T, ds.Q, ds.PHIS, ds.time.values,
+                   ds.hyam.values, ds.hybm.values)
+
+    @profile_utils.timed('mapping.vertical_index.column_heights')
+    def _column_rows(self, column_ids: np.ndarray) -> np.ndarray:
+        """
+        _column_rows returns the rows of self.zi holding the given columns, computing and memoizing missing ones.
+        """
+        missing = np.setdiff1d(column_ids, self.column_ids)
+        if len(missing) > 0:
+            t, j, i = np.unravel_index(missing, self.grid_shape)
+            ps = _gather_columns(self.ps, t, j, i)
+            tk = _gather_columns(self.tk, t, j, i)
+            q = _gather_columns(self.q, t, j, i)
+            phis = _gather_columns(self.phis, t, j, i)
+            # lay the columns out along longitude of a single time and latitude
+            zi = model_utils.calc_phii_hydro_cesm(ps[None,None,:], self.p0, self.hyai, self.hybi,
+                                                  tk.T[None,:,None,:], q.T[None,:,None,:], phis[None,:],
+                                                  self.hyam, self.hybm)
+            ids = np.concatenate([self.column_ids, missing])
+            zis = np.concatenate([self.zi, zi[0,:,0,:].T])
+            order = np.argsort(ids)
+            self.column_ids, self.zi = ids[order], zis[order]
+        return np.searchsorted(self.column_ids, column_ids)
+
+    @profile_utils.timed('mapping.vertical_index.lookup')
+    def lookup(self, times: np.ndarray, lat_idx: np.ndarray, lon_idx: np.ndarray,
+               alt: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        lookup finds the model level and fractional position within it of a batch of samples.
+
+        :param times: An array of sample times (datetime64)
+        :param lat_idx: An int array of the samples' latitude indices, e.g. from find_lat_idx
+        :param lon_idx: An int array of the samples' longitude indices, e.g. from find_lon_idx
+        :param alt: An array of sample altitudes in meters
+
+        :return: Returns a tuple of an int array of level indices (0 is the surface level) and a float array of the
+                 fractional height within that level (0 at its lower, 1 at its upper interface). Samples outside the
+                 model times, below the surface, above the model top, or with -1 indices get -1 and NaN. If there is a
+                 single model time, every sample with a valid time is placed in its columns.
+        """
+        times = to_datetime64(times).astype(np.int64)
+        alt = np.asarray(alt, dtype=np.float64)
+        model_times = self.model_times.astype(np.int64)
+        ntimes = len(model_times)
+
+        # the output times bracketing each sample, and the weight of the later one
+        t0 = np.clip(np.searchsorted(model_times, times, side='right') - 1, 0, max(ntimes - 2, 0))
+        t1 = np.minimum(t0 + 1, ntimes - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(t1 > t0, (times - model_times[t0])/(model_times[t1] - model_times[t0]).astype(np.float64), 0.)
+        valid = (times != np.iinfo(np.int64).min) & (w >= 0) & (w <= 1) & (lat_idx >= 0) & (lon_idx >= 0) \
+                & np.isfinite(alt)
+        if ntimes > 1:
+            # a single output time is used for every sample, as in find_time_idx
+            valid &= (times >= model_times[0]) & (times <= model_times[-1])
+
+        lev = np.full(len(alt), -1, dtype=np.intp)
+        frac = np.full(len(alt), np.nan)
+        if not np.any(valid):
+            return lev, frac
+        w = w[valid]
+        alt = alt[valid]
+        ids0 = np.ravel_multi_index((t0[valid], lat_idx[valid], lon_idx[valid]), self.grid_shape)
+        ids1 = np.ravel_multi_index((t1[valid], lat_idx[valid], lon_idx[valid]), self.grid_shape)
+        rows0 = self._column_rows(ids0)
+        rows1 = self._column_rows(ids1)
+
+        # interface k of each sample's column, interpolated in time
+        ninterfaces = self.zi.shape[1]
+        zi_flat = self.zi.ravel()
+        base0 = rows0*ninterfaces
+        base1 = rows1*ninterfaces
+        def height(k):
+            z0 = zi_flat[base0 + k]
+            return z0 + w*(zi_flat[base1 + k] - z0)
+
+        # bisection over the time-interpolated interfaces, counting those at or below each sample
+        lo = _bisect_levels(height, alt, ninterfaces)
+
+        inside = (lo > 0) & (lo < ninterfaces)
+        lev_valid = np.where(inside, lo - 1, -1)
+        k = np.maximum(lev_valid, 0)
+        z_lower = height(k)
+        frac_valid = np.where(inside, (alt - z_lower)/(height(k + 1) - z_lower), np.nan)
+        lev[valid] = lev_valid
+        frac[valid] = frac_valid
+        return lev, frac
+
+def _axis_weights(x: np.ndarray, centers: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    _axis_weights finds the two grid points bracketing each value along an increasing axis, and the linear weight of
+                  the upper one.
+
+    :return: Returns a tuple of the lower and upper indices, the weights and a boolean array, False where a value is
+             outside the axis or NaN.
+    """
+    if len(centers) == 1:
+        zeros = np.zeros(len(x), dtype=np.intp)
+        return zeros, zeros, np.zeros(len(x)), x == centers[0]
+    i0 = np.clip(np.searchsorted(centers, x, side='right') - 1, 0, len(centers) - 2)
+    with np.errstate(invalid='ignore'):
+        w = (x - centers[i0])/(centers[i0 + 1] - centers[i0])
+        inside = (w >= 0) & (w <= 1)
+    return i0, i0 + 1, w, inside
+
+def _lat_weights(lat: np.ndarray, lats: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    _lat_weights is _axis_weights for a latitude axis, either increasing or decreasing.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    if len(lats) > 1 and lats[0] > lats[-1]:
+        j0, j1, w, inside = _axis_weights(lat, lats[::-1])
+        return len(lats) - 1 - j0, len(lats) - 1 - j1, w, inside
+    return _axis_weights(lat, lats)
+
+def _lon_weights(lon: np.ndarray, lons: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    _lon_weights is _axis_weights for longitudes, in any convention, on a longitude axis that is either the whole
+                 circle, in which case samples between the last and first longitudes are interpolated across the
+                 wrap, or a run of it that may cross the dateline or the 0/360 seam, e.g. a cam_subset's longitudes.
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    nlon = len(lons)
+    # degrees east of the first longitude
+    rel = np.mod(lons - lons[0], 360.)
+    x = np.mod(lon - lons[0], 360.)
+    periodic = nlon > 1 and abs(nlon*rel[1] - 360.) < 1e-6*360.
+    if not periodic:
+        return _axis_weights(x, rel)
+    i0 = np.minimum(np.searchsorted(rel, x, side='right') - 1, nlon - 1)
+    i0[np.isnan(x)] = 0
+    upper = np.append(rel[1:], 360.)
+    w = (x - rel[i0])/(upper[i0] - rel[i0])
+    return i0, (i0 + 1) % nlon, w, np.isfinite(x)
+
+class interp_weights:
+    """
+    interp_weights interpolates model fields onto the flight path: linearly in time between the two output times
+    bracketing each sample, bilinearly in latitude and longitude between the four surrounding grid columns, and
+    linearly in height between the two model levels bracketing the sample in each of those eight columns. The flat
+    indices of the 16 grid points each sample depends on and their weights are computed once, so every field is then
+    sampled with one gather and one weighted sum over all samples, and sampling many fields costs little more than
+    sampling one.
+
+    Level heights are the midpoints of the interface heights zi (e.g. from calc_phii_hydro, calc_phii_hydro_cesm or
+    calc_phii_midpoint) of each column. Below the lowest or above the highest level height, fields are held constant.
+    Samples outside the model times or the lat/lon grid, below the surface or above the model top are not valid, and
+    sample to NaN.
+
+    The __init__ takes a flight DataFrame (see get_flight_position for the needed columns), the grid cell center
+    latitudes and longitudes, the (ntime by nlev+1 by nlat by nlon) interface heights, surface first, and the model
+    output times (optional if zi has a single time). The grid can be a cam_subset's, including a longitude run across
+    the seam. The __init__ assigns:
+    self.index: pd.Index; the index of the flight DataFrame
+    self.grid_shape: tuple[int,int,int,int]; the (ntime, nlev, nlat, nlon) shape of the model grid
+    self.valid: np.ndarray; a boolean array, True for samples that can be interpolated
+    self.flat: np.ndarray; an (nsample by 16) int array of the flat indices of each sample's grid points in a 4-D
+               (ntime by nlev by nlat by nlon) field in CAM level order (model top first)
+    self.weights: np.ndarray; an (nsample by 16) array of the weights of those points, summing to 1 (0 if not valid)
+    self.column_flat: np.ndarray; an (nsample by 8) int array of the flat indices of each sample's grid columns in a
+                      3-D (ntime by nlat by nlon) field
+    self.column_weights: np.ndarray; an (nsample by 8) array of the weights of those columns
+    """
+    @profile_utils.timed('mapping.interp_weights')
+    def __init__(self, df: pd.DataFrame, lats: np.ndarray, lons: np.ndarray, zi: np.ndarray,
+                 model_times: np.ndarray = None):
+        times, lat, lon, alt = get_flight_position(df)
+        alt = np.asarray(alt, dtype=np.float64)
+        ntime, ninterfaces, nlat, nlon = zi.shape
+        nlev = ninterfaces - 1
+        self.index = df.index
+        self.grid_shape = (ntime, nlev, nlat, nlon)
+        n = len(alt)
+
+        if model_times is None:
+            if ntime != 1:
+                raise ValueError("model_times are needed when zi has more than one time")
+            t0 = t1 = np.zeros(n, dtype=np.intp)
+            wt = np.zeros(n)
+            t_ok = ~np.isnat(times)
+        else:
+            # times as float ns since the first output time
+            model_times = to_datetime64(model_times)
+            times = to_datetime64(times)
+            t_ok = ~np.isnat(times)
+            t0, t1, wt, inside = _axis_weights(np.where(t_ok, (times - model_times[0]).astype(np.float64), np.nan),
+                                               (model_times - model_times[0]).astype(np.float64))
+            t_ok &= inside
+        j0, j1, wj, j_ok = _lat_weights(np.asarray(lat, dtype=np.float64), lats)
+        i0, i1, wi, i_ok = _lon_weights(np.asarray(lon, dtype=np.float64), lons)
+        valid = t_ok & j_ok & i_ok & np.isfinite(alt)
+
+        # the 8 columns of each sample, time slowest and longitude fastest, and their weights
+        t = np.stack([t0, t1], axis=1)[:,:,None,None]
+        j = np.stack([j0, j1], axis=1)[:,None,:,None]
+        i = np.stack([i0, i1], axis=1)[:,None,None,:]
+        column_weights = (np.stack([1 - wt, wt], axis=1)[:,:,None,None]*np.stack([1 - wj, wj], axis=1)[:,None,:,None]
+                          *np.stack([1 - wi, wi], axis=1)[:,None,None,:]).reshape(n, 8)
+        t, j, i = (np.broadcast_to(a, (n, 2, 2, 2)).reshape(n, 8) for a in (t, j, i))
+        column_weights[~valid] = 0.
+        t, j, i = (np.where(valid[:,None], a, 0) for a in (t, j, i))
+
+        # bisection over the level heights of each column, counting those at or below the sample
+        zi_flat = np.ravel(zi)
+        level_stride = nlat*nlon
+        base = (t*ninterfaces*level_stride + j*nlon + i).astype(np.intp)
+        def height(k):
+            return 0.5*(zi_flat[base + k*level_stride] + zi_flat[base + (k + 1)*level_stride])
+        alt_col = np.where(valid, alt, 0.)[:,None]
+        lo = _bisect_levels(height, np.broadcast_to(alt_col, base.shape), nlev)
+        k0 = np.clip(lo - 1, 0, max(nlev - 2, 0))
+        k1 = np.minimum(k0 + 1, nlev - 1)
+        z0, z1 = height(k0), height(k1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            wk = np.where(k1 > k0, np.clip((alt_col - z0)/(z1 - z0), 0., 1.), 0.)
+
+        # between the surface and the model top, interpolated like the fields
+        z_surface = np.einsum('nc,nc->n', zi_flat[base], column_weights)
+        z_top = np.einsum('nc,nc->n', zi_flat[base + nlev*level_stride], column_weights)
+        valid &= (alt >= z_surface) & (alt <= z_top)
+        column_weights[~valid] = 0.
+
+        column_flat = (t*nlat + j)*nlon + i
+        # levels in CAM order, model top first
+        lev = nlev - 1 - np.stack([k0, k1], axis=2)
+        self.flat = (((t*nlev)[:,:,None] + lev)*level_stride + (j*nlon + i)[:,:,None]).reshape(n, 16)
+        self.weights = (column_weights[:,:,None]*np.stack([1 - wk, wk], axis=2)).reshape(n, 16)
+        self.column_flat = column_flat
+        self.column_weights = column_weights
+        self.valid = valid
+        profile_utils.count('mapping.interp_rows', n)
+
+    @classmethod
+    def from_arrays(cls, index: pd.Index, grid_shape: tuple[int,int,int,int], valid: np.ndarray, flat: np.ndarray,
+                    weights: np.ndarray) -> 'interp_weights':
+        """
+        from_arrays rebuilds an interp_weights from its index, grid_shape, valid, flat and weights, e.g. as saved by
+                    cache_utils.mapping_cache, without the grid geometry. The column indices and weights are derived
+                    from the level ones.
+        """
+        self = cls.__new__(cls)
+        ntime, nlev, nlat, nlon = grid_shape
+        level_stride = nlat*nlon
+        self.index = index
+        self.grid_shape = tuple(int(size) for size in grid_shape)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.flat = np.asarray(flat, dtype=np.intp)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        # each column's two levels are adjacent in flat and weights
+        lower = self.flat[:,::2]
+        self.column_flat = (lower//(nlev*level_stride))*level_stride + lower % level_stride
+        self.column_weights = self.weights[:,::2] + self.weights[:,1::2]
+        return self
+
+    def sample(self, field, surface_first: bool = False) -> np.ndarray:
+        """
+        sample interpolates a field onto the flight samples.
+
+        :param field: A 4-D (ntime by nlev by nlat by nlon), 3-D (ntime by nlat by nlon) or 2-D (nlat by nlon) numpy
+                      array or xarray DataArray on the model grid (or subset) the weights were computed for
+        :param surface_first: If True, the levels of a 4-D field are surface first, like zi, rather than in CAM order.
+                              Optional. Default is False.
+
+        :return: Returns a float64 array of the field at each sample, NaN where a sample is not valid.
+        """
+        field = np.asarray(field)
+        ntime, nlev, nlat, nlon = self.grid_shape
+        if field.ndim == 4:
+            if field.shape != self.grid_shape:
+                raise ValueError(f"A 4-D field of shape {field.shape} is not on the {self.grid_shape} grid")
+            flat, weights = self.flat, self.weights
+            if surface_first:
+                level_stride = nlat*nlon
+                flat = flat + (nlev - 1 - 2*((flat//level_stride) % nlev))*level_stride
+        elif field.ndim == 3 and field.shape == (ntime, nlat, nlon):
+            flat, weights = self.column_flat, self.column_weights
+        elif field.ndim == 2 and field.shape == (nlat, nlon):
+            flat, weights = self.column_flat % (nlat*nlon), self.column_weights
+        else:
+            raise ValueError(f"A field of shape {field.shape} is not on the {self.grid_shape} grid")
+        values = np.einsum('nc,nc->n', field.reshape(-1)[flat], weights)
+        values[~self.valid] = np.nan
+        return values
+
+    @profile_utils.timed('mapping.interp_weights.sample_dataset')
+    def sample_dataset(self, ds, names: list[str] = None) -> pd.DataFrame:
+        """
+        sample_dataset interpolates the fields of an xarray Dataset, e.g. a cam_subset's ds, onto the flight samples.
+
+        :param ds: An xarray Dataset on the model grid (or subset) the weights were computed for
+        :param names: A list of the fields to sample. Optional. Default is every (time, lev, lat, lon),
+                      (time, lat, lon) and (lat, lon) field of ds.
+
+        :return: Returns a DataFrame, with the same index as the flight DataFrame, of one column per field.
+        """
+        if names is None:
+            shapes = [('time','lev','lat','lon'), ('time','lat','lon'), ('lat','lon')]
+            names = [name for name in ds.data_vars if ds[name].dims in shapes]
+        return pd.DataFrame({name: self.sample(ds[name].values) for name in names}, index=self.index)
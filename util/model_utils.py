@@ -6,29 +6,39 @@ import os
 from datetime import datetime, timedelta
 from fnmatch import fnmatch
 from typing import Iterable
+import util.profile_utils as profile_utils
 
 g = 9.8067
 Rd = 287.1
 Rv = 461.5
 ep = Rd/Rv
 
-def calc_pressure_cesm(ps: np.ndarray, p0: float, a: np.array, b: np.array) -> np.ndarray:
+@profile_utils.timed('model.calc_pressure_cesm')
+def calc_pressure_cesm(ps: np.ndarray, p0: float, a: np.array, b: np.array, out: np.ndarray = None,
+                       dtype: np.dtype = None, time_chunk: int = None) -> np.ndarray:
     """
     calc_pressure_cesm computes pressure on the model levels given surface pressure, reference pressure, and the hybrid
                        level coefficients a and b. See overview at 
                        https://www2.cesm.ucar.edu/models/atm-cam/docs/usersguide/node25.html
-                       Simply, p = a*p0 + b*ps.
+                       Simply, p = a*p0 + b*ps, computed by broadcasting the coefficients against ps.
 
-    :param ps: A 2-D (nlat by nlon) or 3-D (ntime by nlat by nlon) numpy array of surface pressure
+    :param ps: A 2-D (nlat by nlon) or 3-D (ntime by nlat by nlon) array of surface pressure. Anything that can be
+               sliced along time and converted with np.asarray, e.g. a numpy, xarray or dask-backed array, works.
     :param p0: The scalar reference pressure
-    :param a: An array of a hybrid level coefficients 
-    :param b: An array of b hybrid level coefficients 
-
-    :return: Returns  4-D array of grid-cell-center pressure.
+    :param a: An array of a hybrid level coefficients, in CAM order (model top first)
+    :param b: An array of b hybrid level coefficients, in CAM order (model top first)
+    :param out: An optional C-contiguous (ntime by nlev by nlat by nlon) array to write the pressures into.
+    :param dtype: The dtype of the computation and output, e.g. np.float32 to halve the memory. Optional. Default is
+                  the dtype of out if given, otherwise float64.
+    :param time_chunk: The number of times of ps to load and compute at once. Optional. Default is all of them. For
+                       lazily loaded (e.g. xarray/dask-backed) ps, this bounds how much of ps is in memory at a time.
+
+    :return: Returns a C-contiguous 4-D array (ntime by nlev by nlat by nlon) of pressure. The level index is flipped
+             relative to CAM, i.e. level 0 is nearest the surface and pressure decreases with level index.
     """
 
     # if ps is 2-D, make it 3-D
-    if len(ps.shape) == 2: ps = ps[None,:,:]
+    if len(ps.shape) == 2: ps = np.asarray(ps)[None,:,:]
 
     # figure out what the output dimensions should be
     ntimes = ps.shape[0]
@@ -36,18 +46,27 @@ def calc_pressure_cesm(ps: np.ndarray, p0: float, a: np.array, b: np.array) -> n
     nlats = ps.shape[1]
     nlons = ps.shape[2]
 
-    # output p array
-    p = np.zeros((ntimes,nlevs,nlats,nlons))*float("NaN")
+    if dtype is None:
+        dtype = out.dtype if out is not None else np.float64
+    if out is None:
+        out = np.empty((ntimes,nlevs,nlats,nlons), dtype=dtype)
+    elif out.shape != (ntimes,nlevs,nlats,nlons) or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous array of shape {(ntimes,nlevs,nlats,nlons)}")
 
-    # iterate through times, levels and calculate pressures
-    for ti in range(ntimes):
-        for i in range(nlevs):
-            p[ti,i,:,:] = a[i]*p0 + b[i]*ps[ti,:,:]
+    # flip level index so that pressures are decreasing with level, height
+    a_p0 = (np.asarray(a, dtype=dtype)[::-1]*np.asarray(p0, dtype=dtype))[None,:,None,None]
+    b = np.asarray(b, dtype=dtype)[::-1][None,:,None,None]
 
-    p = p[:,::-1,:,:] # flip level index so that pressures are decreasing with level, height
+    if time_chunk is None: time_chunk = ntimes
+    for t0 in range(0, ntimes, time_chunk):
+        t1 = min(t0 + time_chunk, ntimes)
+        ps_chunk = np.asarray(ps[t0:t1], dtype=dtype)
+        np.multiply(b, ps_chunk[:,None,:,:], out=out[t0:t1])
+        out[t0:t1] += a_p0
 
-    return p
+    return out
 
+@profile_utils.timed('model.calc_phii_midpoint')
 def calc_phii_midpoint(z: np.ndarray, zs: np.ndarray) -> np.ndarray:
     """
     calc_phii_midpoint estimates the vertical interfaces of grid cells via midpoint
@@ -85,6 +104,7 @@ def calc_t_virt(tk: np.ndarray, q: np.ndarray) -> np.ndarray:
     tv = tk*(1 + q * factor)
     return tv
 
+@profile_utils.timed('model.calc_rhom')
 def calc_rhom(p: np.ndarray, tk: np.ndarray, q: np.ndarray) -> np.ndarray:
     """
     calc_rhom calculates the density of moist air given pressure, temperature, and specific humidity
@@ -98,6 +118,7 @@ def calc_rhom(p: np.ndarray, tk: np.ndarray, q: np.ndarray) -> np.ndarray:
     rhom = p/Rd/calc_t_virt(tk,q)
     return rhom
 
+@profile_utils.timed('model.calc_phii_hydro')
 def calc_phii_hydro(zs: np.ndarray, rhom: np.ndarray, pi: np.ndarray) -> np.ndarray:
     """
     calc_phii_hydro estimates the vertical interfaces of grid cells via integration on the hydrostatic
@@ -115,12 +136,97 @@ def calc_phii_hydro(zs: np.ndarray, rhom: np.ndarray, pi: np.ndarray) -> np.ndar
     nlat = rhom.shape[2]
     nlon = rhom.shape[3]
 
-    zi = np.zeros((nt,nz+1,nlat,nlon)) # if 3 levels were provided, want to return a 4-level interface height
+    zi = np.empty((nt,nz+1,nlat,nlon)) # if 3 levels were provided, want to return a 4-level interface height
     zi[:,0,:,:] = zs # set the surface, 0 index
-    for i in range(nz):
-        dp = pi[:,i+1,:,:] - pi[:,i,:,:]
-        dz = -dp/rhom[:,i,:,:]/g
-        zi[:,i+1,:,:] = zi[:,i,:,:] + dz
+    # layer thicknesses, dz = -dp/rhom/g, computed in place in the interface array
+    dz = zi[:,1:,:,:]
+    np.subtract(pi[:,1:,:,:], pi[:,:-1,:,:], out=dz)
+    np.negative(dz, out=dz)
+    dz /= rhom
+    dz /= g
+    # sum the layers up from the surface
+    np.add.accumulate(zi, axis=1, out=zi)
     return zi
 
+@profile_utils.timed('model.calc_phii_hydro_cesm')
+def calc_phii_hydro_cesm(ps: np.ndarray, p0: float, hyai: np.array, hybi: np.array, tk: np.ndarray, q: np.ndarray,
+                         phis: np.ndarray, hyam: np.array = None, hybm: np.array = None, out: np.ndarray = None,
+                         dtype: np.dtype = None, time_chunk: int = 1) -> np.ndarray:
+    """
+    calc_phii_hydro_cesm is a fused version of the calc_pressure_cesm -> calc_rhom -> calc_phii_hydro chain. It goes
+                         straight from CAM history fields to the heights of the vertical interfaces by integrating the
+                         hydrostatic equation, dz = -dp*Rd*Tv/(p*g), with a cumulative sum over the levels.
 
+                         Times are processed time_chunk at a time, and every intermediate is computed in place in a
+                         few chunk-sized buffers, so beyond the output, memory is bounded by roughly
+                         5*time_chunk*nlev*nlat*nlon*itemsize bytes, however many times there are.
+
+    :param ps: A 2-D (nlat by nlon) or 3-D (ntime by nlat by nlon) array of surface pressure in Pa
+    :param p0: The scalar reference pressure
+    :param hyai: An array of a hybrid interface coefficients, in CAM order (model top first)
+    :param hybi: An array of b hybrid interface coefficients, in CAM order (model top first)
+    :param tk: A 4-D (ntime by nlev by nlat by nlon) array of temperature in Kelvins, in CAM level order
+    :param q: A 4-D (ntime by nlev by nlat by nlon) array of specific humidity, in CAM level order
+    :param phis: A 2-D (nlat by nlon) or 3-D (ntime by nlat by nlon) array of surface geopotential in m2/s2
+    :param hyam: An optional array of a hybrid level coefficients. If hyam and hybm are not given, level pressures are
+                 taken as the mean of the interface pressures, which is how CAM defines hyam and hybm.
+    :param hybm: An optional array of b hybrid level coefficients.
+    :param out: An optional C-contiguous (ntime by nlev+1 by nlat by nlon) array to write the heights into.
+    :param dtype: The dtype of the computation and output. Optional. Default is the dtype of out if given, otherwise
+                  float64.
+    :param time_chunk: The number of times to load and compute at once. Optional. Default is 1.
+
+    The 3-D and 4-D inputs can be anything that can be sliced along time and converted with np.asarray, e.g. numpy,
+    xarray or dask-backed arrays, so only time_chunk times of each are in memory at once.
+
+    :return: Returns a 4-D numpy array of geopotential height at the interfaces in meters, surface first.
+    """
+    if len(ps.shape) == 2: ps = np.asarray(ps)[None,:,:]
+    ntimes, nlats, nlons = ps.shape
+    nlevs = len(hyai) - 1
+
+    if dtype is None:
+        dtype = out.dtype if out is not None else np.float64
+    if out is None:
+        out = np.empty((ntimes,nlevs+1,nlats,nlons), dtype=dtype)
+    elif out.shape != (ntimes,nlevs+1,nlats,nlons) or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous array of shape {(ntimes,nlevs+1,nlats,nlons)}")
+
+    factor = 1./ep - 1
+    for t0 in range(0, ntimes, time_chunk):
+        t1 = min(t0 + time_chunk, ntimes)
+        zi = out[t0:t1]
+        dz = zi[:,1:,:,:]
+
+        # interface pressures, surface first, and the (negative) pressure change across each layer
+        pi = calc_pressure_cesm(ps[t0:t1], p0, hyai, hybi, dtype=dtype)
+        np.subtract(pi[:,:-1,:,:], pi[:,1:,:,:], out=dz)
+
+        # layer pressures
+        if hyam is not None and hybm is not None:
+            pm = calc_pressure_cesm(ps[t0:t1], p0, hyam, hybm, dtype=dtype)
+        else:
+            pm = np.add(pi[:,:-1,:,:], pi[:,1:,:,:])
+            pm *= 0.5
+        del pi
+
+        # virtual temperature, Tv = T*(1 + q*(1/ep - 1)), flipped to surface first
+        tv = np.multiply(np.asarray(q[t0:t1], dtype=dtype)[:,::-1,:,:], np.asarray(factor, dtype=dtype))
+        tv += 1
+        tv *= np.asarray(tk[t0:t1], dtype=dtype)[:,::-1,:,:]
+
+        # dz = -dp*Rd*Tv/(p*g)
+        dz *= tv
+        del tv
+        dz /= pm
+        del pm
+        dz *= Rd/g
+
+        # surface height, then sum the layers up from the surface
+        if len(phis.shape) == 2:
+            zi[:,0,:,:] = np.asarray(phis, dtype=dtype)/g
+        else:
+            zi[:,0,:,:] = np.asarray(phis[t0:t1], dtype=dtype)/g
+        np.add.accumulate(zi, axis=1, out=zi)
+
+    return out
@@ -1,22 +1,26 @@
+import hashlib
+import pathlib as path
 import pandas as pd
 import numpy as np
 import itertools
+import util.flight_utils as flight_utils
+import util.profile_utils as profile_utils
 from bokeh.io import push_notebook, show, output_notebook
 from bokeh.plotting import figure, show
 from bokeh.models import Title
-from bokeh.palettes import Category10
+from bokeh.palettes import Category10, Category20
+from typing import Iterable, Union
 
 def plot_track(df: pd.DataFrame, mask: pd.Series = None, title: str =''):
     if mask is None:
         mask = np.ones(len(df))
-    # get latitude and longitude from dataframe
-    latitude = df["LATC"].to_numpy().squeeze()
-    longitude = df["LONC"].to_numpy().squeeze()
-    
-    # update to mercator projection
-    k = 6378137
-    longitude = longitude * (k * np.pi/180.0)
-    latitude = np.log(np.tan((90 + latitude) * np.pi/360.0)) * k
+    # get the mercator projected LATC/LONC positions, from the dataframe if they were precomputed from LATC/LONC
+    # (add_projected_columns prefers GGLAT/GGLON when they were read)
+    if "merc_x" in df and not ("GGLAT" in df and "GGLON" in df):
+        longitude, latitude = df["merc_x"].to_numpy(), df["merc_y"].to_numpy()
+    else:
+        _, longitude, latitude, _ = flight_utils.project_positions(df["LATC"].to_numpy().squeeze(),
+                                                                    df["LONC"].to_numpy().squeeze())
     
     # create the plot layout and add axis labels
     try:
@@ -29,10 +33,8 @@ def plot_track(df: pd.DataFrame, mask: pd.Series = None, title: str =''):
         if sum(mask) != len(latitude):
             # condition = np.logical_and(data[flight]["Time"].to_numpy() > start,
             #                            data[flight]["Time"].to_numpy() < end)
-            lat = df["GGLAT"][mask].to_numpy().squeeze()
-            lon = df["GGLON"][mask].to_numpy().squeeze()
-            lon = lon * (k * np.pi/180.0)
-            lat = np.log(np.tan((90 + lat) * np.pi/360.0)) * k
+            _, lon, lat, _ = flight_utils.project_positions(df["GGLAT"][mask].to_numpy().squeeze(),
+                                                            df["GGLON"][mask].to_numpy().squeeze())
             plot.multi_line([longitude,lon],[latitude,lat], color=["yellow","red"])
         else:
             plot.line(longitude,latitude, color="yellow")
@@ -42,59 +44,296 @@ def plot_track(df: pd.DataFrame, mask: pd.Series = None, title: str =''):
     except Exception as e:
         print(e)
 
-def plot_campaigns(all_campaign_dfs: dict[str,dict[str,pd.DataFrame]], show_plot: bool = True):
+def simplify_track(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    simplify_track simplifies a track with the Douglas-Peucker algorithm: a stretch of track is replaced by the straight
+                   line between its ends unless a point on it is farther than tolerance from that line, in which case
+                   the stretch is split at the farthest point and both halves are simplified in turn. All stretches
+                   are split at once, each iteration being a few vectorized operations over the points left, so the
+                   number of iterations grows with the depth of the splitting, not with the number of points.
+
+    :param x: An array of x coordinates of the track, e.g. in plot (web mercator) meters
+    :param y: An array of y coordinates of the track
+    :param tolerance: The largest distance, in units of x and y, a dropped point may be from the simplified track
+
+    :return: Returns a sorted int array of the indices of the points to keep. The ends of the track, NaN points and
+             their neighbors are always kept, so gaps in the track are preserved.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    finite = np.isfinite(x) & np.isfinite(y)
+    keep = ~finite
+    keep[1:] |= ~finite[:-1]
+    keep[:-1] |= ~finite[1:]
+    keep[[0,-1] if n > 0 else []] = True
+
+    active = np.flatnonzero(~keep) # points of stretches that have not been simplified yet
+    while len(active) > 0:
+        # the kept points at the ends of each active point's stretch
+        kept = np.flatnonzero(keep)
+        pos = np.searchsorted(kept, active)
+        i0 = kept[pos - 1]
+        i1 = kept[pos]
+
+        # distance of each point from its stretch's chord (or from its start, if the ends coincide)
+        dx = x[i1] - x[i0]
+        dy = y[i1] - y[i0]
+        px = x[active] - x[i0]
+        py = y[active] - y[i0]
+        chord = np.hypot(dx, dy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.where(chord > 0, np.abs(px*dy - py*dx)/chord, np.hypot(px, py))
+
+        # the farthest point of each stretch; active points are sorted, so stretches are contiguous
+        first = np.flatnonzero(np.r_[True, pos[1:] != pos[:-1]])
+        stretch = np.cumsum(np.r_[True, pos[1:] != pos[:-1]]) - 1
+        farthest = _segment_argmax(dist, first, stretch)
+        split = dist[farthest] > tolerance
+        keep[active[farthest[split]]] = True
+
+        # points of stretches that were split stay active
+        still = split[stretch]
+        still[farthest[split]] = False
+        active = active[still]
+
+    return np.flatnonzero(keep)
+
+def _segment_argmax(values: np.ndarray, first: np.ndarray, segment: np.ndarray) -> np.ndarray:
+    """
+    _segment_argmax finds the index of the (first) largest value of each contiguous segment of an array.
+
+    :param values: A 1-D array
+    :param first: The index of the first element of each segment
+    :param segment: The segment number of each element
+
+    :return: Returns an int array of one index per segment.
+    """
+    seg_max = np.maximum.reduceat(values, first)
+    candidates = np.flatnonzero(values == seg_max[segment])
+    return candidates[np.r_[True, segment[candidates[1:]] != segment[candidates[:-1]]]]
+
+# the web mercator y of 20N
+_merc_y_20n = np.log(np.tan((90 + 20)*np.pi/360.0))*6378137
+
+@profile_utils.timed('plot.project')
+def _campaign_tracks(campaign: str, flight_dfs: dict[str,pd.DataFrame]) -> list[tuple[np.ndarray,np.ndarray]]:
+    """
+    _campaign_tracks gets the tracks of a campaign's flights in plot (web mercator) coordinates, reusing the projected
+                     columns of flight_utils.add_projected_columns when the DataFrames have them.
+
+    :param campaign: The field campaign name
+    :param flight_dfs: A dictionary (keys of file names) of flight DataFrames
+
+    :return: Returns a list of (x, y) arrays, one per flight. x and y are NaN where positions are not valid.
+    """
+    tracks = []
+    for flight, df in flight_dfs.items():
+        # If GGLAT was read in, use it. Otherwise, default to GPS-corrected IRU lat/lon.
+        # NOTE: GPS-corrected IRU lat/lon has problems when flights cross the dateline.
+        lat_var, lon_var = ("GGLAT", "GGLON") if "GGLAT" in df else ("LATC", "LONC")
+        if "merc_x" in df:
+            x, y = df["merc_x"].to_numpy(), df["merc_y"].to_numpy()
+        else:
+            _, x, y, _ = flight_utils.project_positions(df[lat_var].to_numpy(), df[lon_var].to_numpy())
+        #  ARISTO2017 only had high-rate data, with a handful of lat/lons of 0,0. Filter on the projected latitude,
+        #  which is what the track was drawn from, whichever columns it came from.
+        if campaign == "ARISTO2017":
+            keep = ~(y < _merc_y_20n)
+            x, y = x[keep], y[keep]
+        tracks.append((x, y))
+    return tracks
+
+def _all_campaign_tracks(all_campaign_dfs) -> dict[str,list[tuple[np.ndarray,np.ndarray]]]:
+    """
+    _all_campaign_tracks gets the tracks of every campaign's flights (see _campaign_tracks), from either a dictionary
+                         of campaigns' flight DataFrames or an iterator of (campaign, file name, DataFrame) tuples, e.g.
+                         flight_utils.iter_flights. An iterator's flights are projected one at a time as they arrive,
+                         so projecting overlaps with reading ahead and only the tracks are kept. Every campaign of an
+                         iterator having field_campaigns (e.g. a flight_utils.flight_iterator) gets an entry, in that
+                         order, even if none of its flights could be read, as in the dictionaries of read_all_flights.
+    """
+    if isinstance(all_campaign_dfs, dict):
+        return {campaign: _campaign_tracks(campaign, flight_dfs) for campaign, flight_dfs in all_campaign_dfs.items()}
+    all_tracks = {campaign: [] for campaign in getattr(all_campaign_dfs, 'field_campaigns', [])}
+    for campaign, fname, df in all_campaign_dfs:
+        all_tracks.setdefault(campaign, []).extend(_campaign_tracks(campaign, {fname: df}))
+    return all_tracks
+
+@profile_utils.timed('plot.simplify')
+def _simplify_tracks(all_tracks: dict[str,list[tuple[np.ndarray,np.ndarray]]], plot, simplify_px: float):
+    """
+    _simplify_tracks simplifies every track (in place) to within simplify_px pixels at the zoom level at which all
+                     tracks fill the plot.
+    """
+    xs = np.concatenate([x for tracks in all_tracks.values() for (x, _) in tracks] + [np.zeros(0)])
+    ys = np.concatenate([y for tracks in all_tracks.values() for (_, y) in tracks] + [np.zeros(0)])
+    if not np.any(np.isfinite(xs)):
+        return
+    # plot meters per pixel
+    scale = max((np.nanmax(xs) - np.nanmin(xs))/plot.width, (np.nanmax(ys) - np.nanmin(ys))/plot.height)
+    for tracks in all_tracks.values():
+        for k, (x, y) in enumerate(tracks):
+            keep = simplify_track(x, y, simplify_px*scale)
+            tracks[k] = (x[keep], y[keep])
+
+# half the width of the web mercator world in plot meters
+_mercator_half_width = 6378137*np.pi
+
+@profile_utils.timed('plot.rasterize')
+def rasterize_tracks(tracks: list[tuple[np.ndarray,np.ndarray]], width: int = 2048,
+                     wrap_lon: float = -180.) -> tuple[np.ndarray, int, int]:
+    """
+    rasterize_tracks accumulates tracks into a line-density raster of the whole web mercator world, i.e. counts how
+                     many of the tracks pass through each pixel. Segments between consecutive points are sampled
+                     once per pixel of their length, so long segments do not leave gaps and sub-pixel segments cost a
+                     single sample. Each track adds at most one to a pixel, however many of its samples fall in it, so
+                     slow or circling flight shows as one pass rather than as the time spent there.
+
+    :param tracks: A list of (x, y) arrays of tracks in plot (web mercator) meters. NaNs break a track.
+    :param width: The number of raster columns around the world. The raster is square, covering latitudes within
+                  about 85 degrees of the equator. Optional. Default is 2048.
+    :param wrap_lon: The longitude of the raster's western edge. Longitudes wrap around the raster, so unwrapped
+                     tracks crossing the dateline are drawn where they are on the globe. Optional. Default is -180.
+
+    :return: Returns a tuple of a 2-D uint32 array of counts, cropped to the pixels the tracks touch (row 0 is the
+             southernmost), and the row and column of its first pixel in the full raster.
+    """
+    pixel = 2*_mercator_half_width/width
+    x0 = wrap_lon*6378137*np.pi/180.0
+    pixels = [np.zeros(0, dtype=np.int64)] # the flat raster index of every sample
+    for (x, y) in tracks:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) == 0:
+            continue
+        # the samples of each segment, from its start up to (but not including) its end, in pixels
+        dx = np.diff(x)/pixel
+        dy = np.diff(y)/pixel
+        with np.errstate(invalid='ignore'):
+            nsamples = np.where(np.isfinite(dx) & np.isfinite(dy), np.ceil(np.maximum(np.abs(dx), np.abs(dy))), 0)
+        nsamples = np.maximum(nsamples, 1).astype(np.int64)
+        seg = np.repeat(np.arange(len(dx)), nsamples)
+        frac = (np.arange(len(seg)) - np.repeat(np.cumsum(nsamples) - nsamples, nsamples))/nsamples[seg]
+        px = np.append((x[seg] - x0)/pixel + frac*np.nan_to_num(dx)[seg], (x[-1] - x0)/pixel)
+        py = np.append((y[seg] + _mercator_half_width)/pixel + frac*np.nan_to_num(dy)[seg],
+                       (y[-1] + _mercator_half_width)/pixel)
+
+        ok = np.isfinite(px) & np.isfinite(py) & (py >= 0) & (py < width)
+        cols = np.floor(px[ok]).astype(np.int64) % width
+        rows = np.floor(py[ok]).astype(np.int64)
+        pixels.append(np.unique(rows*width + cols))
 
-    campaign = list(all_campaign_dfs.keys())[0]
+    counts = np.bincount(np.concatenate(pixels), minlength=width*width).astype(np.uint32).reshape(width, width)
+    rows = np.flatnonzero(counts.any(axis=1))
+    cols = np.flatnonzero(counts.any(axis=0))
+    if len(rows) == 0:
+        return np.zeros((0,0), dtype=np.uint32), 0, 0
+    return counts[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1], int(rows[0]), int(cols[0])
+
+def _cached_raster(campaign: str, tracks: list[tuple[np.ndarray,np.ndarray]], width: int, wrap_lon: float,
+                   cache_dir: str = None) -> tuple[np.ndarray, int, int]:
+    """
+    _cached_raster is rasterize_tracks reading through an on-disk cache of one .npz file per campaign raster, keyed by
+                   the campaign, the raster geometry and the track coordinates, so that only new or changed campaigns
+                   are rasterized again. Only the latest raster of each campaign and geometry is kept: writing a new
+                   one removes the one it replaces, so the cache does not grow as tracks change.
+    """
+    if cache_dir is None:
+        return rasterize_tracks(tracks, width, wrap_lon)
+    prefix = f"{campaign}_{hashlib.sha1(f'{campaign}/{width}/{wrap_lon}'.encode()).hexdigest()[:12]}_"
+    digest = hashlib.sha1(prefix.encode())
+    for (x, y) in tracks:
+        digest.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    cache_path = path.Path(cache_dir) / f"{prefix}{digest.hexdigest()}.npz"
+    if cache_path.is_file():
+        with np.load(cache_path) as cached:
+            return cached['counts'], int(cached['row0']), int(cached['col0'])
+    counts, row0, col0 = rasterize_tracks(tracks, width, wrap_lon)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    for stale in cache_path.parent.iterdir():
+        if stale.name.startswith(prefix) and stale.suffix == '.npz':
+            stale.unlink(missing_ok=True)
+    np.savez(cache_path, counts=counts, row0=row0, col0=col0)
+    return counts, row0, col0
+
+def _raster_rgba(counts: np.ndarray, color: str) -> np.ndarray:
+    """
+    _raster_rgba colors a line-density raster in a single color, with opacity increasing with the log of the density
+                 and empty pixels transparent.
+
+    :return: Returns a 2-D uint32 array of packed RGBA pixels, as bokeh's image_rgba takes.
+    """
+    r, g, b = (int(color.lstrip('#')[k:k+2], 16) for k in (0, 2, 4))
+    alpha = np.zeros(counts.shape)
+    if counts.size > 0 and counts.max() > 0:
+        alpha = np.where(counts > 0, 0.5 + 0.5*np.log1p(counts)/np.log1p(counts.max()), 0.)
+    rgba = np.empty(counts.shape + (4,), dtype=np.uint8)
+    rgba[...,0], rgba[...,1], rgba[...,2] = r, g, b
+    rgba[...,3] = np.round(255*alpha)
+    return rgba.view(np.uint32)[...,0]
+
+@profile_utils.timed('plot.plot_campaigns')
+def plot_campaigns(all_campaign_dfs: Union[dict[str,dict[str,pd.DataFrame]], Iterable[tuple[str,str,pd.DataFrame]]],
+                   show_plot: bool = True,
+                   simplify_px: float = None, render: str = 'lines', raster_width: int = 2048,
+                   raster_cache_dir: str = None, wrap_lon: float = -180.):
+    """
+    plot_campaigns plots the flight tracks of field campaigns on a map, one color per campaign. Each campaign's flights
+                   are drawn with a single multi_line glyph. A campaign without flights is left out of the plot and
+                   its legend, but still takes its turn of the colors, so the other campaigns keep theirs.
+
+    :param all_campaign_dfs: A dictionary (keys of field campaigns) of dictionaries (keys of file names) of flight
+                             DataFrames, e.g. from flight_utils.read_all_flights, or an iterator of (campaign, file
+                             name, DataFrame) tuples, e.g. flight_utils.iter_flights, whose flights are then projected
+                             while the next ones are read
+    :param show_plot: If True, show the plot. Otherwise, return it.
+    :param simplify_px: Optional. If given, tracks are simplified (see simplify_track) to within this many pixels at
+                        the initial zoom level, e.g. 0.5, which leaves the map looking the same while shrinking the
+                        plot's size by orders of magnitude.
+    :param render: 'lines' to draw the tracks as vector lines, or 'raster' to accumulate each campaign's tracks into a
+                   line-density raster (see rasterize_tracks) drawn as a single image, so the plot's size and render
+                   time are set by the raster's pixel count rather than the number of samples.
+    :param raster_width: The number of raster columns around the world, for render='raster'. Optional. Default is 2048.
+    :param raster_cache_dir: A path string to a directory to cache campaign rasters in, for render='raster'. Optional.
+                             If given, only campaigns whose tracks changed are rasterized again.
+    :param wrap_lon: The longitude of the raster's western edge, for render='raster'. Optional. Default is -180.
+    """
 
     plot = figure(width=1000, height=600, x_axis_type="mercator", y_axis_type="mercator") 
     plot.add_layout(Title(text="Longitude [Degrees]", align="center"), "below")
     plot.add_layout(Title(text="Latitude [Degrees]", align="center"), "left")
 
+    all_tracks = _all_campaign_tracks(all_campaign_dfs)
+    if simplify_px is not None:
+        _simplify_tracks(all_tracks, plot, simplify_px)
 
     colors = itertools.cycle(Category10[8])
-    for campaign in all_campaign_dfs.keys():
+    pixel = 2*_mercator_half_width/raster_width
+    for campaign, tracks in all_tracks.items():
         color=next(colors)
-        for flight, df in all_campaign_dfs[campaign].items():
-            # If GGLAT was read in, use it. Otherwise, default to GPS-corrected IRU lat/lon.
-            # NOTE: GPS-corrected IRU lat/lon has problems when flights cross the dateline.
-            if "GGLAT" in list(df.keys()):
-                latitude = df["GGLAT"].to_numpy().squeeze()
-                longitude = df["GGLON"].to_numpy().squeeze()
-            elif "LATC" in list(df.keys()):
-                latitude = df["LATC"].to_numpy().squeeze()
-                longitude = df["LONC"].to_numpy().squeeze()
-            # To prevent wrap around, detect when a flight crossed the dateline and unwrap the longitudes.
-            #    That is, when lats go -178, -179, 180, 179, 178, ..., and most flights on east of the dateline
-            #    (negative) make all longitudes east of the dateline (negative)
-            if np.any(longitude > 179) and np.any(longitude < -179):
-                num_pos = np.sum(longitude > 0)
-                num_neg = np.sum(longitude < 0)
-                if num_pos >= num_neg:
-                    longitude = np.where(longitude < 0, longitude + 360, longitude)
-                else:
-                    longitude = np.where(longitude > 0, longitude - 360, longitude)
-            #  ARISTO2017 only had high-rate data, with a handful of lat/lons of 0,0
-            if campaign == "ARISTO2017":
-                mask = np.argwhere(latitude < 20)
-                latitude = np.delete(latitude,mask)
-                longitude = np.delete(longitude,mask)
-            # shift flights so that the wrap point is where we haven't flown (e.g. longitude of +75)
-            #wrap_longitude = 75.0
-            #longitude = np.where(longitude > wrap_longitude, longitude - 360, longitude)
-            # now, convert lat/lon into plot coordinates
-            k = 6378137
-            longitude = longitude * (k * np.pi/180.0)
-            latitude = np.log(np.tan((90 + latitude) * np.pi/360.0)) * k
-            # make that plot
-            plot.line(longitude,latitude, color=color, legend_label=campaign)
-
-    plot.legend.click_policy = 'hide'
-    plot.legend.label_text_font_size = '10px'
-    plot.legend.glyph_height = 16
-    plot.legend.label_height = 16
-    plot.legend.ncols = 2
+        if not tracks:
+            continue
+        # make that plot
+        if render == 'raster':
+            counts, row0, col0 = _cached_raster(campaign, tracks, raster_width, wrap_lon, raster_cache_dir)
+            plot.image_rgba(image=[_raster_rgba(counts, color)], x=wrap_lon*6378137*np.pi/180.0 + col0*pixel,
+                            y=-_mercator_half_width + row0*pixel, dw=counts.shape[1]*pixel,
+                            dh=counts.shape[0]*pixel, legend_label=campaign)
+        elif render == 'lines':
+            plot.multi_line([x for (x, _) in tracks], [y for (_, y) in tracks], color=color, legend_label=campaign)
+        else:
+            raise ValueError(f"render must be 'lines' or 'raster', not '{render}'")
+
+    if plot.legend: # there is no legend when no campaign had flights
+        plot.legend.click_policy = 'hide'
+        plot.legend.label_text_font_size = '10px'
+        plot.legend.glyph_height = 16
+        plot.legend.label_height = 16
+        plot.legend.ncols = 2
+        plot.add_layout(plot.legend[0],'right')
     plot.add_tile("CartoDB Positron", retina=True)
-    plot.add_layout(plot.legend[0],'right')
     #plot.add_tile("Esri World Imagery", retina=True) # uncomment to add satellite imagery
 
     if show_plot:
@@ -102,63 +341,51 @@ def plot_campaigns(all_campaign_dfs: dict[str,dict[str,pd.DataFrame]], show_plot
     else:
         return plot
 
-def plot_campaigns_custom(all_campaign_dfs: dict[str,dict[str,pd.DataFrame]], show_plot: bool = True):
+@profile_utils.timed('plot.plot_campaigns_custom')
+def plot_campaigns_custom(all_campaign_dfs: Union[dict[str,dict[str,pd.DataFrame]],
+                                                 Iterable[tuple[str,str,pd.DataFrame]]],
+                          show_plot: bool = True, simplify_px: float = None):
+    """
+    plot_campaigns_custom is plot_campaigns with a handful of campaigns highlighted in color and the rest in gray.
+                          Campaigns without flights are left out, as in plot_campaigns.
 
-    campaign = list(all_campaign_dfs.keys())[0]
+    :param all_campaign_dfs: A dictionary (keys of field campaigns) of dictionaries (keys of file names) of flight
+                             DataFrames, e.g. from flight_utils.read_all_flights, or an iterator of (campaign, file
+                             name, DataFrame) tuples, e.g. flight_utils.iter_flights, whose flights are then projected
+                             while the next ones are read
+    :param show_plot: If True, show the plot. Otherwise, return it.
+    :param simplify_px: Optional. If given, tracks are simplified to within this many pixels, as in plot_campaigns.
+    """
 
     plot = figure(width=1000, height=600, x_axis_type="mercator", y_axis_type="mercator") 
     plot.add_layout(Title(text="Longitude [Degrees]", align="center"), "below")
     plot.add_layout(Title(text="Latitude [Degrees]", align="center"), "left")
 
+    all_tracks = _all_campaign_tracks(all_campaign_dfs)
+    if simplify_px is not None:
+        _simplify_tracks(all_tracks, plot, simplify_px)
 
     #colors = itertools.cycle(Category10[10])
     colors = itertools.cycle(Category20[20])
-    for campaign in all_campaign_dfs.keys():
+    for campaign, tracks in all_tracks.items():
         if campaign in ['SOCRATES','RICO','VOCALS','HIPPO-1','HIPPO-2','HIPPO-3','HIPPO-4','CAESAR','ORCAS','CSET']:
             color=next(colors)
             line_width=1.5
         else:
             color='gray'
             line_width=1
-        for flight, df in all_campaign_dfs[campaign].items():
-            # If GGLAT was read in, use it. Otherwise, default to GPS-corrected IRU lat/lon.
-            # NOTE: GPS-corrected IRU lat/lon has problems when flights cross the dateline.
-            if "GGLAT" in list(df.keys()):
-                latitude = df["GGLAT"].to_numpy().squeeze()
-                longitude = df["GGLON"].to_numpy().squeeze()
-            elif "LATC" in list(df.keys()):
-                latitude = df["LATC"].to_numpy().squeeze()
-                longitude = df["LONC"].to_numpy().squeeze()
-            # To prevent wrap around, detect when a flight crossed the dateline and unwrap the longitudes.
-            #    That is, when lats go -178, -179, 180, 179, 178, ..., and most flights on east of the dateline
-            #    (negative) make all longitudes east of the dateline (negative)
-            if np.any(longitude > 179) and np.any(longitude < -179):
-                num_pos = np.sum(longitude > 0)
-                num_neg = np.sum(longitude < 0)
-                if num_pos >= num_neg:
-                    longitude = np.where(longitude < 0, longitude + 360, longitude)
-                else:
-                    longitude = np.where(longitude > 0, longitude - 360, longitude)
-            #  ARISTO2017 only had high-rate data, with a handful of lat/lons of 0,0
-            if campaign == "ARISTO2017":
-                mask = np.argwhere(latitude < 20)
-                latitude = np.delete(latitude,mask)
-                longitude = np.delete(longitude,mask)
-            # shift flights so that the wrap point is where we haven't flown (e.g. longitude of +75)
-            #wrap_longitude = 75.0
-            #longitude = np.where(longitude > wrap_longitude, longitude - 360, longitude)
-            # now, convert lat/lon into plot coordinates
-            k = 6378137
-            longitude = longitude * (k * np.pi/180.0)
-            latitude = np.log(np.tan((90 + latitude) * np.pi/360.0)) * k
-            # make that plot
-            plot.line(longitude,latitude, color=color, legend_label=campaign,line_width=line_width)
-
-    plot.legend.click_policy = 'hide'
-    plot.legend.label_text_font_size = '10px'
-    plot.legend.ncols = 2
+        if not tracks:
+            continue
+        # make that plot
+        plot.multi_line([x for (x, _) in tracks], [y for (_, y) in tracks], color=color, legend_label=campaign,
+                        line_width=line_width)
+
+    if plot.legend: # there is no legend when no campaign had flights
+        plot.legend.click_policy = 'hide'
+        plot.legend.label_text_font_size = '10px'
+        plot.legend.ncols = 2
+        plot.add_layout(plot.legend[0],'right')
     plot.add_tile("CartoDB Positron", retina=True)
-    plot.add_layout(plot.legend[0],'right')
     #plot.add_tile("Esri World Imagery", retina=True) # uncomment to add satellite imagery
 
     if show_plot:
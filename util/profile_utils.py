@@ -0,0 +1,149 @@
+import contextvars
+import functools
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# the collector of the current context, or None when profiling is off
+_collector = contextvars.ContextVar('profile_collector', default=None)
+
+def _peak_rss() -> int:
+    """
+    _peak_rss returns the peak resident set size of this process in bytes, or None if it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak*1024
+
+class profile_collector:
+    """
+    profile_collector gathers stage timings, counters and notes from the code run within it. It is a context manager:
+
+        with profile_utils.profile_collector() as prof:
+            df = flight_utils.read_flight_file(file_path)
+        prof.save('profile.json')
+
+    Collection is scoped to the context (thread or asyncio task) that entered the collector, and collectors can be
+    nested, the innermost one collecting. Code run in other processes, e.g. read_all_flights with n_workers > 1, is not
+    collected. When no collector is active, the instrumentation in the utils modules does next to nothing.
+
+    The __init__ assigns:
+    self.stages: dict[str,dict]; stage name -> {'calls': int, 'seconds': float}, the total time spent in each stage.
+                 Stages can nest, so times of nested stages are included in those of the stages around them.
+    self.counters: dict[str,int]; counter name -> total, e.g. 'flight.bytes_read' or 'flight.rows'
+    self.notes: dict[str,list[str]]; note name -> messages, e.g. 'flight.skipped_vars' -> why each variable was skipped
+    self.peak_rss_bytes: int; the peak resident set size of the process when the collector exited. This is the peak
+                         over the life of the process, not just the time the collector was active.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.notes = {}
+        self.peak_rss_bytes = None
+        self.seconds = 0.
+        self._token = None
+
+    def __enter__(self):
+        self._token = _collector.set(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._t0
+        self.peak_rss_bytes = _peak_rss()
+        _collector.reset(self._token)
+
+    def add_time(self, name: str, seconds: float):
+        totals = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def note(self, name: str, message: str):
+        self.notes.setdefault(name, []).append(message)
+
+    def to_dict(self) -> dict:
+        """
+        to_dict returns everything collected as a json-serializable dictionary.
+        """
+        return {'seconds': self.seconds, 'peak_rss_bytes': self.peak_rss_bytes, 'stages': self.stages,
+                'counters': self.counters, 'notes': self.notes}
+
+    def save(self, file_path: str):
+        """
+        save writes everything collected to a json file.
+
+        :param file_path: A path string to the json file to write.
+        """
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+class stage:
+    """
+    stage times a block of code as a named stage of the active profile_collector, if there is one:
+
+        with profile_utils.stage('flight.decode_time'):
+            ...
+    """
+    __slots__ = ('name', '_prof', '_t0')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._prof = _collector.get()
+        if self._prof is not None:
+            self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._prof is not None:
+            self._prof.add_time(self.name, time.perf_counter() - self._t0)
+
+def timed(name: str):
+    """
+    timed is a decorator timing every call of a function as a named stage of the active profile_collector.
+
+    :param name: The stage name, e.g. 'model.calc_pressure_cesm'
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _collector.get() is None:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def active() -> profile_collector:
+    """
+    active returns the active profile_collector, or None when profiling is off. Code that does extra work only to
+           report it, e.g. summing bytes, can check this first.
+    """
+    return _collector.get()
+
+def count(name: str, n: int = 1):
+    """
+    count adds n to a counter of the active profile_collector, if there is one.
+    """
+    prof = _collector.get()
+    if prof is not None:
+        prof.count(name, n)
+
+def note(name: str, message: str):
+    """
+    note adds a message to a note of the active profile_collector, if there is one.
+    """
+    prof = _collector.get()
+    if prof is not None:
+        prof.note(name, message)
@@ -0,0 +1,256 @@
+import json
+import pathlib as path
+import sqlite3
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import util.flight_utils as flight_utils
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    file_path TEXT PRIMARY KEY,
+    campaign TEXT,
+    fname TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    rate INTEGER,
+    ntimes INTEGER,
+    start TEXT,
+    end TEXT,
+    dimensions TEXT,
+    attributes TEXT
+);
+CREATE TABLE IF NOT EXISTS variables (
+    file_path TEXT REFERENCES files(file_path) ON DELETE CASCADE,
+    name TEXT,
+    units TEXT,
+    rate INTEGER,
+    dimensions TEXT,
+    PRIMARY KEY (file_path, name)
+);
+CREATE INDEX IF NOT EXISTS variables_by_name ON variables(name);
+"""
+
+def _json_safe(value):
+    """
+    _json_safe converts a netcdf attribute value to something json can write.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def scan_flight_header(file_path: str) -> dict:
+    """
+    scan_flight_header reads the metadata of a flight file: its dimensions, variables, units, rates and global
+                       attributes. No variable data is read except the first and last Time values, for the time
+                       coverage.
+
+    :param file_path: A path string to a flight data file
+
+    :return: Returns a dictionary of the file's identity (resolved path, size, mtime_ns), rate, number of times,
+             start and end times (ISO strings, UTC), dimensions (name -> size), global attributes, and a list of
+             (name, units, rate, dimensions) tuples of its variables.
+    """
+    fp_path = path.Path(file_path).resolve()
+    stat = fp_path.stat()
+    nc = flight_utils.open_flight_nc(str(fp_path))
+    try:
+        dims = {name: len(dim) for (name, dim) in nc.dimensions.items()}
+        variables = []
+        for name, ncvar in nc.variables.items():
+            try:
+                rate = flight_utils._var_rate(ncvar) if ncvar.dimensions[:1] == ('Time',) else None
+            except RuntimeError:
+                rate = None
+            variables.append((name, getattr(ncvar, 'units', None), rate, ','.join(ncvar.dimensions)))
+        ntimes = dims.get('Time', 0)
+        start = end = None
+        if ntimes > 0 and 'Time' in nc.variables:
+            times = flight_utils.sfm_to_datetime64([nc['Time'][0], nc['Time'][ntimes - 1]], nc['Time'].units)
+            start, end = (None if np.isnat(t) else str(t) for t in times)
+        attrs = {name: _json_safe(nc.getncattr(name)) for name in nc.ncattrs()}
+        rate = flight_utils.get_flight_rate(nc)
+    finally:
+        nc.close()
+
+    return {'file_path': str(fp_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'rate': rate,
+            'ntimes': ntimes, 'start': start, 'end': end, 'dimensions': dims, 'attributes': attrs,
+            'variables': variables}
+
+class flight_registry:
+    """
+    flight_registry is a persistent SQLite registry of flight file metadata, so that which files exist, what variables
+    they have and what time they cover can be looked up without opening them.
+
+    The files table holds one row per file: its resolved path, campaign, file name, size and modification time (for
+    change detection), rate, number of times, start and end times, and its dimensions and global attributes as json.
+    The variables table holds one row per variable of each file: its name, units, rate and dimensions.
+
+    Scans read only netcdf headers (see scan_flight_header), can be spread across worker processes, and only rescan
+    files that are new or whose size or modification time changed.
+
+    The __init__ takes a path string to the SQLite database file (created if needed).
+    """
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        self.con = sqlite3.connect(self.db_path)
+        self.con.execute("PRAGMA foreign_keys = ON")
+        self.con.executescript(_schema)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _stored_identity(self, file_path: str) -> tuple[int, int]:
+        row = self.con.execute("SELECT size, mtime_ns FROM files WHERE file_path = ?", (file_path,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def is_current(self, file_path: str) -> bool:
+        """
+        is_current checks that a file is in the registry and has not changed since it was scanned.
+
+        :param file_path: A path string to a flight data file
+
+        :return: Returns True if the registered size and modification time match the file's.
+        """
+        fp_path = path.Path(file_path).resolve()
+        try:
+            stat = fp_path.stat()
+        except OSError:
+            return False
+        return self._stored_identity(str(fp_path)) == (stat.st_size, stat.st_mtime_ns)
+
+    def _insert(self, header: dict, campaign: str = None):
+        """
+        _insert writes the result of scan_flight_header to the registry, replacing any earlier rows of the file.
+        """
+        with self.con:
+            self.con.execute("DELETE FROM files WHERE file_path = ?", (header['file_path'],))
+            self.con.execute("INSERT INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                             (header['file_path'], campaign, path.Path(header['file_path']).name, header['size'],
+                              header['mtime_ns'], header['rate'], header['ntimes'], header['start'], header['end'],
+                              json.dumps(header['dimensions']), json.dumps(header['attributes'])))
+            self.con.executemany("INSERT INTO variables VALUES (?,?,?,?,?)",
+                                 [(header['file_path'],) + tuple(var) for var in header['variables']])
+
+    def add_file(self, file_path: str, campaign: str = None):
+        """
+        add_file scans the header of a flight file and registers it, if it is new or changed.
+
+        :param file_path: A path string to a flight data file
+        :param campaign: The field campaign of the flight. Optional.
+        """
+        if not self.is_current(file_path):
+            self._insert(scan_flight_header(file_path), campaign)
+
+    def scan(self, data_dir: str, field_campaigns: list[str], n_workers: int = 1) -> dict[str,str]:
+        """
+        scan registers every flight file in the lrt directory of each field campaign in data_dir, the same files that
+             flight_utils.read_all_flights reads. Only new or modified files are scanned, and files that were
+             registered under these campaigns but no longer exist are removed.
+
+        :param data_dir: A path string to the directory holding one directory per field campaign.
+        :param field_campaigns: A list of field campaign names, e.g. ['SOCRATES','CSET'].
+        :param n_workers: The number of worker processes to spread the header scans across. Optional. Default is 1.
+
+        :return: Returns a dictionary of file path -> error message for the files that could not be scanned.
+        """
+        errors = {}
+        jobs = [] # (campaign, file path) of every new or modified file
+        for campaign in field_campaigns:
+            campaign_dir = data_dir + "/" + campaign + "/lrt"
+            try:
+                flight_fnames = flight_utils.find_flight_fnames(campaign_dir)
+            except OSError as e:
+                errors[campaign_dir] = f"{type(e).__name__}: {e}"
+                continue
+            file_paths = [str(path.Path(campaign_dir, fname).resolve()) for fname in flight_fnames]
+            jobs += [(campaign, file_path) for file_path in file_paths if not self.is_current(file_path)]
+
+            # forget files of this campaign that were removed
+            registered = [row[0] for row in self.con.execute("SELECT file_path FROM files WHERE campaign = ?",
+                                                            (campaign,))]
+            with self.con:
+                self.con.executemany("DELETE FROM files WHERE file_path = ?",
+                                     [(fp,) for fp in set(registered) - set(file_paths)])
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = {pool.submit(scan_flight_header, file_path): (campaign, file_path)
+                           for (campaign, file_path) in jobs}
+                for future in as_completed(futures):
+                    campaign, file_path = futures[future]
+                    try:
+                        self._insert(future.result(), campaign)
+                    except Exception as e:
+                        errors[file_path] = f"{type(e).__name__}: {e}"
+        else:
+            for campaign, file_path in jobs:
+                try:
+                    self._insert(scan_flight_header(file_path), campaign)
+                except Exception as e:
+                    errors[file_path] = f"{type(e).__name__}: {e}"
+        return errors
+
+    def files(self, read_vars: list[str] = None, campaign: str = None) -> pd.DataFrame:
+        """
+        files lists the registered files.
+
+        :param read_vars: A list of variable names. Optional. If given, only files having all of them are listed.
+        :param campaign: A field campaign name. Optional. If given, only files of that campaign are listed.
+
+        :return: Returns a DataFrame of the files table, sorted by campaign and file name, with start and end as
+                 datetimes and dimensions and attributes as dictionaries.
+        """
+        query = "SELECT * FROM files"
+        conditions, params = [], []
+        if campaign is not None:
+            conditions.append("campaign = ?")
+            params.append(campaign)
+        if read_vars:
+            names = list(dict.fromkeys(read_vars)) # without repeats, which would never match the count
+            conditions.append(f"file_path IN (SELECT file_path FROM variables WHERE name IN "
+                              f"({','.join('?'*len(names))}) GROUP BY file_path HAVING COUNT(*) = ?)")
+            params += names + [len(names)]
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        df = pd.read_sql_query(query + " ORDER BY campaign, fname", self.con, params=params)
+        df['start'] = pd.to_datetime(df['start'])
+        df['end'] = pd.to_datetime(df['end'])
+        df['dimensions'] = df['dimensions'].map(json.loads)
+        df['attributes'] = df['attributes'].map(json.loads)
+        return df
+
+    def variables(self, file_path: str) -> pd.DataFrame:
+        """
+        variables lists the variables of a registered file.
+
+        :param file_path: A path string to a flight data file
+
+        :return: Returns a DataFrame of the name, units, rate and dimensions of each variable.
+        """
+        return pd.read_sql_query("SELECT name, units, rate, dimensions FROM variables WHERE file_path = ? ORDER BY name",
+                                 self.con, params=(str(path.Path(file_path).resolve()),))
+
+    def missing_vars(self, file_path: str, read_vars: list[str]) -> list[str]:
+        """
+        missing_vars finds which of the requested variables a file lacks, without opening it.
+
+        :param file_path: A path string to a flight data file
+        :param read_vars: A list of variable names
+
+        :return: Returns the list of the variables of read_vars the file does not have, or None if the file is not
+                 registered or has changed since it was scanned, i.e. the registry does not know.
+        """
+        if not self.is_current(file_path):
+            return None
+        names = {row[0] for row in self.con.execute("SELECT name FROM variables WHERE file_path = ?",
+                                                    (str(path.Path(file_path).resolve()),))}
+        return [var for var in read_vars if var not in names]
@@ -0,0 +1,290 @@
+import pandas as pd
+import numpy as np
+
+def _group(cell_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    _group groups samples by cell id.
+
+    :param cell_ids: An int array of cell ids, one per sample
+
+    :return: Returns a tuple of (the sorted unique cell ids, the index of each sample's cell in the unique ids, the
+             order that sorts the samples by cell).
+    """
+    keys, inverse = np.unique(cell_ids, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    return keys, inverse, order
+
+class cell_stats:
+    """
+    cell_stats is a sparse accumulator of per-grid-cell statistics (count, mean, variance, min and max) of flight
+    variables. Only cells that samples have been added to are stored, so memory scales with the number of visited cells,
+    not with the model grid or the number of samples.
+
+    Batches of samples are added with add(), which reduces each batch by cell with vectorized group-bys and then
+    combines it with what has been accumulated so far using Chan et al.'s parallel algorithm for the mean and variance.
+    The same combination is used by merge(), so partial accumulators (per flight, window or worker) can be reduced
+    independently and merged later with the same result as if all samples had been added to one accumulator.
+    NaN samples are ignored, so counts can differ between variables.
+
+    The __init__ takes a list of variable names, e.g. ['WIC','ATX','EWX'].
+    The __init__ assigns:
+    self.variables: list[str]; the variable names
+    self.cell_ids: np.ndarray; the sorted int64 ids of the visited cells
+    self.count, self.mean, self.m2, self.min, self.max: dict[str,np.ndarray]; per-variable arrays, aligned with
+                                                         self.cell_ids, of the sample count, mean, sum of squared
+                                                         differences from the mean, minimum and maximum
+    """
+    def __init__(self, variables: list[str]):
+        self.variables = list(variables)
+        self.cell_ids = np.zeros(0, dtype=np.int64)
+        self.count = {var: np.zeros(0, dtype=np.int64) for var in self.variables}
+        self.mean = {var: np.zeros(0) for var in self.variables}
+        self.m2 = {var: np.zeros(0) for var in self.variables}
+        self.min = {var: np.zeros(0) for var in self.variables}
+        self.max = {var: np.zeros(0) for var in self.variables}
+
+    def __len__(self) -> int:
+        return len(self.cell_ids)
+
+    def add(self, cell_ids: np.ndarray, data):
+        """
+        add accumulates a batch of samples.
+
+        :param cell_ids: An int array of cell ids, one per sample, e.g. from mapping_utils.calc_cell_ids. Samples with
+                         negative ids (not in any cell) are skipped.
+        :param data: A DataFrame or dictionary holding a column/array of samples for each of self.variables
+        """
+        cell_ids = np.asarray(cell_ids)
+        in_cell = cell_ids >= 0
+        batch = cell_stats(self.variables)
+        batch.cell_ids, inverse, order = _group(cell_ids[in_cell])
+        if len(batch.cell_ids) == 0:
+            return
+        starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+        ncells = len(batch.cell_ids)
+
+        for var in self.variables:
+            x = np.asarray(data[var], dtype=np.float64)[in_cell]
+            finite = np.isfinite(x)
+            x0 = np.where(finite, x, 0.)
+
+            count = np.bincount(inverse, weights=finite, minlength=ncells)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.bincount(inverse, weights=x0, minlength=ncells)/count
+            mean[count == 0] = 0.
+            dev = np.where(finite, x0 - mean[inverse], 0.)
+            batch.count[var] = count.astype(np.int64)
+            batch.mean[var] = mean
+            batch.m2[var] = np.bincount(inverse, weights=dev*dev, minlength=ncells)
+            # fmin/fmax ignore NaNs, so only cells with no finite samples get NaN
+            batch.min[var] = np.fmin.reduceat(x[order], starts)
+            batch.max[var] = np.fmax.reduceat(x[order], starts)
+
+        self.merge(batch)
+
+    def merge(self, other: 'cell_stats'):
+        """
+        merge combines another accumulator of the same variables into this one.
+
+        :param other: A cell_stats with the same variables
+        """
+        if other.variables != self.variables:
+            raise ValueError(f"Cannot merge statistics of {other.variables} into statistics of {self.variables}")
+
+        keys = np.union1d(self.cell_ids, other.cell_ids)
+        ia = np.searchsorted(keys, self.cell_ids)
+        ib = np.searchsorted(keys, other.cell_ids)
+
+        for var in self.variables:
+            na = np.zeros(len(keys), dtype=np.int64)
+            nb = np.zeros(len(keys), dtype=np.int64)
+            ma = np.zeros(len(keys))
+            mb = np.zeros(len(keys))
+            na[ia] = self.count[var]
+            nb[ib] = other.count[var]
+            ma[ia] = self.mean[var]
+            mb[ib] = other.mean[var]
+            m2 = np.zeros(len(keys))
+            m2[ia] += self.m2[var]
+            m2[ib] += other.m2[var]
+
+            # Chan et al.: combine the means and sums of squared differences of the two partitions
+            n = na + nb
+            with np.errstate(invalid='ignore', divide='ignore'):
+                frac_b = np.where(n > 0, nb/n, 0.)
+            delta = mb - ma
+            self.count[var] = n
+            self.mean[var] = ma + delta*frac_b
+            self.m2[var] = m2 + delta*delta*na*frac_b
+
+            vmin = np.full(len(keys), np.nan)
+            vmax = np.full(len(keys), np.nan)
+            vmin[ia] = self.min[var]
+            vmax[ia] = self.max[var]
+            vmin[ib] = np.fmin(vmin[ib], other.min[var])
+            vmax[ib] = np.fmax(vmax[ib], other.max[var])
+            self.min[var] = vmin
+            self.max[var] = vmax
+
+        self.cell_ids = keys
+
+    def to_dataframe(self, grid_shape: tuple[int,int,int,int] = None, ddof: int = 0) -> pd.DataFrame:
+        """
+        to_dataframe returns the accumulated statistics as a DataFrame indexed by cell id.
+
+        :param grid_shape: The (ntime, nlev, nlat, nlon) shape of the model grid. Optional. If given, columns of
+                           time_idx, lev_idx, lat_idx and lon_idx are added.
+        :param ddof: The delta degrees of freedom of the variance. Optional. Default is 0, the population variance.
+
+        :return: Returns a DataFrame with columns <var>_count, <var>_mean, <var>_var, <var>_min and <var>_max for
+                 each variable. Statistics of cells without finite samples of a variable are NaN.
+        """
+        columns = {}
+        if grid_shape is not None:
+            for name, idx in zip(['time_idx','lev_idx','lat_idx','lon_idx'],
+                                 np.unravel_index(self.cell_ids, grid_shape)):
+                columns[name] = idx
+        for var in self.variables:
+            count = self.count[var]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                columns[f"{var}_count"] = count
+                columns[f"{var}_mean"] = np.where(count > 0, self.mean[var], np.nan)
+                columns[f"{var}_var"] = np.where(count > ddof, self.m2[var]/(count - ddof), np.nan)
+            columns[f"{var}_min"] = self.min[var]
+            columns[f"{var}_max"] = self.max[var]
+        return pd.DataFrame(columns, index=pd.Index(self.cell_ids, name='cell_id'))
+
+class cell_histogram:
+    """
+    cell_histogram is a sparse accumulator of per-grid-cell histograms of a flight variable, from which per-cell
+    quantiles (e.g. 5th, 50th, 95th percentiles) and PDFs are estimated. Each visited cell holds exactly
+    len(edges)+1 int64 counts (the bins plus an underflow and an overflow bin), so memory per cell has a hard bound
+    regardless of how many samples fall in it.
+
+    Batches of samples are binned with add() using vectorized searchsorted/bincount. Histograms of the same edges merge
+    exactly by adding counts, so partial accumulators (per flight, window or worker) can be reduced independently and
+    merged later with merge(). NaN samples are ignored.
+
+    The __init__ takes a variable name, e.g. 'WIC', and a 1-D array of increasing bin edges, e.g.
+    np.linspace(-10, 10, 201) for 0.1 m/s bins of vertical velocity.
+    The __init__ assigns:
+    self.variable: str; the variable name
+    self.edges: np.ndarray; the bin edges
+    self.cell_ids: np.ndarray; the sorted int64 ids of the visited cells
+    self.counts: np.ndarray; a (ncells by nbins+2) int64 array of counts, aligned with self.cell_ids. Column 0 counts
+                 samples below edges[0], and the last column samples above edges[-1].
+    """
+    def __init__(self, variable: str, edges: np.ndarray):
+        self.variable = variable
+        self.edges = np.asarray(edges, dtype=np.float64)
+        if self.edges.ndim != 1 or len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0):
+            raise ValueError("edges must be a 1-D array of at least 2 increasing values")
+        self.cell_ids = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, len(self.edges)+1), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.cell_ids)
+
+    def nbytes(self) -> int:
+        """
+        nbytes returns the memory held by the cell ids and counts in bytes.
+        """
+        return self.cell_ids.nbytes + self.counts.nbytes
+
+    def add(self, cell_ids: np.ndarray, data):
+        """
+        add bins a batch of samples.
+
+        :param cell_ids: An int array of cell ids, one per sample, e.g. from mapping_utils.calc_cell_ids. Samples with
+                         negative ids (not in any cell) are skipped.
+        :param data: A DataFrame or dictionary holding a column/array of samples of self.variable
+        """
+        x = np.asarray(data[self.variable], dtype=np.float64)
+        cell_ids = np.asarray(cell_ids)
+        keep = (cell_ids >= 0) & ~np.isnan(x)
+        x = x[keep]
+
+        batch = cell_histogram(self.variable, self.edges)
+        batch.cell_ids, inverse = np.unique(cell_ids[keep], return_inverse=True)
+        nbins = len(self.edges) + 1
+        bins = np.searchsorted(self.edges, x, side='right')
+        bins[x == self.edges[-1]] = nbins - 2 # the last edge belongs to the last bin
+        batch.counts = np.bincount(inverse*nbins + bins, minlength=len(batch.cell_ids)*nbins) \
+                         .reshape(len(batch.cell_ids), nbins).astype(np.int64)
+        self.merge(batch)
+
+    def merge(self, other: 'cell_histogram'):
+        """
+        merge adds the counts of another histogram accumulator with the same edges into this one.
+
+        :param other: A cell_histogram with the same edges
+        """
+        if not np.array_equal(other.edges, self.edges):
+            raise ValueError("Cannot merge histograms with different bin edges")
+        keys = np.union1d(self.cell_ids, other.cell_ids)
+        counts = np.zeros((len(keys), self.counts.shape[1]), dtype=np.int64)
+        counts[np.searchsorted(keys, self.cell_ids)] += self.counts
+        counts[np.searchsorted(keys, other.cell_ids)] += other.counts
+        self.cell_ids = keys
+        self.counts = counts
+
+    def quantiles(self, qs: list[float]) -> np.ndarray:
+        """
+        quantiles estimates per-cell quantiles by linear interpolation within the histogram bins.
+
+        :param qs: A list of quantiles between 0 and 1, e.g. [0.05, 0.5, 0.95]
+
+        :return: Returns a (ncells by len(qs)) array of quantile estimates. Quantiles that fall in the underflow or
+                 overflow bin are returned as edges[0] or edges[-1], respectively.
+        """
+        qs = np.asarray(qs, dtype=np.float64)
+        cum = np.cumsum(self.counts, axis=1)
+        total = cum[:,-1]
+        out = np.full((len(self.cell_ids), len(qs)), np.nan)
+        rows = np.arange(len(self.cell_ids))
+        for k, q in enumerate(qs):
+            target = q*total
+            # the first bin whose cumulative count reaches the target (the first non-empty bin for q = 0)
+            bins = np.where(target > 0, (cum < target[:,None]).sum(axis=1), (cum == 0).sum(axis=1))
+            bins = np.minimum(bins, self.counts.shape[1] - 1)
+            below = np.where(bins > 0, cum[rows, np.maximum(bins - 1, 0)], 0)
+            in_bin = self.counts[rows, bins]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                frac = np.where(in_bin > 0, (target - below)/in_bin, 0.)
+            lower = self.edges[np.clip(bins - 1, 0, len(self.edges) - 1)]
+            upper = self.edges[np.clip(bins, 0, len(self.edges) - 1)]
+            out[:,k] = np.where(total > 0, lower + frac*(upper - lower), np.nan)
+        return out
+
+    def pdf(self) -> np.ndarray:
+        """
+        pdf returns the per-cell probability density of the samples within the bin edges.
+
+        :return: Returns a (ncells by nbins) array of densities, normalized by all (including under- and overflow)
+                 samples of the cell, so it integrates to the fraction of samples within the edges.
+        """
+        total = self.counts.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.counts[:,1:-1]/np.diff(self.edges)[None,:]/total[:,None]
+
+    def to_dataframe(self, qs: tuple[float,...] = (0.05, 0.5, 0.95),
+                     grid_shape: tuple[int,int,int,int] = None) -> pd.DataFrame:
+        """
+        to_dataframe returns per-cell sample counts and quantile estimates as a DataFrame indexed by cell id.
+
+        :param qs: A sequence of quantiles between 0 and 1. Optional. Default is the 5th, 50th and 95th percentiles.
+        :param grid_shape: The (ntime, nlev, nlat, nlon) shape of the model grid. Optional. If given, columns of
+                           time_idx, lev_idx, lat_idx and lon_idx are added.
+
+        :return: Returns a DataFrame with columns <var>_count and <var>_q<percent> for each quantile, e.g. WIC_q05.
+        """
+        columns = {}
+        if grid_shape is not None:
+            for name, idx in zip(['time_idx','lev_idx','lat_idx','lon_idx'],
+                                 np.unravel_index(self.cell_ids, grid_shape)):
+                columns[name] = idx
+        columns[f"{self.variable}_count"] = self.counts.sum(axis=1)
+        quantiles = self.quantiles(qs)
+        for k, q in enumerate(qs):
+            columns[f"{self.variable}_q{100*q:02g}"] = quantiles[:,k]
+        return pd.DataFrame(columns, index=pd.Index(self.cell_ids, name='cell_id'))
@@ -0,0 +1,112 @@
+import netCDF4
+import numpy as np
+
+def write_flight_nc(file_path: str, duration: int = 3600, hz: int = 25, n_hr_vars: int = 6,
+                    start: str = '2018-02-17 00:00:00', seed: int = 0, gps: bool = True):
+    """
+    write_flight_nc writes a synthetic RAF-style flight file: a smooth track with a climb, cruise and descent, 1 Hz
+                    position variables and high rate (hz) turbulence-like variables with a few masked samples.
+
+    :param file_path: A path string to the file to write
+    :param duration: The length of the flight in seconds. Optional. Default is 3600.
+    :param hz: The rate of the high rate variables. Optional. Default is 25. With hz=1, every variable is 1 Hz.
+    :param n_hr_vars: The number of high rate variables. The first six are named like RAF variables (UIC, VIC, WIC,
+                      ATX, PSFC, EWX), the rest X007, X008, ... Optional. Default is 6.
+    :param start: The takeoff time (UTC). Optional.
+    :param seed: The random seed. Optional.
+    :param gps: If False, the GPS position variables GGLAT and GGLON are left out, as in some older campaigns' files.
+                Optional. Default is True.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(duration, dtype=np.float64)
+
+    # a track heading off in a slowly wandering direction at 200 m/s
+    heading = np.radians(135.) + np.cumsum(rng.normal(0, 0.002, duration))
+    lat = -42.9 + np.cumsum(200*np.cos(heading))/111e3
+    lon = 147.5 + np.cumsum(200*np.sin(heading))/(111e3*np.cos(np.radians(lat)))
+    lon = (lon + 180) % 360 - 180
+    # climb for 20 minutes, cruise at 6 km, and descend over the last 20 minutes
+    ramp = min(1200., duration/2)
+    alt = 6000*np.clip(np.minimum(t, duration - 1 - t)/ramp, 0, 1) + 10*rng.standard_normal(duration)
+
+    with netCDF4.Dataset(file_path, 'w') as nc:
+        nc.project = 'BENCH'
+        nc.FlightNumber = 'rf01'
+        nc.createDimension('Time', duration)
+        time = nc.createVariable('Time', 'i4', ('Time',))
+        time.units = f'seconds since {start} +0000'
+        time[:] = t
+        for name, data, units in [('GGLAT', lat, 'degree_N'), ('GGLON', lon, 'degree_E'), ('GGALT', alt, 'm'),
+                                  ('LATC', lat, 'degree_N'), ('LONC', lon, 'degree_E')]:
+            if not gps and name in ['GGLAT','GGLON']:
+                continue
+            ncvar = nc.createVariable(name, 'f4', ('Time',), fill_value=-32767.)
+            ncvar.units = units
+            ncvar[:] = data
+
+        dims = ('Time',)
+        if hz > 1:
+            nc.createDimension(f'sps{hz}', hz)
+            dims = ('Time', f'sps{hz}')
+        names = ['UIC','VIC','WIC','ATX','PSFC','EWX'] + [f'X{k:03d}' for k in range(7, n_hr_vars + 1)]
+        for name in names[:n_hr_vars]:
+            ncvar = nc.createVariable(name, 'f4', dims, fill_value=-32767.)
+            data = np.cumsum(rng.standard_normal(duration*hz)).reshape(duration, hz)*0.01 + rng.standard_normal()
+            data[rng.random(data.shape) < 1e-4] = -32767. # a few missing samples
+            ncvar[:] = data.squeeze() if hz == 1 else data
+
+def write_cam_nc(file_path: str, ntimes: int = 4, nlev: int = 32, nlat: int = 192, nlon: int = 288,
+                 start: str = '2018-01-01 00:00:00', seed: int = 0):
+    """
+    write_cam_nc writes a synthetic CAM history file on a regular lat/lon grid with the fields needed for hydrostatic
+                 interface heights: time, lat, lon, hyai, hybi, hyam, hybm, P0, PS, PHIS, T and Q, in CAM order (model
+                 top first), with 6-hourly output, and the midpoint geopotential heights Z3 consistent with them.
+
+    :param file_path: A path string to the file to write
+    :param ntimes: The number of output times. Optional. Default is 4.
+    :param nlev: The number of model levels. Optional. Default is 32.
+    :param nlat: The number of latitudes. Optional. Default is 192.
+    :param nlon: The number of longitudes. Optional. Default is 288.
+    :param start: The first output time (noleap calendar). Optional.
+    :param seed: The random seed. Optional.
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-90., 90., nlat)
+    lon = np.arange(nlon)*360./nlon
+    # hybrid coefficients going from pure pressure near the 2 hPa model top to terrain following at the surface
+    eta = np.linspace(0, 1, nlev + 1)**1.5*0.998 + 0.002
+    hybi = np.clip((eta - 0.2)/0.8, 0, 1)**1.3
+    hyai = eta - hybi
+
+    lat2d, lon2d = np.meshgrid(lat, lon, indexing='ij')
+    phis = np.maximum(0, 3000*np.sin(np.radians(lon2d))*np.cos(np.radians(lat2d)))*9.8067
+    ps = 101325*np.exp(-phis/9.8067/8000)[None]*(1 + 0.01*rng.standard_normal((ntimes, nlat, nlon)))
+    pm = (0.5*(hyai[1:] + hyai[:-1])*1e5)[None,:,None,None] + (0.5*(hybi[1:] + hybi[:-1]))[None,:,None,None]*ps[:,None]
+    tk = np.maximum(200, 288 + 6.5e-3*8000*np.log(pm/101325)) + rng.standard_normal(pm.shape)
+    q = 0.01*(pm/101325)**3
+    # midpoint geopotential heights from the hypsometric equation, integrated up from the surface
+    pi = (hyai*1e5)[None,:,None,None] + hybi[None,:,None,None]*ps[:,None]
+    tv_rd_g = 287.04*tk*(1 + 0.608*q)/9.8067
+    dz = tv_rd_g*np.log(pi[:,1:]/pi[:,:-1]) # layer thicknesses, model top first
+    zi_below = phis[None,None]/9.8067 + np.cumsum(dz[:,::-1], axis=1)[:,::-1] - dz # the interface below each level
+    z3 = zi_below + tv_rd_g*np.log(pi[:,1:]/pm)
+
+    with netCDF4.Dataset(file_path, 'w') as nc:
+        for name, size in [('time', None), ('lev', nlev), ('ilev', nlev + 1), ('lat', nlat), ('lon', nlon)]:
+            nc.createDimension(name, size)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = f'days since {start}'
+        time.calendar = 'noleap'
+        time[:] = np.arange(ntimes)/4.
+        nc.createVariable('lat', 'f8', ('lat',))[:] = lat
+        nc.createVariable('lon', 'f8', ('lon',))[:] = lon
+        nc.createVariable('hyai', 'f8', ('ilev',))[:] = hyai
+        nc.createVariable('hybi', 'f8', ('ilev',))[:] = hybi
+        nc.createVariable('hyam', 'f8', ('lev',))[:] = 0.5*(hyai[1:] + hyai[:-1])
+        nc.createVariable('hybm', 'f8', ('lev',))[:] = 0.5*(hybi[1:] + hybi[:-1])
+        nc.createVariable('P0', 'f8')[...] = 100000.
+        nc.createVariable('PHIS', 'f4', ('time','lat','lon'))[:] = np.repeat(phis[None], ntimes, axis=0)
+        nc.createVariable('PS', 'f4', ('time','lat','lon'))[:] = ps
+        nc.createVariable('T', 'f4', ('time','lev','lat','lon'))[:] = tk
+        nc.createVariable('Q', 'f4', ('time','lev','lat','lon'))[:] = q
+        nc.createVariable('Z3', 'f4', ('time','lev','lat','lon'))[:] = z3